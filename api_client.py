@@ -0,0 +1,225 @@
+"""
+Klient API serwera (nagłówek X-Device-UID) oparty o requests.Session.
+
+Jedna sesja trzyma otwarte połączenia (keep-alive), więc kolejne wysyłki
+nie płacą za nowy handshake TCP/TLS. Opcjonalnie kilka zdjęć twarzy
+może pójść jednym żądaniem multipart.
+"""
+
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from logger import get_logger
+
+load_dotenv()
+
+REMOTE_SERVER_URL = os.getenv("REMOTE_SERVER_URL")
+DEVICE_UID = os.getenv("DEVICE_UID")
+
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", 4))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", 5))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", 10))
+# 1 = każda twarz osobnym żądaniem (bez batchowania)
+FACE_BATCH_SIZE = int(os.getenv("FACE_BATCH_SIZE", 1))
+
+VIDEO_INFO_ENDPOINT = "videos/save-info-about-video/"
+FACE_ENDPOINT = "analyze/upload-face-to-analyze/"
+FACE_BATCH_ENDPOINT = os.getenv("FACE_BATCH_ENDPOINT", "analyze/upload-faces-to-analyze/")
+VIDEO_UPLOAD_ENDPOINT = os.getenv("VIDEO_UPLOAD_ENDPOINT", "videos/upload/")
+
+# Czas odczytu odpowiedzi dla poszczególnych endpointów (sekundy)
+ENDPOINT_READ_TIMEOUTS = {
+    VIDEO_INFO_ENDPOINT: 5,
+    FACE_ENDPOINT: 15,
+    FACE_BATCH_ENDPOINT: 30,
+    VIDEO_UPLOAD_ENDPOINT: 60,
+}
+
+logger = get_logger("api_client")
+
+
+class DeviceApiClient:
+    def __init__(self, base_url=REMOTE_SERVER_URL, device_uid=DEVICE_UID,
+                 pool_size=API_POOL_SIZE, face_batch_size=FACE_BATCH_SIZE):
+        self.base_url = base_url
+        self.device_uid = device_uid
+        self.pool_size = pool_size
+        self.face_batch_size = max(1, face_batch_size)
+        self.lock = threading.Lock()
+        self._session = None
+
+    @property
+    def session(self):
+        """
+        Sesja tworzona przy pierwszym żądaniu - import requests (~0,5 s na Pi)
+        odbywa się w wątku wysyłki, a nie przy starcie workera.
+        """
+        if self._session is None:
+            with self.lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers.update({"X-Device-UID": self.device_uid or ""})
+                    self._session = session
+        return self._session
+
+    def timeout(self, endpoint):
+        return API_CONNECT_TIMEOUT, ENDPOINT_READ_TIMEOUTS.get(endpoint, API_READ_TIMEOUT)
+
+    def post_json(self, endpoint, data):
+        return self.session.post(
+            self.base_url + endpoint,
+            json=data,
+            timeout=self.timeout(endpoint),
+        )
+
+    def post_file(self, endpoint, data, content, filename, content_type):
+        return self.session.post(
+            self.base_url + endpoint,
+            data=data,
+            files={"file": (filename, content, content_type)},
+            timeout=self.timeout(endpoint),
+        )
+
+    def upload_faces(self, faces):
+        """
+        Wysyła kilka zdjęć jednym żądaniem multipart.
+
+        Args:
+            faces: lista (recorded_at, content, filename)
+        """
+        data = [("recorded_at", recorded_at) for recorded_at, _, _ in faces]
+        files = [("files", (filename, content, "image/jpeg")) for _, content, filename in faces]
+        return self.session.post(
+            self.base_url + FACE_BATCH_ENDPOINT,
+            data=data,
+            files=files,
+            timeout=self.timeout(FACE_BATCH_ENDPOINT),
+        )
+
+    def start_video_upload(self, data):
+        """
+        Zakłada (lub wznawia) wysyłkę pliku wideo w kawałkach.
+        Odpowiedź: {"upload_id": ..., "offset": bajty już zapisane na serwerze}
+        """
+        return self.post_json(VIDEO_UPLOAD_ENDPOINT, data)
+
+    def video_upload_offset(self, upload_id):
+        """Ile bajtów serwer już ma - źródło prawdy przy wznawianiu"""
+        return self.session.get(
+            f"{self.base_url}{VIDEO_UPLOAD_ENDPOINT}{upload_id}/",
+            timeout=self.timeout(VIDEO_UPLOAD_ENDPOINT),
+        )
+
+    def upload_video_chunk(self, upload_id, offset, body, length, total):
+        """
+        Wysyła kawałek [offset, offset + length) pliku o rozmiarze total.
+        `body` może być obiektem z read() (np. z limitem przepustowości).
+        """
+        return self.session.put(
+            f"{self.base_url}{VIDEO_UPLOAD_ENDPOINT}{upload_id}/",
+            data=body,
+            headers={
+                "Content-Type": "application/octet-stream",
+                "Content-Length": str(length),
+                "Content-Range": f"bytes {offset}-{offset + length - 1}/{total}",
+            },
+            timeout=self.timeout(VIDEO_UPLOAD_ENDPOINT),
+        )
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+def benchmark(count=50, size=20 * 1024, batch=5):
+    """Porównanie requests.post, sesji z keep-alive i batchowania na lokalnym serwerze"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import requests
+
+    stats = {"connections": 0, "requests": 0}
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Jak prawdziwy serwer: bez TCP_NODELAY odpowiedź na keep-alive czeka ~40 ms na opóźnione ACK
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            stats["connections"] += 1
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            stats["requests"] += 1
+            body = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    content = os.urandom(size)
+
+    def run(label, send):
+        stats["connections"] = stats["requests"] = 0
+        start = time.perf_counter()
+        send()
+        elapsed = time.perf_counter() - start
+        print(
+            f"{label:<18} {elapsed / count * 1000:>8.2f} ms/zdjęcie "
+            f"{stats['connections']:>5} połączeń {stats['requests']:>5} żądań"
+        )
+
+    def plain():
+        for i in range(count):
+            requests.post(
+                base_url + FACE_ENDPOINT,
+                data={"recorded_at": str(i)},
+                files={"file": (f"{i}.jpg", content, "image/jpeg")},
+                headers={"X-Device-UID": "bench"},
+                timeout=10,
+            ).raise_for_status()
+
+    def pooled():
+        client = DeviceApiClient(base_url, "bench")
+        for i in range(count):
+            client.post_file(FACE_ENDPOINT, {"recorded_at": str(i)}, content,
+                             f"{i}.jpg", "image/jpeg").raise_for_status()
+        client.close()
+
+    def batched():
+        client = DeviceApiClient(base_url, "bench", face_batch_size=batch)
+        faces = [(str(i), content, f"{i}.jpg") for i in range(count)]
+        for i in range(0, count, batch):
+            client.upload_faces(faces[i:i + batch]).raise_for_status()
+        client.close()
+
+    run("requests.post", plain)
+    run("sesja keep-alive", pooled)
+    run(f"batch po {batch}", batched)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark klienta API na lokalnym serwerze")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--size", type=int, default=20 * 1024, help="rozmiar zdjęcia w bajtach")
+    parser.add_argument("--batch", type=int, default=5)
+    args = parser.parse_args()
+    benchmark(args.count, args.size, args.batch)
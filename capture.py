@@ -0,0 +1,380 @@
+"""
+Alternatywne źródła klatek dla MotionRecorder.capture_frames.
+
+Klasy udają interfejs cv2.VideoCapture (isOpened/read/set/release),
+więc pętla przechwytywania się nie zmienia.
+"""
+
+import functools
+import os
+import re
+import subprocess
+import threading
+import time
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from logger import get_logger
+from uniwersal import backoff_delay
+from supervisor import write_pid_file, remove_pid_file
+import metrics
+
+load_dotenv()
+
+MOTION_WIDTH = int(os.getenv("MOTION_WIDTH", 320))
+MOTION_HEIGHT = int(os.getenv("MOTION_HEIGHT", 240))
+FRAME_WIDTH = int(os.getenv("FRAME_WIDTH", 1920))
+FRAME_HEIGHT = int(os.getenv("FRAME_HEIGHT", 1080))
+# opencv = pełne klatki z cv2.VideoCapture, opencv_lazy = grab() w pętli i retrieve() na żądanie,
+# ffmpeg_pipe = pomniejszone klatki z ffmpeg
+CAPTURE_BACKEND = os.getenv("CAPTURE_BACKEND", "opencv")
+CAPTURE_PIPE_FPS = float(os.getenv("CAPTURE_PIPE_FPS", 5))
+# pełne klatki (do wykrywania twarzy) z ffmpeg_pipe na sekundę - tyle najwyżej są starsze od próbki ruchu
+CAPTURE_PIPE_FULL_FPS = float(os.getenv("CAPTURE_PIPE_FULL_FPS", 1))
+# Nadzór strumienia: brak klatek dłużej niż CAPTURE_STALL_SECONDS = ponowne otwarcie,
+# kolejne próby co CAPTURE_RETRY_BASE * 2^n s (z rozrzutem), najwyżej co CAPTURE_RETRY_MAX
+CAPTURE_STALL_SECONDS = float(os.getenv("CAPTURE_STALL_SECONDS", 10))
+CAPTURE_RETRY_BASE = float(os.getenv("CAPTURE_RETRY_BASE", 1))
+CAPTURE_RETRY_MAX = float(os.getenv("CAPTURE_RETRY_MAX", 60))
+# co tyle nieudanych prób sprawdzany (i w razie potrzeby uruchamiany) jest mediamtx
+CAPTURE_MEDIAMTX_AFTER = int(os.getenv("CAPTURE_MEDIAMTX_AFTER", 3))
+
+logger = get_logger("capture")
+
+
+def reconnect_delay(attempt, base=CAPTURE_RETRY_BASE, maximum=CAPTURE_RETRY_MAX):
+    """Odstęp przed ponownym otwarciem strumienia - kilka kamer nie łączy się naraz po awarii mediamtx"""
+    return backoff_delay(attempt, base, maximum)
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_major_version():
+    """Główny numer wersji ffmpeg albo None (brak ffmpeg, kompilacja z gita)"""
+    try:
+        output = subprocess.run(
+            ["ffmpeg", "-version"], capture_output=True, text=True, timeout=10
+        ).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    match = re.match(r"ffmpeg version n?(\d+)\.", output)
+    return int(match.group(1)) if match else None
+
+
+def stream_timeout_args(stream_url, seconds):
+    """
+    Opcje ffmpeg ograniczające czas oczekiwania na dane ze strumienia.
+
+    W ffmpeg < 5 (Raspberry Pi OS Bullseye) `-timeout` dla RTSP oznacza czekanie
+    na połączenie przychodzące (tryb serwera), a limit gniazda to `-stimeout`;
+    od ffmpeg 5 `-stimeout` nazywa się `-timeout`. Pozostałe protokoły: `-rw_timeout`.
+    """
+    microseconds = str(int(seconds * 1_000_000))
+    if stream_url.startswith(("rtsp://", "rtsps://")):
+        major = ffmpeg_major_version()
+        return ["-stimeout" if major is not None and major < 5 else "-timeout", microseconds]
+    return ["-rw_timeout", microseconds]
+
+
+def open_opencv_capture(stream_url, api_preference=cv2.CAP_FFMPEG, timeout=CAPTURE_STALL_SECONDS):
+    """
+    cv2.VideoCapture z limitem czasu otwarcia i odczytu - zawieszony strumień
+    kończy read()/grab() błędem zamiast blokować wątek przechwytywania.
+    """
+    timeout_ms = int(timeout * 1000)
+    cap = cv2.VideoCapture(stream_url, api_preference, [
+        cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms,
+        cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms,
+    ])
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+
+class FFmpegPipeCapture:
+    """
+    ffmpeg dekoduje strumień, zmniejsza go i ogranicza liczbę klatek
+    zanim cokolwiek trafi do Pythona.
+
+    Wyjście 1 (stdout): klatki MOTION_WIDTH x MOTION_HEIGHT w skali szarości,
+    CAPTURE_PIPE_FPS na sekundę - do detekcji ruchu.
+    Wyjście 2 (osobny pipe): pełna rozdzielczość BGR, CAPTURE_PIPE_FULL_FPS
+    na sekundę - do wykrywania twarzy, odbierane przez full_frame() razem
+    z czasem odbioru, żeby nie użyć klatki starszej od próbki ruchu.
+    """
+
+    scaled = True
+
+    def __init__(self, stream_url, fps=CAPTURE_PIPE_FPS, width=MOTION_WIDTH, height=MOTION_HEIGHT,
+                 full_width=FRAME_WIDTH, full_height=FRAME_HEIGHT, full_fps=CAPTURE_PIPE_FULL_FPS, pid_file=None):
+        self.stream_url = stream_url
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.full_width = full_width
+        self.full_height = full_height
+        self.full_fps = min(full_fps, fps)
+        # PID ffmpeg - po zabiciu workera kolejny kończy pozostały proces
+        self.pid_file = pid_file
+
+        self.frame_bytes = width * height
+        self.full_frame_bytes = full_width * full_height * 3
+
+        self.proc = None
+        self.full_pipe = None
+        self.full_thread = None
+        self.full_lock = threading.Lock()
+        # (time.time odbioru, klatka)
+        self.latest_full = None
+        self.released = False
+        self._spawn()
+
+    def _spawn(self):
+        read_fd, write_fd = os.pipe()
+        cmd = [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-rtsp_transport", "tcp",
+            # Limit czasu gniazda: zawieszony strumień kończy ffmpeg, read() zwraca błąd
+            *stream_timeout_args(self.stream_url, CAPTURE_STALL_SECONDS),
+            "-i", self.stream_url,
+            "-map", "0:v:0",
+            "-vf", f"fps={self.fps},scale={self.width}:{self.height}",
+            "-pix_fmt", "gray",
+            "-f", "rawvideo",
+            "pipe:1",
+            "-map", "0:v:0",
+            "-vf", f"fps={self.full_fps},scale={self.full_width}:{self.full_height}",
+            "-pix_fmt", "bgr24",
+            "-f", "rawvideo",
+            f"pipe:{write_fd}",
+        ]
+        metrics.counter("watchdog_ffmpeg_spawns_total", "Uruchomienia procesów ffmpeg", {"role": "capture"}).inc()
+        try:
+            self.proc = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                stdin=subprocess.DEVNULL,
+                pass_fds=(write_fd,),
+            )
+        finally:
+            os.close(write_fd)
+        write_pid_file(self.pid_file, self.proc.pid)
+
+        self.full_pipe = os.fdopen(read_fd, "rb")
+        self.full_thread = threading.Thread(target=self._read_full_frames, args=(self.full_pipe,), daemon=True)
+        self.full_thread.start()
+        logger.info(
+            f"ffmpeg pipe: {self.width}x{self.height} gray @ {self.fps} fps, "
+            f"pełne klatki @ {self.full_fps} fps (PID: {self.proc.pid})"
+        )
+
+    def _read_full_frames(self, pipe):
+        while True:
+            data = pipe.read(self.full_frame_bytes)
+            if len(data) < self.full_frame_bytes:
+                break
+            frame = np.frombuffer(data, np.uint8).reshape(self.full_height, self.full_width, 3)
+            with self.full_lock:
+                self.latest_full = (time.time(), frame)
+        pipe.close()
+
+    def _kill(self):
+        if self.proc and self.proc.poll() is None:
+            try:
+                self.proc.terminate()
+                self.proc.wait(timeout=3)
+            except Exception:
+                self.proc.kill()
+
+    def isOpened(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def set(self, prop, value):
+        return True
+
+    def read(self):
+        # Zerwany strumień otwiera ponownie nadzór w capture_frames (z odstępem i rozrzutem)
+        if self.released or not self.isOpened():
+            return False, None
+
+        data = self.proc.stdout.read(self.frame_bytes)
+        if len(data) < self.frame_bytes:
+            self._kill()
+            return False, None
+        return True, np.frombuffer(data, np.uint8).reshape(self.height, self.width)
+
+    def full_frame(self, not_before=None):
+        """
+        Ostatnia klatka w pełnej rozdzielczości (BGR) albo None.
+
+        Args:
+            not_before: czas próbki ruchu - odrzucana jest klatka starsza o więcej
+                niż odstęp pełnych klatek (plus jedna próbka ruchu na opóźnienie pipe)
+        """
+        with self.full_lock:
+            latest = self.latest_full
+        if latest is None:
+            return None
+        received_at, frame = latest
+        if not_before is not None and received_at < not_before - 1 / self.full_fps - 1 / self.fps:
+            return None
+        return frame
+
+    def release(self):
+        self.released = True
+        self._kill()
+        remove_pid_file(self.pid_file)
+
+
+class LazyOpenCVCapture:
+    """
+    cv2.VideoCapture, w którym wątek przechwytywania wywołuje tylko grab(),
+    żeby strumień był na bieżąco, a konwersja do BGR i kopia klatki
+    (retrieve()) odbywa się dopiero, gdy konsument o nią poprosi.
+
+    grab() może blokować do CAP_PROP_READ_TIMEOUT_MSEC, więc działa poza
+    blokadą - retrieve() czeka na jego koniec najwyżej `timeout` s.
+    Oba wywołania nie dotykają VideoCapture jednocześnie (flaga grabbing),
+    a czekający retrieve() ma pierwszeństwo przed kolejnym grab().
+    """
+
+    lazy = True
+
+    def __init__(self, stream_url, api_preference=cv2.CAP_FFMPEG, cap=None):
+        """
+        Args:
+            cap: gotowy obiekt z grab()/retrieve() zamiast cv2.VideoCapture (np. odtwarzanie pliku)
+        """
+        self.cap = cap if cap is not None else open_opencv_capture(stream_url, api_preference)
+        self.cond = threading.Condition()
+        self.grabbing = False
+        self.retrieve_waiting = 0
+        self.grab_seq = 0
+        self.grab_time = None
+        self.retrieved_seq = 0
+        self.grabbed = 0
+        self.retrieved = 0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def grab(self, timestamp=None):
+        with self.cond:
+            # Pętla grab() bez tej przerwy zagłodziłaby czekający retrieve()
+            self.cond.wait_for(lambda: not self.retrieve_waiting)
+            self.grabbing = True
+        ok = False
+        try:
+            ok = self.cap.grab()
+        finally:
+            with self.cond:
+                self.grabbing = False
+                if ok:
+                    self.grab_seq += 1
+                    self.grabbed += 1
+                    self.grab_time = timestamp if timestamp is not None else time.time()
+                self.cond.notify_all()
+        return ok
+
+    def retrieve(self, timeout=1):
+        """
+        Czeka na klatkę nowszą niż ostatnio pobrana i ją dekoduje.
+
+        Returns:
+            (czas_grab, klatka) albo (None, None) po przekroczeniu czasu
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.grab_seq > self.retrieved_seq, timeout):
+                return None, None
+            # Klatka jest, ale grab() kolejnej może właśnie blokować VideoCapture
+            self.retrieve_waiting += 1
+            try:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not self.cond.wait_for(lambda: not self.grabbing, remaining):
+                    return None, None
+                ok, frame = self.cap.retrieve()
+                self.retrieved_seq = self.grab_seq
+            finally:
+                self.retrieve_waiting -= 1
+                self.cond.notify_all()
+            if not ok:
+                return None, None
+            self.retrieved += 1
+            return self.grab_time, frame
+
+    def read(self):
+        ok = self.grab()
+        if not ok:
+            return False, None
+        _, frame = self.retrieve(timeout=0)
+        return frame is not None, frame
+
+    def release(self):
+        with self.cond:
+            # release() woła wątek przechwytywania po grab(); retrieve() kończy się pod blokadą
+            self.cond.wait_for(lambda: not self.grabbing, CAPTURE_STALL_SECONDS)
+            self.cap.release()
+
+
+def benchmark(source, seconds=60, retrieve_interval=1.0):
+    """
+    Czas CPU przechwytywania: read() każdej klatki vs grab() + retrieve()
+    raz na `retrieve_interval` sekund, przeliczony na godzinę pracy.
+    """
+    results = {}
+    for mode in ("read", "grab"):
+        cap = LazyOpenCVCapture(source)
+        if not cap.isOpened():
+            raise RuntimeError(f"Nie można otworzyć {source}")
+        fps = cap.cap.get(cv2.CAP_PROP_FPS) or 25
+        is_file = os.path.exists(source)
+
+        frames = 0
+        start_wall = time.time()
+        start_cpu = time.process_time()
+        last_retrieve = 0
+        while time.time() - start_wall < seconds:
+            if mode == "read":
+                ok, _ = cap.read()
+            else:
+                ok = cap.grab()
+                if ok and time.time() - last_retrieve >= retrieve_interval:
+                    cap.retrieve(timeout=0)
+                    last_retrieve = time.time()
+            if not ok:
+                break
+            frames += 1
+            if is_file:
+                # Plik czytany w tempie strumienia na żywo
+                delay = start_wall + frames / fps - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+        wall = time.time() - start_wall
+        cpu = time.process_time() - start_cpu
+        cap.release()
+        results[mode] = cpu / wall * 3600 if wall else 0
+        print(f"{mode:<5} {frames:>6} klatek, {wall:6.1f}s, CPU {cpu:6.2f}s "
+              f"-> {results[mode]:8.0f} CPU-s/h")
+
+    saved = results["read"] - results["grab"]
+    print(f"Oszczędność: {saved:.0f} CPU-s na godzinę spokojnej sceny "
+          f"({saved / results['read'] * 100 if results['read'] else 0:.0f}%)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Koszt CPU read() vs grab()/retrieve()")
+    parser.add_argument("source", nargs="?", default=os.getenv("STREAM_URL"),
+                        help="adres strumienia lub plik wideo")
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--retrieve-interval", type=float,
+                        default=float(os.getenv("MOTION_CHECK_INTERVAL", 1)))
+    args = parser.parse_args()
+    benchmark(args.source, args.seconds, args.retrieve_interval)
@@ -0,0 +1,257 @@
+"""
+Sprawdzanie dostępu do sieci bez uruchamiania procesów (zamiast ping).
+
+Sonda to połączenie TCP do kilku adresów CONNECTIVITY_TARGETS naraz
+("host:port,host:port"); sieć jest dostępna, gdy odpowie co najmniej
+CONNECTIVITY_MIN_OK z nich. ConnectivityMonitor powtarza sondę co
+CONNECTIVITY_INTERVAL s w wątku w tle i zmienia stan dopiero po
+CONNECTIVITY_UP_AFTER kolejnych udanych / CONNECTIVITY_DOWN_AFTER
+nieudanych sondach - pojedyncza zgubiona sonda nie przełącza trybu.
+
+Z `link_check` (np. wifi_associated) sama awaria internetu nie zmienia
+stanu: łącze jest niedostępne dopiero, gdy nie ma ani internetu, ani
+połączenia z siecią WiFi.
+
+    python connectivity.py            # jedna sonda skonfigurowanych adresów
+    python connectivity.py --selftest # histereza na lokalnym serwerze
+"""
+
+import os
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from logger import get_logger
+
+load_dotenv()
+
+CONNECTIVITY_TARGETS = os.getenv("CONNECTIVITY_TARGETS", "8.8.8.8:53,1.1.1.1:53")
+CONNECTIVITY_TIMEOUT = float(os.getenv("CONNECTIVITY_TIMEOUT", 2))
+CONNECTIVITY_MIN_OK = int(os.getenv("CONNECTIVITY_MIN_OK", 1))
+CONNECTIVITY_INTERVAL = float(os.getenv("CONNECTIVITY_INTERVAL", 10))
+CONNECTIVITY_UP_AFTER = int(os.getenv("CONNECTIVITY_UP_AFTER", 2))
+CONNECTIVITY_DOWN_AFTER = int(os.getenv("CONNECTIVITY_DOWN_AFTER", 6))
+
+logger = get_logger("connectivity")
+
+
+def parse_targets(value):
+    """"host:port,host:port" -> lista (host, port)"""
+    targets = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, sep, port = entry.rpartition(":")
+        if not sep or not host:
+            raise ValueError(f"Niepoprawny adres w CONNECTIVITY_TARGETS: {entry}")
+        targets.append((host.strip("[]"), int(port)))
+    return targets
+
+
+def probe(host, port, timeout=CONNECTIVITY_TIMEOUT):
+    """
+    Returns:
+        czas nawiązania połączenia TCP w sekundach albo None
+    """
+    started = time.monotonic()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return time.monotonic() - started
+    except OSError:
+        return None
+
+
+class ConnectivityProbe:
+    """Sonda kilku adresów naraz (wątki z puli, bez procesów)"""
+
+    def __init__(self, targets=None, timeout=CONNECTIVITY_TIMEOUT, min_ok=CONNECTIVITY_MIN_OK):
+        self.targets = targets if targets is not None else parse_targets(CONNECTIVITY_TARGETS)
+        self.timeout = timeout
+        self.min_ok = max(1, min(min_ok, len(self.targets)))
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.targets)),
+                                           thread_name_prefix="connectivity")
+
+    def run(self):
+        """
+        Returns:
+            (czy sieć dostępna, {(host, port): czas połączenia albo None})
+        """
+        futures = {
+            target: self.executor.submit(probe, target[0], target[1], self.timeout)
+            for target in self.targets
+        }
+        results = {target: future.result() for target, future in futures.items()}
+        reachable = sum(1 for latency in results.values() if latency is not None)
+        return reachable >= self.min_ok, results
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def is_online(targets=None, timeout=CONNECTIVITY_TIMEOUT):
+    """Jednorazowe sprawdzenie (np. w postmanie po połączeniu z nową siecią)"""
+    connectivity_probe = ConnectivityProbe(targets, timeout)
+    try:
+        return connectivity_probe.run()[0]
+    finally:
+        connectivity_probe.close()
+
+
+def wifi_associated(interface, ap_connection_name=None, timeout=5):
+    """
+    Czy `interface` jest połączony z siecią WiFi jako klient (własny hotspot
+    `ap_connection_name` się nie liczy) - stan z NetworkManagera, bez ruchu w sieci.
+    """
+    try:
+        result = subprocess.run(
+            ["nmcli", "-t", "-f", "DEVICE,STATE,CONNECTION", "device"],
+            capture_output=True, text=True, timeout=timeout,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.error(f"Błąd sprawdzania połączenia WiFi: {e}")
+        return False
+    for line in result.stdout.splitlines():
+        parts = line.split(":", 2)
+        if len(parts) == 3 and parts[0] == interface:
+            return parts[1] == "connected" and parts[2] != ap_connection_name
+    return False
+
+
+class ConnectivityMonitor:
+    def __init__(self, targets=None, interval=CONNECTIVITY_INTERVAL, timeout=CONNECTIVITY_TIMEOUT,
+                 min_ok=CONNECTIVITY_MIN_OK, up_after=CONNECTIVITY_UP_AFTER,
+                 down_after=CONNECTIVITY_DOWN_AFTER, link_check=None):
+        """
+        Args:
+            link_check: funkcja bez argumentów - True, gdy łącze lokalne działa mimo braku
+                internetu (np. WiFi połączone); wtedy stan pozostaje "dostępna"
+        """
+        self.probe = ConnectivityProbe(targets, timeout, min_ok)
+        self.link_check = link_check
+        # Ostatni wynik samej sondy internetu (niezależnie od link_check)
+        self.internet = None
+        self.interval = interval
+        self.up_after = max(1, up_after)
+        self.down_after = max(1, down_after)
+
+        # None do pierwszej sondy - pierwsza decyzja bez histerezy, jak dawny ping przy starcie
+        self.online = None
+        self.changed_at = None
+        self.streak = 0
+        self.last_results = {}
+        self.ready = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def update(self, ok):
+        """Uwzględnia wynik jednej sondy; zwraca True, gdy zmienił się stan"""
+        if self.online is None:
+            self.online = ok
+            self.changed_at = time.monotonic()
+            self.ready.set()
+            logger.info(f"Sieć: {'dostępna' if ok else 'niedostępna'}")
+            return True
+
+        if ok == self.online:
+            self.streak = 0
+            return False
+        self.streak += 1
+        if self.streak < (self.up_after if ok else self.down_after):
+            return False
+
+        self.online = ok
+        self.changed_at = time.monotonic()
+        self.streak = 0
+        logger.warning(f"Sieć: {'dostępna' if ok else 'niedostępna'} "
+                       f"({self.up_after if ok else self.down_after} kolejne sondy)")
+        return True
+
+    def check(self):
+        ok, self.last_results = self.probe.run()
+        if ok != self.internet and self.internet is not None:
+            logger.info(f"Internet: {'dostępny' if ok else 'niedostępny'}")
+        self.internet = ok
+        if not ok and self.link_check:
+            # Bez internetu, ale z połączeniem WiFi - nagrywanie i kolejka wysyłek działają dalej
+            ok = self.link_check()
+        return self.update(ok)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Błąd sondy sieci: {e}")
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def wait_ready(self, timeout=None):
+        """Czeka na wynik pierwszej sondy"""
+        return self.ready.wait(timeout)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=self.probe.timeout + 1)
+        self.probe.close()
+
+
+def selftest():
+    """Histereza na lokalnym serwerze: serwer działa, znika, wraca"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    port = server.getsockname()[1]
+    monitor = ConnectivityMonitor([("127.0.0.1", port)], timeout=0.5, up_after=2, down_after=3)
+
+    def step(label):
+        changed = monitor.check()
+        print(f"{label:<22} online={monitor.online!s:<5} zmiana={changed}")
+
+    step("serwer działa")
+    server.close()
+    for _ in range(3):
+        step("serwer wyłączony")
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", port))
+    server.listen()
+    for _ in range(2):
+        step("serwer znowu działa")
+    server.close()
+    monitor.stop()
+
+    # Bez internetu, ale z działającym łączem lokalnym - stan się nie zmienia
+    monitor = ConnectivityMonitor([("127.0.0.1", port)], timeout=0.5, up_after=2, down_after=3,
+                                  link_check=lambda: True)
+    monitor.online = True
+    for _ in range(3):
+        step("serwer wył., WiFi ok")
+    monitor.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sonda dostępu do sieci (TCP, bez ping)")
+    parser.add_argument("--targets", default=CONNECTIVITY_TARGETS)
+    parser.add_argument("--selftest", action="store_true", help="histereza na lokalnym serwerze")
+    args = parser.parse_args()
+
+    if args.selftest:
+        selftest()
+    else:
+        connectivity_probe = ConnectivityProbe(parse_targets(args.targets))
+        online, results = connectivity_probe.run()
+        for (host, port), latency in results.items():
+            print(f"{host}:{port:<6} {'brak' if latency is None else f'{latency * 1000:.1f} ms'}")
+        print(f"sieć {'dostępna' if online else 'niedostępna'}")
+        connectivity_probe.close()
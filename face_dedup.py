@@ -0,0 +1,108 @@
+"""
+Odrzucanie powtarzających się zdjęć twarzy przed wysyłką.
+
+Twarze są śledzone pomiędzy detekcjami po pokryciu bounding boxów (IoU),
+a każdy wycinek dostaje hash percepcyjny (dHash, 64 bity). Wysyłane są
+tylko nowe osoby i wyraźnie inne ujęcia już śledzonej osoby.
+"""
+
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FACE_DEDUP = os.getenv("FACE_DEDUP", "1") == "1"
+FACE_TRACK_IOU = float(os.getenv("FACE_TRACK_IOU", 0.3))
+FACE_TRACK_TTL = float(os.getenv("FACE_TRACK_TTL", 30))
+FACE_HASH_DISTANCE = int(os.getenv("FACE_HASH_DISTANCE", 10))
+
+
+def dhash(image, size=8):
+    """Hash różnicowy: porównanie sąsiednich pikseli pomniejszonego obrazu"""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def iou(a, b):
+    """IoU dwóch boxów (xmin, ymin, width, height)"""
+    ax2, ay2 = a[0] + a[2], a[1] + a[3]
+    bx2, by2 = b[0] + b[2], b[1] + b[3]
+    inter_w = min(ax2, bx2) - max(a[0], b[0])
+    inter_h = min(ay2, by2) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    return inter / (a[2] * a[3] + b[2] * b[3] - inter)
+
+
+class FaceTrack:
+    __slots__ = ("bbox", "hashes", "last_seen")
+
+    def __init__(self, bbox, face_hash, now):
+        self.bbox = bbox
+        self.hashes = [face_hash]
+        self.last_seen = now
+
+
+class FaceDeduplicator:
+    def __init__(self, iou_threshold=FACE_TRACK_IOU, hash_distance=FACE_HASH_DISTANCE,
+                 track_ttl=FACE_TRACK_TTL):
+        self.iou_threshold = iou_threshold
+        self.hash_distance = hash_distance
+        self.track_ttl = track_ttl
+
+        self.lock = threading.Lock()
+        self.tracks = []
+        self.sent = 0
+        self.suppressed = 0
+
+    def should_send(self, bbox, face_img, now=None):
+        """
+        Args:
+            bbox: (xmin, ymin, width, height) względem całej klatki
+            face_img: wycinek twarzy (BGR)
+
+        Returns:
+            True jeśli zdjęcie wnosi coś nowego i powinno zostać wysłane
+        """
+        now = time.time() if now is None else now
+        face_hash = dhash(face_img)
+
+        with self.lock:
+            self.tracks = [t for t in self.tracks if now - t.last_seen <= self.track_ttl]
+
+            best, best_iou = None, self.iou_threshold
+            for track in self.tracks:
+                overlap = iou(track.bbox, bbox)
+                if overlap >= best_iou:
+                    best, best_iou = track, overlap
+
+            if best is None:
+                self.tracks.append(FaceTrack(bbox, face_hash, now))
+                self.sent += 1
+                return True
+
+            best.bbox = bbox
+            best.last_seen = now
+            if min(hamming(face_hash, h) for h in best.hashes) <= self.hash_distance:
+                self.suppressed += 1
+                return False
+
+            best.hashes.append(face_hash)
+            self.sent += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {"sent": self.sent, "suppressed": self.suppressed, "tracks": len(self.tracks)}
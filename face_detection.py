@@ -0,0 +1,73 @@
+"""
+Wykrywanie twarzy MediaPipe i wycinanie kadrów twarzy z klatki.
+
+Wspólne dla wątku detekcji ruchu i procesów z face_pool.
+"""
+
+import cv2
+
+
+def create_face_detector(model_selection=0, min_detection_confidence=0.5):
+    import mediapipe as mp
+
+    return mp.solutions.face_detection.FaceDetection(
+        model_selection=model_selection,  # 0 = short range (szybszy), 1 = full range
+        min_detection_confidence=min_detection_confidence
+    )
+
+
+def crop_face(frame, relative_bbox, scale_factor=2):
+    """
+    Wycina powiększony obszar twarzy z klatki BGR.
+
+    Args:
+        frame: klatka, na której działał detektor
+        relative_bbox: (xmin, ymin, width, height) względem rozmiaru klatki (0-1)
+        scale_factor: ile razy powiększyć bounding box
+
+    Returns:
+        wycinek klatki (może być pusty)
+    """
+    h, w = frame.shape[:2]
+    xmin, ymin, width, height = relative_bbox
+
+    x = int(xmin * w)
+    y = int(ymin * h)
+    box_w = int(width * w)
+    box_h = int(height * h)
+
+    cx = x + box_w // 2
+    cy = y + box_h // 2
+
+    new_w = int(box_w * scale_factor)
+    new_h = int(box_h * scale_factor)
+
+    # Wyznaczenie granic wycinka (z zabezpieczeniem przed wyjściem poza kadr)
+    x1 = max(0, cx - new_w // 2)
+    y1 = max(0, cy - new_h // 2)
+    x2 = min(w, cx + new_w // 2)
+    y2 = min(h, cy + new_h // 2)
+    # Wycinek wydłużony w dół, żeby objąć też sylwetkę
+    y2 = int(y2 * 1.5)
+    return frame[y1:y2, x1:x2]
+
+
+def find_faces(detector, frame):
+    """
+    Uruchamia detektor na klatce BGR.
+
+    Returns:
+        lista (wycinek_twarzy, confidence, relative_bbox), w kolejności detektora
+    """
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    results = detector.process(rgb_frame)
+
+    faces = []
+    for detection in results.detections or []:
+        # MediaPipe: bounding box względny 0-1
+        bbox = detection.location_data.relative_bounding_box
+        relative_bbox = (bbox.xmin, bbox.ymin, bbox.width, bbox.height)
+        face_img = crop_face(frame, relative_bbox)
+        if face_img.size > 0:
+            faces.append((face_img, float(detection.score[0]), relative_bbox))
+    return faces
@@ -0,0 +1,306 @@
+"""
+Wykrywanie twarzy w osobnych procesach.
+
+Klatki przekazywane są przez multiprocessing.shared_memory (stała pula
+slotów), więc do procesu potomnego nie trafia zserializowana tablica
+1080p, a jedynie numer slotu i kształt. Wyniki (małe wycinki twarzy)
+wracają asynchronicznie i są przekazywane do callbacka.
+
+Jedna pula może obsługiwać kilka kamer - każda dostaje własnego
+klienta (client), a wyniki trafiają do jej callbacka.
+
+Wątek wyników pilnuje też procesów: martwy proces (awaria MediaPipe,
+OOM) jest uruchamiany ponownie z wykładniczym odstępem, a slot bez wyniku
+dłużej niż FACE_POOL_TASK_TIMEOUT wraca do puli - inaczej po kilku
+awariach wszystkie sloty byłyby zajęte i każda klatka pomijana.
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from dotenv import load_dotenv
+from logger import get_logger
+from uniwersal import backoff_delay
+import metrics
+
+load_dotenv()
+
+FRAME_WIDTH = int(os.getenv("FRAME_WIDTH", 1920))
+FRAME_HEIGHT = int(os.getenv("FRAME_HEIGHT", 1080))
+# 0 = wykrywanie twarzy w wątku detekcji ruchu
+FACE_WORKERS = int(os.getenv("FACE_WORKERS", 0))
+# Po tylu sekundach bez wyniku slot wraca do puli (proces padł albo się zawiesił)
+FACE_POOL_TASK_TIMEOUT = float(os.getenv("FACE_POOL_TASK_TIMEOUT", 30))
+# Restart martwego procesu co RESTART_BASE * 2^n s (najwyżej RESTART_MAX);
+# proces działający dłużej niż RESTART_STABLE_AFTER liczy próby od nowa
+RESTART_BASE = 1
+RESTART_MAX = 300
+RESTART_STABLE_AFTER = 60
+
+
+def default_workers():
+    """Rozmiar wspólnej puli: wszystkie rdzenie poza jednym (przechwytywanie, ruch)"""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+logger = get_logger("face_pool")
+
+POOL_DROPS = metrics.counter("watchdog_face_pool_drops_total", "Klatki pominięte przez zajętą pulę")
+POOL_ROUNDTRIP = metrics.histogram(
+    "watchdog_face_pool_roundtrip_seconds", "Od zlecenia klatki do wyniku z puli"
+)
+POOL_RESTARTS = metrics.counter("watchdog_face_pool_restarts_total", "Ponowne uruchomienia procesów puli")
+POOL_RECLAIMED = metrics.counter("watchdog_face_pool_reclaimed_total", "Sloty odzyskane po przekroczeniu czasu")
+
+
+READY = "ready"
+
+
+def _worker_main(slot_names, tasks, results):
+    """Pętla procesu potomnego: slot z klatką -> lista twarzy"""
+    from face_detection import create_face_detector, find_faces
+
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    detector = create_face_detector()
+    # Sygnał gotowości - rodzic mierzy, kiedy pula naprawdę może wykrywać twarze
+    results.put(READY)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, task_id, shape, meta = task
+            try:
+                frame = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+                faces = [
+                    (face_img.copy(), score, bbox)
+                    for face_img, score, bbox in find_faces(detector, frame)
+                ]
+                results.put((slot, task_id, meta, faces, None))
+            except Exception as e:
+                results.put((slot, task_id, meta, [], str(e)))
+    finally:
+        detector.close()
+        for shm in slots:
+            shm.close()
+
+
+class FaceDetectionPool:
+    def __init__(self, on_result=None, workers=FACE_WORKERS, slots=None,
+                 max_shape=(FRAME_HEIGHT, FRAME_WIDTH, 3), task_timeout=FACE_POOL_TASK_TIMEOUT):
+        """
+        Args:
+            on_result: callback(meta, faces) wywoływany z wątku wyników;
+                       None = wyniki kierowane do klientów z client()
+            workers: liczba procesów
+            slots: liczba buforów klatek (domyślnie 2 na proces)
+            max_shape: największa przyjmowana klatka
+            task_timeout: po ilu sekundach bez wyniku slot wraca do puli
+        """
+        self.on_result = on_result
+        self.routes = {}
+        self.workers = max(1, workers)
+        self.slot_bytes = int(np.prod(max_shape))
+        self.task_timeout = task_timeout
+
+        self.ctx = ctx = mp.get_context("spawn")
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+
+        slot_count = slots or self.workers * 2
+        self.slots = [
+            shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+            for _ in range(slot_count)
+        ]
+        self.free_slots = queue.Queue()
+        # Zlecone sloty: slot -> (numer zadania, time.monotonic zlecenia)
+        self.pending_lock = threading.Lock()
+        self.pending = {}
+        self.task_seq = 0
+        for index in range(slot_count):
+            self.free_slots.put(index)
+
+        self.submitted = 0
+        self.dropped = 0
+        self.reclaimed = 0
+        self.restarts = 0
+        self.closing = False
+        # Chwila (time.monotonic), w której pierwszy proces załadował MediaPipe
+        self.ready_at = None
+
+        self.processes = [None] * self.workers
+        self.started_at = [0.0] * self.workers
+        self.failures = [0] * self.workers
+        self.restart_at = [0.0] * self.workers
+        for index in range(self.workers):
+            self._spawn(index)
+
+        self.result_thread = threading.Thread(target=self._collect_results, daemon=True)
+        self.result_thread.start()
+        logger.info(f"Pula detekcji twarzy: {self.workers} procesów, {slot_count} slotów")
+
+    def _spawn(self, index):
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=([shm.name for shm in self.slots], self.tasks, self.results),
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+
+    def _supervise(self):
+        """Uruchamia ponownie martwe procesy i odzyskuje sloty bez wyniku"""
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if self.closing or process.is_alive():
+                continue
+            if self.restart_at[index] == 0:
+                # Świeżo wykryta awaria - odstęp jak w supervisor.ChildProcess
+                uptime = now - self.started_at[index]
+                self.failures[index] = 1 if uptime > RESTART_STABLE_AFTER else self.failures[index] + 1
+                delay = backoff_delay(self.failures[index], RESTART_BASE, RESTART_MAX)
+                self.restart_at[index] = now + delay
+                logger.error(
+                    f"Proces puli detekcji twarzy (PID: {process.pid}) zakończył się z kodem "
+                    f"{process.exitcode} po {uptime:.0f}s - restart za {delay:.1f}s "
+                    f"(próba {self.failures[index]})"
+                )
+            elif now >= self.restart_at[index]:
+                self.restart_at[index] = 0
+                self._spawn(index)
+                self.restarts += 1
+                POOL_RESTARTS.inc()
+                logger.warning(f"Proces puli detekcji twarzy uruchomiony ponownie (PID: {self.processes[index].pid})")
+
+        with self.pending_lock:
+            expired = [
+                slot for slot, (_, submitted_at) in self.pending.items()
+                if now - submitted_at > self.task_timeout
+            ]
+            for slot in expired:
+                del self.pending[slot]
+        for slot in expired:
+            self.free_slots.put(slot)
+        if expired:
+            self.reclaimed += len(expired)
+            POOL_RECLAIMED.inc(len(expired))
+            logger.error(
+                f"Pula detekcji twarzy: {len(expired)} slotów bez wyniku od ponad "
+                f"{self.task_timeout:.0f}s - odzyskane"
+            )
+
+    def in_flight(self):
+        return len(self.slots) - self.free_slots.qsize()
+
+    def submit(self, frame, meta=None):
+        """
+        Kopiuje klatkę do wolnego slotu i zleca detekcję. Nie blokuje -
+        gdy wszystkie sloty są zajęte, klatka jest pomijana.
+
+        Returns:
+            True jeśli klatka została przyjęta
+        """
+        if frame.nbytes > self.slot_bytes:
+            logger.warning(f"Klatka {frame.shape} większa niż slot puli - pomijam")
+            self.dropped += 1
+            POOL_DROPS.inc()
+            return False
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            POOL_DROPS.inc()
+            return False
+
+        view = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.slots[slot].buf)
+        view[...] = frame
+        with self.pending_lock:
+            self.task_seq += 1
+            task_id = self.task_seq
+            self.pending[slot] = (task_id, time.monotonic())
+        self.tasks.put((slot, task_id, frame.shape, meta))
+        self.submitted += 1
+        return True
+
+    def _collect_results(self):
+        supervised_at = time.monotonic()
+        while True:
+            if time.monotonic() - supervised_at >= 1:
+                self._supervise()
+                supervised_at = time.monotonic()
+            try:
+                item = self.results.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            if item is None:
+                break
+            if item == READY:
+                if self.ready_at is None:
+                    self.ready_at = time.monotonic()
+                    logger.info("Pula detekcji twarzy gotowa")
+                continue
+            slot, task_id, meta, faces, error = item
+            with self.pending_lock:
+                current = self.pending.get(slot)
+                if current is None or current[0] != task_id:
+                    # Wynik po odzyskaniu slotu - slot ma już inne zadanie
+                    continue
+                del self.pending[slot]
+            POOL_ROUNDTRIP.observe(time.monotonic() - current[1])
+            self.free_slots.put(slot)
+            if error:
+                logger.error(f"Błąd detekcji twarzy w procesie puli: {error}")
+                continue
+            try:
+                if self.on_result:
+                    self.on_result(meta, faces)
+                else:
+                    key, meta = meta
+                    self.routes[key](meta, faces)
+            except Exception as e:
+                logger.error(f"Błąd obsługi wyników detekcji twarzy: {e}")
+
+    def client(self, key, on_result):
+        """Klient puli dla jednej kamery - wyniki jej klatek trafiają do on_result"""
+        self.routes[key] = on_result
+        return FacePoolClient(self, key)
+
+    def close(self):
+        self.closing = True
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=3)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+        self.result_thread.join(timeout=3)
+        for shm in self.slots:
+            shm.close()
+            shm.unlink()
+
+
+class FacePoolClient:
+    """Widok wspólnej puli z interfejsem FaceDetectionPool (submit/close)"""
+
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+
+    def submit(self, frame, meta=None):
+        return self.pool.submit(frame, (self.key, meta))
+
+    @property
+    def ready_at(self):
+        return self.pool.ready_at
+
+    def close(self):
+        # Pulę zamyka jej właściciel
+        self.pool.routes.pop(self.key, None)
@@ -0,0 +1,77 @@
+"""
+Wybór najlepszych ujęć twarzy w oknie czasowym.
+
+Zamiast wysyłać pierwszą wykrytą twarz, kandydaci z okna
+FACE_WINDOW_SECONDS są oceniani (pewność detektora, rozmiar wycinka,
+ostrość jako wariancja Laplasjanu) i po zamknięciu okna zostaje
+FACE_TOP_K najlepszych.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+
+import cv2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 0 = bez okna, wysyłana jest pierwsza twarz
+FACE_WINDOW_SECONDS = float(os.getenv("FACE_WINDOW_SECONDS", 0))
+FACE_TOP_K = int(os.getenv("FACE_TOP_K", 2))
+FACE_SIZE_REF = int(os.getenv("FACE_SIZE_REF", 128))
+FACE_SHARPNESS_REF = float(os.getenv("FACE_SHARPNESS_REF", 100))
+
+
+def sharpness(face_img, max_side=160):
+    """Wariancja Laplasjanu na pomniejszonym wycinku (porównywalna między rozmiarami)"""
+    gray = face_img if face_img.ndim == 2 else cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
+    scale = max_side / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def face_score(face_img, confidence, size_ref=FACE_SIZE_REF, sharpness_ref=FACE_SHARPNESS_REF):
+    size = min(1.0, min(face_img.shape[:2]) / size_ref)
+    sharp = min(1.0, sharpness(face_img) / sharpness_ref)
+    return confidence * (0.5 + 0.5 * size) * (0.5 + 0.5 * sharp)
+
+
+class BestShotSelector:
+    def __init__(self, window=FACE_WINDOW_SECONDS, top_k=FACE_TOP_K):
+        self.window = window
+        self.top_k = max(1, top_k)
+
+        self.lock = threading.Lock()
+        self.candidates = []  # kopiec (score, nr, face) - tylko top_k najlepszych
+        self.counter = itertools.count()
+        self.window_start = None
+
+    def add(self, face_img, confidence, bbox, now):
+        score = face_score(face_img, confidence)
+        entry = (score, next(self.counter), (face_img, confidence, bbox))
+        with self.lock:
+            if self.window_start is None:
+                self.window_start = now
+            if len(self.candidates) < self.top_k:
+                heapq.heappush(self.candidates, entry)
+            elif score > self.candidates[0][0]:
+                heapq.heapreplace(self.candidates, entry)
+
+    def pending(self):
+        with self.lock:
+            return len(self.candidates)
+
+    def ready(self, now):
+        with self.lock:
+            return self.window_start is not None and now - self.window_start >= self.window
+
+    def flush(self):
+        """Zamyka okno i zwraca najlepsze twarze (od najlepszej)"""
+        with self.lock:
+            best = sorted(self.candidates, reverse=True)
+            self.candidates = []
+            self.window_start = None
+        return [face for _, _, face in best]
@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 """
 Skrypt monitorujący połączenie WiFi.
-Jeśli brak połączenia - uruchamia inny cron i usypia się.
+Jeśli jest połączenie - uruchamia workera, jeśli nie - gate_watchera,
+i pilnuje, żeby wybrany proces działał (restart po awarii lub zawieszeniu).
+Łącze sprawdzane jest co CHECK_INTERVAL s (z histerezą), więc tryb
+przełącza się także w trakcie działania. Sama awaria internetu przy
+połączonym WiFi nie zatrzymuje workera - nagrania nie potrzebują sieci,
+a wysyłki czekają w kolejce na dysku; gate_watcher startuje dopiero po
+utracie połączenia z siecią WiFi.
 """
 
-import subprocess
+import signal
 import sys
 import os
 from dotenv import load_dotenv
 import time
-from uniwersal import start_script
+from connectivity import ConnectivityMonitor, wifi_associated
+from supervisor import ChildProcess, single_instance, STOP_TIMEOUT, WORKER_STOP_TIMEOUT
 from logger import setup_logging, get_logger
 
 
@@ -18,6 +25,13 @@ load_dotenv()
 CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", 10))
 GATE_WATCHER_SCRIPT = os.getenv("GATE_WATCHER_SCRIPT")
 WORKER_SCRIPT = os.getenv("WORKER_SCRIPT")
+WORKER_SCRIPT_VENV = os.getenv("WORKER_SCRIPT_VENV")
+WORKER_ENV_PATH = os.getenv("WORKER_ENV_PATH")
+INTERFACE = os.getenv("INTERFACE")
+AP_CONNECTION_NAME = os.getenv("AP_CONNECTION_NAME")
+# Co ile sekund father sprawdza dziecko i co ile loguje jego stan
+SUPERVISE_INTERVAL = 1
+STATUS_INTERVAL = 60
 
 setup_logging()
 logger = get_logger("father")
@@ -30,51 +44,66 @@ logger.info("")
 logger.info("father === start")
 
 
-def check_wifi_connection():
-    """check connection by google ping"""
-    try:
-        result = subprocess.run(
-            ["ping", "-c", "1", "-W", "2", "8.8.8.8"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=3
-        )
-        return result.returncode == 0
-    except subprocess.SubprocessError as e:
-        logger.error(f"Ping failed: {e}")
-        return False
-    except Exception as e:
-        logger.error(f"Nieoczekiwany błąd przy sprawdzaniu WiFi: {e}")
-        return False
-
-
 def main():
     logger.info("=====================")
     logger.info("=== Start fathera ===")
 
-    try:
-        wifi_ok = check_wifi_connection()
-        logger.info(f"wifi_ok: {wifi_ok}")
+    instance_lock = single_instance("father")
+    if instance_lock is None:
+        logger.error("father już działa - kończę")
+        return 1
 
-        if wifi_ok:
-            logger.info("Połączenie WiFi: OK - uruchamiam skrypt online i kończę")
-            script_wifi_ok = start_script(WORKER_SCRIPT, logger)
-            if not script_wifi_ok:
-                logger.error("Nie udało się uruchomić skryptu online")
-        else:
-            logger.info("Brak połączenia WiFi - uruchamiam skrypt offline i kończę")
-            script_wifi_not_ok = start_script(GATE_WATCHER_SCRIPT, logger)
-            if not script_wifi_not_ok:
-                logger.error("Nie udało się uruchomić skryptu offline")
+    children = {
+        # worker potrzebuje OpenCV/MediaPipe - ten sam venv co przy starcie z gate_watchera
+        # Zamknięcie workera (ostatnie nagranie, obróbka) ma własny limit - SIGKILL dopiero po nim
+        True: ChildProcess("worker", WORKER_SCRIPT, WORKER_ENV_PATH,
+                           stop_timeout=WORKER_STOP_TIMEOUT + STOP_TIMEOUT),
+        False: ChildProcess("gate_watcher", GATE_WATCHER_SCRIPT, WORKER_SCRIPT_VENV),
+    }
+    # Bez INTERFACE o trybie decyduje tylko sonda internetu
+    link_check = (lambda: wifi_associated(INTERFACE, AP_CONNECTION_NAME)) if INTERFACE else None
+    monitor = ConnectivityMonitor(interval=CHECK_INTERVAL, link_check=link_check)
 
-    except Exception as e:
-        logger.error(f"Błąd KRYTYCZNY: {e}")
-    logger.error(f"kończę")
+    def shutdown(signum, frame):
+        logger.info(f"father --- sygnał {signum}, zatrzymuję procesy")
+        monitor.stop()
+        for child in children.values():
+            child.stop()
+        sys.exit(0)
 
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    monitor.start()
+    monitor.wait_ready()
+    online = None
+    child = None
+    last_status = 0
     while True:
-        logger.info("father")
-        time.sleep(60)
+        if monitor.online != online:
+            if child:
+                logger.warning(f"father --- zmiana trybu, zatrzymuję {child.role}")
+                child.stop()
+            online = monitor.online
+            child = children[online]
+            if online:
+                logger.info("Połączenie WiFi: OK - uruchamiam skrypt online")
+            else:
+                logger.info("Brak połączenia WiFi - uruchamiam skrypt offline")
+            child.reset()
+
+        try:
+            child.check()
+        except Exception as e:
+            logger.error(f"Błąd nadzoru {child.role}: {e}")
+        if time.monotonic() - last_status >= STATUS_INTERVAL:
+            logger.info(
+                f"father --- sieć {'dostępna' if online else 'niedostępna'}, "
+                f"internet {'dostępny' if monitor.internet else 'niedostępny'}, {child.status()}"
+            )
+            last_status = time.monotonic()
+        time.sleep(SUPERVISE_INTERVAL)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
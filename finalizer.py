@@ -0,0 +1,205 @@
+"""
+Obróbka nagrania po jego zakończeniu, w małej puli wątków.
+
+    1. (tryb segmentów) wycięcie fragmentu
+    2. ffprobe - rzeczywista długość i rozmiar pliku
+    3. remux z -movflags +faststart (moov na początku - odtwarzanie od razu)
+    4. miniatura JPEG obok pliku
+    5. jedno zgłoszenie z metadanymi do kolejki wysyłek
+    6. (VIDEO_UPLOAD) przekazanie pliku do wysyłki w kawałkach
+
+Wątek detekcji ruchu tylko zleca zadanie i wraca do pracy.
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from api_client import VIDEO_INFO_ENDPOINT
+from logger import get_logger
+
+load_dotenv()
+
+FINALIZE_WORKERS = int(os.getenv("FINALIZE_WORKERS", 1))
+FINALIZE_FASTSTART = os.getenv("FINALIZE_FASTSTART", "1") == "1"
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", 320))
+
+logger = get_logger("finalizer")
+
+
+def probe_video(path):
+    """
+    Returns:
+        (długość w sekundach, rozmiar w bajtach); długość None, gdy ffprobe jej nie zna
+    """
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-show_entries", "format=duration,size",
+            "-of", "json",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    fmt = {}
+    if result.returncode == 0:
+        try:
+            fmt = json.loads(result.stdout).get("format", {})
+        except ValueError:
+            pass
+    try:
+        duration = float(fmt["duration"])
+    except (KeyError, ValueError):
+        duration = None
+    try:
+        size = int(fmt["size"])
+    except (KeyError, ValueError):
+        size = os.path.getsize(path)
+    return duration, size
+
+
+def remux_faststart(path):
+    """Przepisuje kontener bez kodowania, z indeksem moov na początku pliku"""
+    tmp_path = f"{path}.faststart.mp4"
+    result = subprocess.run(
+        [
+            "ffmpeg", "-loglevel", "error", "-y",
+            "-i", path,
+            "-c", "copy",
+            "-movflags", "+faststart",
+            tmp_path,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        timeout=300,
+    )
+    if result.returncode != 0:
+        logger.error(f"Błąd remuksowania {path}: {result.stderr.strip()}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+
+def make_thumbnail(path, duration=None, width=THUMBNAIL_WIDTH):
+    """Klatka z pierwszej sekundy (lub środka krótszego nagrania) jako JPEG"""
+    thumb_path = os.path.splitext(path)[0] + ".jpg"
+    position = min(1.0, duration / 2) if duration else 0
+    result = subprocess.run(
+        [
+            "ffmpeg", "-loglevel", "error", "-y",
+            "-ss", f"{position:.2f}",
+            "-i", path,
+            "-frames:v", "1",
+            "-vf", f"scale={width}:-2",
+            "-q:v", "5",
+            thumb_path,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        timeout=30,
+    )
+    if result.returncode != 0 or not os.path.exists(thumb_path):
+        logger.warning(f"Nie udało się utworzyć miniatury {path}: {result.stderr.strip()}")
+        return None
+    return thumb_path
+
+
+class RecordingFinalizer:
+    def __init__(self, uploader, workers=FINALIZE_WORKERS, faststart=FINALIZE_FASTSTART,
+                 catalog=None, video_uploader=None):
+        self.uploader = uploader
+        self.catalog = catalog
+        self.video_uploader = video_uploader
+        self.faststart = faststart
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers),
+                                           thread_name_prefix="finalizer")
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, output_file, recorded_at, prepare=None):
+        """
+        Zleca obróbkę zakończonego nagrania.
+
+        Args:
+            output_file: ścieżka do pliku MP4
+            recorded_at: początek nagrania (ISO)
+            prepare: opcjonalna funkcja tworząca plik (np. wycięcie z segmentów),
+                     zwracająca ścieżkę albo None
+        """
+        with self.lock:
+            self.pending += 1
+        return self.executor.submit(self._finalize, output_file, recorded_at, prepare)
+
+    def _finalize(self, output_file, recorded_at, prepare):
+        try:
+            if prepare and prepare() is None:
+                self._discard(output_file)
+                return None
+            if not os.path.exists(output_file):
+                logger.warning(f"Brak pliku nagrania do obróbki: {output_file}")
+                self._discard(output_file)
+                return None
+
+            if self.faststart:
+                remux_faststart(output_file)
+            duration, size = probe_video(output_file)
+            thumbnail = make_thumbnail(output_file, duration)
+            if self.catalog:
+                self.catalog.finish(output_file, duration=duration, size=size, thumbnail=thumbnail)
+
+            data = {
+                'file_path': os.path.basename(output_file),
+                'recorded_at': recorded_at,
+                'record_length': round(duration) if duration is not None else 0,
+                'file_size': size,
+            }
+            if thumbnail:
+                data['thumbnail'] = os.path.basename(thumbnail)
+
+            self.uploader.enqueue_json(VIDEO_INFO_ENDPOINT, data)
+            if self.video_uploader:
+                self.video_uploader.enqueue(output_file, data)
+            logger.info(
+                f"Nagranie gotowe: {output_file} "
+                f"({duration or 0:.1f}s, {size / 1024 / 1024:.1f} MB)"
+            )
+            return data
+        except Exception as e:
+            logger.error(f"Błąd obróbki nagrania {output_file}: {e}")
+            return None
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def _discard(self, output_file):
+        if self.catalog:
+            self.catalog.remove(output_file)
+
+    def close(self, wait=True, timeout=None):
+        """
+        Czeka na dokończenie zleconych nagrań (przy zamykaniu systemu).
+
+        Args:
+            timeout: najdłuższe czekanie w sekundach; niedokończone nagrania
+                zostają w katalogu jako "recording" i zamyka je reconcile() po restarcie
+        """
+        if self.pending:
+            logger.info(f"Oczekiwanie na obróbkę nagrań: {self.pending}")
+        if wait and timeout is not None:
+            deadline = time.monotonic() + timeout
+            while self.pending and time.monotonic() < deadline:
+                time.sleep(0.1)
+            if self.pending:
+                logger.warning(f"Obróbka {self.pending} nagrań nie zmieściła się w {timeout:.0f}s - przerywam")
+                wait = False
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
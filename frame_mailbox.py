@@ -0,0 +1,182 @@
+"""
+Skrzynka na najnowszą klatkę: jeden slot z numerem kolejnym.
+
+Producent (wątek przechwytywania) nadpisuje slot, nie czekając na nikogo.
+Każdy konsument pamięta numer ostatnio odebranej klatki i czeka tylko
+na nowszą (wait), więc kilku konsumentów (detekcja ruchu, podgląd)
+czyta tę samą skrzynkę niezależnie. Pominięte klatki to różnica numerów.
+
+W pamięci zostaje najwyżej jedna klatka (plus te, które konsumenci
+właśnie przetwarzają) zamiast kolejki kilku klatek 1080p.
+
+    python frame_mailbox.py [--seconds 3] [--interval 0.2]
+
+porównuje koszt przekazania klatki i zajętą pamięć z queue.Queue(maxsize=3).
+"""
+
+import threading
+
+
+class FrameMailbox:
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.seq = 0
+        self.item = None
+
+    def put(self, item):
+        """Zastępuje poprzednią klatkę i budzi czekających; zwraca jej numer"""
+        with self.cond:
+            self.seq += 1
+            self.item = item
+            self.cond.notify_all()
+            return self.seq
+
+    def latest(self):
+        """(numer, klatka) bez czekania; (0, None) przed pierwszą klatką"""
+        with self.cond:
+            return self.seq, self.item
+
+    def wait(self, after_seq=0, timeout=None):
+        """
+        Czeka na klatkę nowszą niż `after_seq`.
+
+        Returns:
+            (numer, klatka) albo (after_seq, None) po przekroczeniu czasu
+        """
+        with self.cond:
+            if self.seq <= after_seq and not self.cond.wait_for(lambda: self.seq > after_seq, timeout):
+                return after_seq, None
+            return self.seq, self.item
+
+    def clear(self):
+        """Zwalnia przechowywaną klatkę (numeracja biegnie dalej)"""
+        with self.cond:
+            self.item = None
+
+
+def benchmark(seconds=3.0, interval=0.2, width=1920, height=1080):
+    """
+    Producent wstawia nowe klatki tak szybko, jak może, konsument co `interval` s
+    bierze najnowszą - jak capture_frames i motion_step. Mierzy czas put/get
+    na klatkę i największą liczbę jednocześnie żywych klatek.
+    """
+    import queue
+    import time
+    import weakref
+
+    import numpy as np
+
+    frame_bytes = width * height * 3
+
+    class QueueHandoff:
+        """Dotychczasowy sposób: Queue(maxsize=3) z wyrzucaniem najstarszej"""
+
+        def __init__(self):
+            self.queue = queue.Queue(maxsize=3)
+
+        def put(self, item):
+            try:
+                self.queue.put(item, block=False)
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put(item, block=False)
+                except queue.Empty:
+                    pass
+
+        def get(self, timeout):
+            try:
+                item = self.queue.get(timeout=timeout)
+                while not self.queue.empty():
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+            except queue.Empty:
+                return None
+            return item
+
+    class MailboxHandoff:
+        def __init__(self):
+            self.mailbox = FrameMailbox()
+            self.seq = 0
+
+        def put(self, item):
+            self.mailbox.put(item)
+
+        def get(self, timeout):
+            seq, item = self.mailbox.wait(self.seq, timeout)
+            if item is None:
+                return None
+            self.seq = seq
+            return item
+
+    results = {}
+    for name, handoff in (("Queue(maxsize=3)", QueueHandoff()), ("FrameMailbox", MailboxHandoff())):
+        live = [0]
+        live_lock = threading.Lock()
+
+        def released():
+            with live_lock:
+                live[0] -= 1
+
+        stop = threading.Event()
+        stats = {"puts": 0, "put_time": 0.0, "gets": 0, "get_time": 0.0, "peak": 0}
+
+        def consume():
+            held = None
+            while not stop.is_set():
+                started = time.perf_counter()
+                item = handoff.get(timeout=0.5)
+                stats["get_time"] += time.perf_counter() - started
+                if item is not None:
+                    stats["gets"] += 1
+                    held = item
+                time.sleep(interval)
+            del held
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            # np.empty nie dotyka stron - liczy się tylko przekazanie referencji
+            frame = np.empty((height, width, 3), np.uint8)
+            with live_lock:
+                live[0] += 1
+            weakref.finalize(frame, released)
+            item = (time.time(), frame)
+            del frame
+            started = time.perf_counter()
+            handoff.put(item)
+            stats["put_time"] += time.perf_counter() - started
+            stats["puts"] += 1
+            del item
+            stats["peak"] = max(stats["peak"], live[0])
+            # ~ tempo dekodera, żeby konsument w ogóle dostał blokadę
+            time.sleep(0.001)
+        stop.set()
+        consumer.join()
+        results[name] = stats
+
+    print(f"klatka {width}x{height} BGR = {frame_bytes / 1024 / 1024:.1f} MB, "
+          f"konsument co {interval * 1000:.0f} ms, {seconds:.0f}s na wariant")
+    for name, stats in results.items():
+        print(
+            f"{name:>17}: put {stats['put_time'] / max(1, stats['puts']) * 1e6:6.2f} µs/klatkę, "
+            f"get {stats['get_time'] / max(1, stats['gets']) * 1e3:6.2f} ms (z czekaniem), "
+            f"najwięcej żywych klatek {stats['peak']} "
+            f"({stats['peak'] * frame_bytes / 1024 / 1024:.1f} MB)"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Koszt przekazania klatki: Queue(maxsize=3) vs FrameMailbox")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--interval", type=float, default=0.2, help="odstęp pobierania klatek przez konsumenta")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    args = parser.parse_args()
+    benchmark(args.seconds, args.interval, args.width, args.height)
@@ -1,8 +1,10 @@
 import subprocess
+import sys
 import time
 import os
 from dotenv import load_dotenv
 from uniwersal import start_script
+from supervisor import Heartbeat, instance_pid, single_instance
 from logger import setup_logging, get_logger
 
 load_dotenv()
@@ -17,10 +19,14 @@ WORKER_SCRIPT = os.getenv('WORKER_SCRIPT')
 REMOTE_SERVER_URL = os.getenv('REMOTE_SERVER_URL')
 DEVICE_UID = os.getenv('DEVICE_UID')
 WORKER_ENV_PATH = os.getenv('WORKER_ENV_PATH')
+# W trybie Access Point co tyle sekund próba powrotu do zapisanej sieci (0 = nigdy)
+AP_RETRY_INTERVAL = int(os.getenv('AP_RETRY_INTERVAL', 300))
 
 setup_logging()
 logger = get_logger("gate_watcher")
 logger.info("gate_watcher")
+# Bicie serca dla fathera - każda pętla oczekiwania je odnawia
+heartbeat = Heartbeat("gate_watcher")
 
 
 def run_command(command, check=True):
@@ -216,9 +222,34 @@ def disable_access_point():
     return True
 
 
+def retry_client_mode():
+    """
+    Z trybu Access Point: próba powrotu do zapisanej sieci WiFi (np. po
+    restarcie routera). Bez powodzenia hotspot jest włączany z powrotem.
+    """
+    if not get_saved_connections():
+        return False
+    logger.info("Próba powrotu do zapisanej sieci WiFi...")
+    disable_access_point()
+    run_command(f"nmcli device connect {INTERFACE}", check=False)
+    for attempt in range(MAX_RETRIES):
+        heartbeat.beat()
+        if is_connected_to_wifi():
+            logger.info("Pozostaję w trybie klienta WiFi")
+            return True
+        time.sleep(WAIT_TIME)
+    logger.warning("Zapisana sieć nadal niedostępna - wracam do trybu Access Point")
+    enable_access_point()
+    return False
+
 
 def main():
     logger.info("start gate watcher")
+    instance_lock = single_instance("gate_watcher")
+    if instance_lock is None:
+        logger.error("gate_watcher już działa - kończę")
+        return 1
+    heartbeat.beat()
     logger.info("Uruchamiam WiFi Manager (NetworkManager)")
     
     network_manager_status = False
@@ -228,6 +259,7 @@ def main():
             break
         logger.error(f"Czekam na NetworkManager... (próba {attempt + 1}/10)")
         time.sleep(5)
+        heartbeat.beat()
 
     if not network_manager_status:
         logger.error("NetworkManager nie jest dostępny")
@@ -247,17 +279,22 @@ def main():
         else:
             logger.error(f"System sam nie aktywował połączenia, próba: {attempt}/{MAX_RETRIES} czekam {attempt * WAIT_TIME}s")
             time.sleep(WAIT_TIME)
+        heartbeat.beat()
 
     if connected:
         logger.info("Pozostaję w trybie klienta WiFi")
         disable_access_point()
 
-        status_worker = start_script(WORKER_SCRIPT, logger, WORKER_ENV_PATH)
-        if status_worker:
-            logger.info(f"Załączono wokera: {WORKER_SCRIPT}")
+        if instance_pid("father"):
+            # Father wykryje połączenie i sam uruchomi workera pod nadzorem
+            logger.info("Workera uruchomi father")
         else:
-            logger.error(f"NIE załączono wokera: {WORKER_SCRIPT}")
-            return 1
+            status_worker = start_script(WORKER_SCRIPT, logger, WORKER_ENV_PATH)
+            if status_worker:
+                logger.info(f"Załączono wokera: {WORKER_SCRIPT}")
+            else:
+                logger.error(f"NIE załączono wokera: {WORKER_SCRIPT}")
+                return 1
     else:
         logger.warning("Brak połączenia - przełączam na tryb Access Point")
         if enable_access_point():
@@ -276,14 +313,22 @@ def main():
             logger.error("Nie udało się włączyć trybu Access Point")
             return 0
 
+    ap_mode = not connected
+    next_retry = time.monotonic() + AP_RETRY_INTERVAL
     while True:
         logger.info("gate_watcher")
-        time.sleep(60)
+        heartbeat.beat()
+        if ap_mode and AP_RETRY_INTERVAL and time.monotonic() >= next_retry:
+            # Po połączeniu father przełącza się na workera i kończy gate_watchera
+            ap_mode = not retry_client_mode()
+            next_retry = time.monotonic() + AP_RETRY_INTERVAL
+        time.sleep(min(60, AP_RETRY_INTERVAL) if ap_mode and AP_RETRY_INTERVAL else 60)
 
 if __name__ == "__main__":
     try:
-        main()
+        sys.exit(main())
     except KeyboardInterrupt:
         logger.info("Przerwano przez użytkownika")
     except Exception as e:
         logger.error(f"Nieoczekiwany błąd: {str(e)}", exc_info=True)
+        sys.exit(1)
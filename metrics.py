@@ -0,0 +1,229 @@
+"""
+Liczniki i histogramy czasów etapów (format tekstowy Prometheusa).
+
+Pomiar to jedno bisect + inkrementacja pod blokadą, bez alokacji
+napisów, więc instrumentacja może siedzieć w gorącej ścieżce.
+Wyniki są dostępne pod http://METRICS_HOST:METRICS_PORT/metrics
+i/lub zapisywane co METRICS_FLUSH_INTERVAL do METRICS_FILE
+(np. dla textfile collectora node_exportera).
+
+    CAPTURE_READ = metrics.histogram("watchdog_capture_read_seconds", "cap.read()")
+    with CAPTURE_READ.time():
+        ret, frame = cap.read()
+"""
+
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+from logger import get_logger
+
+load_dotenv()
+
+# 0 = bez endpointu HTTP
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# puste = bez zapisu do pliku
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 60))
+
+# Od 0,5 ms do 30 s - obejmuje zarówno blur małej klatki, jak i żądanie HTTP
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+logger = get_logger("metrics")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self):
+        return [f"{self.name}{_label_text(self.labels)} {self.value}"]
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # Ostatni kubełek = +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def render(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = _label_text(self.labels + (("le", le),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_sum{_label_text(self.labels)} {total:.6f}")
+        lines.append(f"{self.name}_count{_label_text(self.labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.help = {}
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        labels = tuple(sorted((labels or {}).items()))
+        key = (name, labels)
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = cls(name, labels, **kwargs)
+                if help_text:
+                    self.help.setdefault(name, help_text)
+            return metric
+
+    def counter(self, name, help_text="", labels=None):
+        return self._get(Counter, name, help_text, labels)
+
+    def histogram(self, name, help_text="", labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        last_name = None
+        for (name, _), metric in metrics:
+            if name != last_name:
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+                last_name = name
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+counter = registry.counter
+histogram = registry.histogram
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsExporter:
+    """Endpoint /metrics i/lub okresowy zapis do pliku"""
+
+    def __init__(self, port=METRICS_PORT, host=METRICS_HOST, path=METRICS_FILE,
+                 interval=METRICS_FLUSH_INTERVAL):
+        self.port = port
+        self.host = host
+        self.path = path
+        self.interval = interval
+
+        self.server = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def enabled(self):
+        return bool(self.port or self.path)
+
+    def start(self):
+        if self.port:
+            self.server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+            self.server.daemon_threads = True
+            self.threads.append(threading.Thread(target=self.server.serve_forever, daemon=True))
+            logger.info(f"Metryki: http://{self.host}:{self.port}/metrics")
+        if self.path:
+            self.threads.append(threading.Thread(target=self._flush_loop, daemon=True))
+            logger.info(f"Metryki zapisywane do {self.path} co {self.interval:.0f}s")
+        for thread in self.threads:
+            thread.start()
+
+    def flush(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(registry.render())
+        os.replace(tmp_path, self.path)
+
+    def _flush_loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"Błąd zapisu metryk do {self.path}: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path:
+            try:
+                self.flush()
+            except OSError:
+                pass
@@ -0,0 +1,316 @@
+"""
+Silniki detekcji ruchu pracujące na klatkach MOTION_WIDTH x MOTION_HEIGHT.
+
+Każdy silnik przyjmuje rozmytą klatkę w skali szarości i zwraca
+(motion_ratio, maska), trzymając własny stan pomiędzy klatkami.
+"""
+
+import collections
+import os
+import time
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MOTION_ENGINE = os.getenv("MOTION_ENGINE", "absdiff")
+MOTION_SENSITIVITY = int(os.getenv("MOTION_SENSITIVITY", 25))
+MOTION_BG_ALPHA = float(os.getenv("MOTION_BG_ALPHA", 0.05))
+MOTION_BG_HISTORY = int(os.getenv("MOTION_BG_HISTORY", 200))
+# Klatki nauki modelu MOG2/KNN po resecie, zanim maska jest oceniana (0 = history / 20, min. 5)
+MOTION_BG_WARMUP = int(os.getenv("MOTION_BG_WARMUP", 0))
+MOTION_LIGHT_CHANGE_RATIO = float(os.getenv("MOTION_LIGHT_CHANGE_RATIO", 0.6))
+MOTION_RATIO_THRESHOLD = float(os.getenv("MOTION_RATIO_THRESHOLD", 0.01))
+MOTION_CHECK_INTERVAL = float(os.getenv("MOTION_CHECK_INTERVAL", 1))
+# Domyślnie oba równe MOTION_CHECK_INTERVAL = stały odstęp jak dotychczas
+MOTION_INTERVAL_MIN = float(os.getenv("MOTION_INTERVAL_MIN", MOTION_CHECK_INTERVAL))
+MOTION_INTERVAL_MAX = float(os.getenv("MOTION_INTERVAL_MAX", MOTION_CHECK_INTERVAL))
+MOTION_INTERVAL_BACKOFF = float(os.getenv("MOTION_INTERVAL_BACKOFF", 1.5))
+MOTION_TILE_SIZE = int(os.getenv("MOTION_TILE_SIZE", 16))
+MOTION_TILE_FILL = float(os.getenv("MOTION_TILE_FILL", 0.1))
+
+
+class AbsDiffEngine:
+    """Dotychczasowa metoda: różnica dwóch kolejnych próbek"""
+
+    name = "absdiff"
+
+    def __init__(self, sensitivity=MOTION_SENSITIVITY):
+        self.sensitivity = sensitivity
+        self.prev = None
+
+    def reset(self):
+        self.prev = None
+
+    def process(self, gray):
+        if self.prev is None or self.prev.shape != gray.shape:
+            self.prev = gray.copy()
+            return 0.0, None
+
+        diff = cv2.absdiff(self.prev, gray)
+        _, mask = cv2.threshold(diff, self.sensitivity, 255, cv2.THRESH_BINARY)
+        self.prev = gray.copy()
+        return cv2.countNonZero(mask) / mask.size, mask
+
+
+class RunningAverageEngine:
+    """
+    Tło jako średnia krocząca (cv2.accumulateWeighted).
+
+    Wolno poruszające się obiekty odróżniają się od tła, mimo że pomiędzy
+    dwiema kolejnymi próbkami prawie się nie przesuwają. Globalna zmiana
+    jasności (chmura, latarnia) jest kompensowana przesunięciem o medianę
+    różnicy, a gdy i tak zmienia się większość kadru, tło jest przejmowane
+    bez zgłaszania ruchu.
+    """
+
+    name = "running_avg"
+
+    def __init__(self, sensitivity=MOTION_SENSITIVITY, alpha=MOTION_BG_ALPHA,
+                 light_change_ratio=MOTION_LIGHT_CHANGE_RATIO):
+        self.sensitivity = sensitivity
+        self.alpha = alpha
+        self.light_change_ratio = light_change_ratio
+        self.background = None
+
+    def reset(self):
+        self.background = None
+
+    def process(self, gray):
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype(np.float32)
+            return 0.0, None
+
+        diff = gray.astype(np.float32)
+        diff -= self.background
+        # Kompensacja globalnej zmiany oświetlenia
+        diff -= np.median(diff)
+        np.abs(diff, out=diff)
+
+        mask = (diff > self.sensitivity).astype(np.uint8)
+        mask *= 255
+        ratio = cv2.countNonZero(mask) / mask.size
+
+        if ratio > self.light_change_ratio:
+            # Zmiana całej sceny - przejmij nowe tło od razu
+            self.background = gray.astype(np.float32)
+            return 0.0, None
+
+        # Piksele ruchu uczą tło wolniej, żeby stojąca osoba nie znikała od razu
+        cv2.accumulateWeighted(gray, self.background, self.alpha, mask=cv2.bitwise_not(mask))
+        cv2.accumulateWeighted(gray, self.background, self.alpha / 10, mask=mask)
+        return ratio, mask
+
+
+class SubtractorEngine:
+    """
+    Modele tła z OpenCV (MOG2 / KNN).
+
+    Świeży model (start, zmiana oświetlenia) przez `warmup` klatek tylko się
+    uczy: KNN zaraz po utworzeniu zgłasza większość kadru jako pierwszy plan,
+    co bez rozgrzewki wyglądałoby jak kolejna zmiana oświetlenia i resetowało
+    model w każdej klatce.
+    """
+
+    def __init__(self, kind="mog2", history=MOTION_BG_HISTORY,
+                 light_change_ratio=MOTION_LIGHT_CHANGE_RATIO, warmup=MOTION_BG_WARMUP):
+        self.name = kind
+        self.history = history
+        self.light_change_ratio = light_change_ratio
+        self.warmup = warmup or max(5, history // 20)
+        self.warmup_left = 0
+        self.resets = 0
+        self.subtractor = None
+        self.reset()
+
+    def reset(self):
+        if self.name == "knn":
+            self.subtractor = cv2.createBackgroundSubtractorKNN(
+                history=self.history, detectShadows=False
+            )
+        else:
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(
+                history=self.history, detectShadows=False
+            )
+        self.warmup_left = self.warmup
+        self.resets += 1
+
+    def process(self, gray):
+        if self.warmup_left > 0:
+            # Rozgrzewka: nauka bez oceny ruchu i bez sprawdzania zmiany oświetlenia;
+            # pierwsza klatka zastępuje model w całości
+            rate = 1.0 if self.warmup_left == self.warmup else -1
+            self.warmup_left -= 1
+            self.subtractor.apply(gray, learningRate=rate)
+            return 0.0, None
+
+        mask = self.subtractor.apply(gray)
+        ratio = cv2.countNonZero(mask) / mask.size
+
+        if ratio > self.light_change_ratio:
+            # Zmiana oświetlenia - model uczy się nowej sceny od zera
+            self.reset()
+            return self.process(gray)
+
+        return ratio, mask
+
+
+def create_motion_engine(name=MOTION_ENGINE):
+    """Zwraca silnik detekcji ruchu o podanej nazwie"""
+    name = (name or "absdiff").lower()
+    if name == "absdiff":
+        return AbsDiffEngine()
+    if name in ("running_avg", "running_average"):
+        return RunningAverageEngine()
+    if name in ("mog2", "knn"):
+        return SubtractorEngine(name)
+    raise ValueError(f"Nieznany silnik detekcji ruchu: {name}")
+
+
+def motion_bbox(mask, tile=MOTION_TILE_SIZE, min_fill=MOTION_TILE_FILL):
+    """
+    Obszar ruchu na siatce kafelków `tile` x `tile`.
+
+    Kafelek jest aktywny, gdy co najmniej `min_fill` jego pikseli należy do
+    maski (pojedyncze zaszumione piksele nie rozciągają obszaru).
+
+    Returns:
+        (x1, y1, x2, y2) względem rozmiaru maski (0-1) albo None
+    """
+    if mask is None:
+        return None
+    h, w = mask.shape[:2]
+    rows, cols = h // tile, w // tile
+    if rows == 0 or cols == 0:
+        return None
+
+    tiles = mask[:rows * tile, :cols * tile].reshape(rows, tile, cols, tile)
+    active = np.count_nonzero(tiles, axis=(1, 3)) >= tile * tile * min_fill
+    if not active.any():
+        return None
+
+    active_rows = np.flatnonzero(active.any(axis=1))
+    active_cols = np.flatnonzero(active.any(axis=0))
+    return (
+        active_cols[0] * tile / w,
+        active_rows[0] * tile / h,
+        (active_cols[-1] + 1) * tile / w,
+        (active_rows[-1] + 1) * tile / h,
+    )
+
+
+class AdaptiveInterval:
+    """
+    Odstęp pomiędzy próbkami ruchu zależny od aktywności sceny.
+
+    Podczas zdarzenia albo gdy motion_ratio rośnie - próbkowanie co `floor`
+    sekund. W spokoju odstęp rośnie wykładniczo (x `backoff`) do `ceiling`.
+    """
+
+    def __init__(self, floor=MOTION_INTERVAL_MIN, ceiling=MOTION_INTERVAL_MAX,
+                 backoff=MOTION_INTERVAL_BACKOFF, threshold=MOTION_RATIO_THRESHOLD,
+                 history=1000):
+        self.floor = min(floor, ceiling)
+        self.ceiling = max(floor, ceiling)
+        self.backoff = max(1.0, backoff)
+        self.threshold = threshold
+
+        self.interval = self.floor
+        self.prev_ratio = 0.0
+        # (czas, wybrany odstęp) - do strojenia kompromisu CPU / opóźnienie
+        self.history = collections.deque(maxlen=history)
+
+    def update(self, motion_ratio, active, now=None):
+        rising = motion_ratio > self.threshold / 4 and motion_ratio > self.prev_ratio * 1.5
+        self.prev_ratio = motion_ratio
+
+        if active or rising:
+            self.interval = self.floor
+        else:
+            self.interval = min(self.ceiling, self.interval * self.backoff)
+
+        self.history.append((time.time() if now is None else now, self.interval))
+        return self.interval
+
+    def average(self):
+        if not self.history:
+            return self.interval
+        return sum(interval for _, interval in self.history) / len(self.history)
+
+
+def _synthetic_frames(count, width, height, light_every=150, seed=0):
+    """
+    Scena testowa: szum sensora, wolno idący obiekt w drugiej połowie
+    oraz skokowe zmiany jasności co `light_every` klatek.
+    Zwraca (klatka, czy_jest_ruch).
+    """
+    rng = np.random.default_rng(seed)
+    base = cv2.GaussianBlur(
+        rng.integers(40, 200, (height, width), dtype=np.uint8), (21, 21), 0
+    )
+    for i in range(count):
+        frame = base.astype(np.int16)
+        if light_every and (i // light_every) % 2:
+            frame += 40
+        frame += rng.integers(-3, 4, (height, width), dtype=np.int16)
+
+        moving = i >= count // 2
+        if moving:
+            x = int((i - count // 2) * 2) % (width - 30)
+            frame[height // 3:height // 3 + 60, x:x + 30] = 20
+        yield np.clip(frame, 0, 255).astype(np.uint8), moving
+
+
+def benchmark(video=None, frames=600, threshold=0.01):
+    """Porównanie kosztu na klatkę i liczby fałszywych alarmów"""
+    width = int(os.getenv("MOTION_WIDTH", 320))
+    height = int(os.getenv("MOTION_HEIGHT", 240))
+
+    if video:
+        cap = cv2.VideoCapture(video)
+        samples = []
+        while len(samples) < frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            small = cv2.resize(frame, (width, height))
+            samples.append((cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), None))
+        cap.release()
+    else:
+        samples = list(_synthetic_frames(frames, width, height))
+
+    samples = [(cv2.GaussianBlur(gray, (5, 5), 0), moving) for gray, moving in samples]
+
+    print(f"{'silnik':<12} {'ms/klatkę':>10} {'alarmy':>8} {'fałszywe':>9} {'pominięte':>10} {'resety':>7}")
+    for name in ("absdiff", "running_avg", "mog2", "knn"):
+        engine = create_motion_engine(name)
+        triggers = false_triggers = missed = 0
+        start = time.process_time()
+        for gray, moving in samples:
+            ratio, _ = engine.process(gray)
+            detected = ratio > threshold
+            triggers += detected
+            if moving is not None:
+                false_triggers += detected and not moving
+                missed += moving and not detected
+        per_frame = (time.process_time() - start) / max(1, len(samples)) * 1000
+        labelled = video is None
+        print(
+            f"{name:<12} {per_frame:>10.3f} {triggers:>8} "
+            f"{false_triggers if labelled else '-':>9} {missed if labelled else '-':>10} "
+            f"{getattr(engine, 'resets', 1) - 1:>7}"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark silników detekcji ruchu")
+    parser.add_argument("--video", help="plik wideo zamiast sceny syntetycznej")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--threshold", type=float,
+                        default=float(os.getenv("MOTION_RATIO_THRESHOLD", 0.01)))
+    args = parser.parse_args()
+    benchmark(args.video, args.frames, args.threshold)
@@ -0,0 +1,172 @@
+"""
+Zapis każdej próbki ruchu do pierścieniowego pliku MOTION_LOG_FILE.
+
+Plik ma stały rozmiar: nagłówek + MOTION_LOG_CAPACITY rekordów po 13 bajtów
+(czas float64, motion_ratio float32, flagi uint8), zmapowanych do pamięci
+przez numpy.memmap. Zapis próbki to przypisanie do tablicy - bez
+formatowania tekstu i bez wywołań systemowych. Najstarsze próbki są
+nadpisywane.
+
+    python motion_log.py [--last 3600] [--csv próbki.csv]
+
+wypisuje rozkład motion_ratio (do strojenia MOTION_RATIO_THRESHOLD).
+"""
+
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from logger import get_logger
+
+load_dotenv()
+
+MOTION_LOG_FILE = os.getenv("MOTION_LOG_FILE")
+MOTION_LOG_CAPACITY = int(os.getenv("MOTION_LOG_CAPACITY", 500000))
+
+MAGIC = b"WDML0001"
+HEADER_SIZE = 32
+# Nagłówek: magic, pojemność, liczba zapisanych próbek (rośnie bez końca)
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("capacity", "<u8"), ("written", "<u8"), ("reserved", "<u8")])
+RECORD_DTYPE = np.dtype([("time", "<f8"), ("ratio", "<f4"), ("flags", "u1")])
+
+FLAG_RECORDING = 1
+FLAG_MOTION = 2
+
+logger = get_logger("motion_log")
+
+
+class MotionLog:
+    def __init__(self, path=MOTION_LOG_FILE, capacity=MOTION_LOG_CAPACITY, readonly=False):
+        self.path = path
+        self.readonly = readonly
+
+        if readonly:
+            header = np.memmap(path, dtype=HEADER_DTYPE, mode="r", shape=(1,))
+            capacity = int(header[0]["capacity"])
+            if header[0]["magic"] != MAGIC:
+                raise ValueError(f"{path} nie jest plikiem MotionLog")
+        elif not self._compatible(path, capacity):
+            self._create(path, capacity)
+
+        mode = "r" if readonly else "r+"
+        self.header = np.memmap(path, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+        self.records = np.memmap(path, dtype=RECORD_DTYPE, mode=mode, offset=HEADER_SIZE,
+                                 shape=(capacity,))
+        self.capacity = capacity
+
+    @staticmethod
+    def _compatible(path, capacity):
+        expected = HEADER_SIZE + capacity * RECORD_DTYPE.itemsize
+        if not os.path.exists(path) or os.path.getsize(path) != expected:
+            return False
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+
+    @staticmethod
+    def _create(path, capacity):
+        if os.path.exists(path):
+            logger.warning(f"{path} ma inny format lub pojemność - tworzę od nowa")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header[0] = (MAGIC, capacity, 0, 0)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header.tobytes().ljust(HEADER_SIZE, b"\0"))
+            f.truncate(HEADER_SIZE + capacity * RECORD_DTYPE.itemsize)
+        os.replace(tmp_path, path)
+
+    @property
+    def written(self):
+        return int(self.header[0]["written"])
+
+    def append(self, timestamp, ratio, recording=False, motion=False):
+        written = int(self.header[0]["written"])
+        flags = (FLAG_RECORDING if recording else 0) | (FLAG_MOTION if motion else 0)
+        self.records[written % self.capacity] = (timestamp, ratio, flags)
+        # Licznik po rekordzie - czytelnik nigdy nie widzi niezapisanej próbki
+        self.header[0]["written"] = written + 1
+
+    def read(self, start=None, end=None):
+        """
+        Próbki w kolejności chronologicznej, opcjonalnie z przedziału [start, end].
+
+        Returns:
+            tablica numpy z polami time, ratio, flags
+        """
+        written = self.written
+        if written <= self.capacity:
+            samples = np.array(self.records[:written])
+        else:
+            head = written % self.capacity
+            samples = np.concatenate((self.records[head:], self.records[:head]))
+
+        if start is not None or end is not None:
+            times = samples["time"]
+            lo = 0 if start is None else np.searchsorted(times, start, "left")
+            hi = len(samples) if end is None else np.searchsorted(times, end, "right")
+            samples = samples[lo:hi]
+        return samples
+
+    def flush(self):
+        if not self.readonly:
+            self.records.flush()
+            self.header.flush()
+
+    def close(self):
+        self.flush()
+        del self.records
+        del self.header
+
+
+def summary(samples, threshold=None):
+    """Rozkład motion_ratio - jaki próg oddzieliłby szum od ruchu"""
+    if len(samples) == 0:
+        return {}
+    ratios = samples["ratio"]
+    result = {
+        "samples": len(samples),
+        "from": samples["time"][0],
+        "to": samples["time"][-1],
+        "recording_share": float(np.mean((samples["flags"] & FLAG_RECORDING) > 0)),
+    }
+    for pct in (50, 90, 99, 99.9):
+        result[f"p{pct}"] = float(np.percentile(ratios, pct))
+    if threshold is not None:
+        result["above_threshold"] = int(np.count_nonzero(ratios > threshold))
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Podsumowanie próbek ruchu z MOTION_LOG_FILE")
+    parser.add_argument("--file", default=MOTION_LOG_FILE)
+    parser.add_argument("--last", type=float, help="tylko ostatnie N sekund")
+    parser.add_argument("--threshold", type=float,
+                        default=float(os.getenv("MOTION_RATIO_THRESHOLD", 0.01)))
+    parser.add_argument("--csv", help="zapis próbek do CSV (czas, ratio, nagrywanie, ruch)")
+    args = parser.parse_args()
+
+    log = MotionLog(args.file, readonly=True)
+    samples = log.read(start=time.time() - args.last if args.last else None)
+    stats = summary(samples, args.threshold)
+    if not stats:
+        print("Brak próbek")
+    else:
+        print(f"próbek: {stats['samples']} "
+              f"({datetime.fromtimestamp(stats['from'])} - {datetime.fromtimestamp(stats['to'])})")
+        print(f"nagrywanie: {stats['recording_share']:.1%} próbek")
+        for key in ("p50", "p90", "p99", "p99.9"):
+            print(f"{key:>6}: {stats[key]:.4f}")
+        print(f"powyżej progu {args.threshold}: {stats['above_threshold']}")
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write("time,ratio,recording,motion\n")
+            for sample in samples:
+                f.write(
+                    f"{sample['time']:.3f},{sample['ratio']:.5f},"
+                    f"{int(bool(sample['flags'] & FLAG_RECORDING))},{int(bool(sample['flags'] & FLAG_MOTION))}\n"
+                )
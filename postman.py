@@ -7,6 +7,8 @@ from dotenv import load_dotenv
 from urllib.parse import urlparse
 
 from uniwersal import start_script
+from connectivity import is_online
+from supervisor import instance_pid
 
 app = Flask(__name__)
 load_dotenv()
@@ -97,21 +99,22 @@ def connect_to_wifi(ssid, password=None):
         return False
 
 def check_internet():
-    """Sprawdza dostęp do internetu"""
+    """Sprawdza dostęp do internetu (połączenia TCP do CONNECTIVITY_TARGETS, bez ping)"""
     try:
-        result = subprocess.run(
-            ['ping', '-c', '1', '-W', '3', '8.8.8.8'],
-            capture_output=True,
-            timeout=5
-        )
-        logger.info(f'status sprawdzenie połączenia: {result}')
-        return result.returncode == 0
-    except:
+        online = is_online()
+        logger.info(f'status sprawdzenie połączenia: {online}')
+        return online
+    except Exception as e:
+        logger.error(f'Błąd sprawdzania połączenia: {e}')
         return False
 
 def enable_worker_cron():
     """Zarządza cronami w zależności od dostępu do internetu"""
     try:
+        if instance_pid("father"):
+            # Father wykryje połączenie i sam uruchomi workera pod nadzorem
+            logger.info("Workera uruchomi father")
+            return True
         status_worker = start_script(WORKER_SCRIPT, logger, WORKER_ENV_PATH)
         if status_worker:
             logger.info(f"Załączono wokera: {WORKER_SCRIPT}")
@@ -0,0 +1,322 @@
+"""
+Bufor pre-roll: stale otwarty strumień (stream copy do MPEG-TS) trzymany
+w pamięci przez ostatnie PREROLL_SECONDS sekund.
+
+Bufor dzielony jest na GOP-y zaczynające się od klatki kluczowej, więc
+nagranie po wyzwoleniu zaczyna się od pełnej klatki sprzed wykrycia
+ruchu, a dalej leci na żywo z tego samego strumienia. Gdy czytnik nie ma
+strumienia (łączy się, czeka po awarii), nagranie idzie wprost z RTSP,
+jak bez pre-rollu.
+"""
+
+import collections
+import os
+import subprocess
+import threading
+import time
+
+from dotenv import load_dotenv
+from logger import get_logger
+from supervisor import write_pid_file, remove_pid_file
+import metrics
+
+load_dotenv()
+
+PREROLL_SECONDS = float(os.getenv("PREROLL_SECONDS", 0))
+PREROLL_MAX_BYTES = int(os.getenv("PREROLL_MAX_BYTES", 16 * 1024 * 1024))
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# ffmpeg nadaje PID-y od 0x100 w kolejności strumieni (wideo mapujemy jako pierwsze)
+TS_PAT_PID = 0x0000
+TS_PMT_PID = 0x1000
+TS_VIDEO_PID = 0x0100
+READ_SIZE = TS_PACKET_SIZE * 64
+
+logger = get_logger("preroll")
+
+
+def _packet_pid(packet):
+    return ((packet[1] & 0x1F) << 8) | packet[2]
+
+
+def _is_random_access(packet):
+    """Flaga random_access_indicator z adaptation field (klatka kluczowa)"""
+    has_adaptation = packet[3] & 0x20
+    return bool(has_adaptation and packet[4] > 0 and packet[5] & 0x40)
+
+
+class PrerollBuffer:
+    def __init__(self, stream_url, seconds=PREROLL_SECONDS, max_bytes=PREROLL_MAX_BYTES, pid_file=None):
+        """
+        Args:
+            pid_file: plik z PID czytnika strumienia - po zabiciu workera kolejny kończy pozostały proces
+        """
+        self.stream_url = stream_url
+        self.pid_file = pid_file
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.gops = collections.deque()  # [czas_startu, bytearray]
+        self.buffered_bytes = 0
+        self.pat = None
+        self.pmt = None
+        self.partial = b""
+
+        self.reader_proc = None
+        self.reader_thread = None
+        self.stop_event = threading.Event()
+
+        # Czytnik odbiera dane - bez tego nagranie idzie wprost z RTSP
+        self.connected = False
+        self.writer = None
+        self.writer_pending = False
+        self.writer_failed = False
+        # Nagranie wprost z RTSP (czytnik nie miał strumienia przy starcie)
+        self.direct = None
+
+    # --- czytanie strumienia ---
+
+    def start(self):
+        if self.reader_thread and self.reader_thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.reader_thread = threading.Thread(target=self._run, daemon=True)
+        self.reader_thread.start()
+        logger.info(f"Pre-roll: {self.seconds}s, limit {self.max_bytes // 1024} KiB")
+
+    def stop(self):
+        self.stop_event.set()
+        self.stop_recording()
+        self._kill_reader()
+        if self.reader_thread and self.reader_thread.is_alive():
+            self.reader_thread.join(timeout=3)
+        remove_pid_file(self.pid_file)
+
+    def _spawn_reader(self):
+        cmd = [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-rtsp_transport", "tcp",
+            "-i", self.stream_url,
+            "-map", "0:v:0",
+            "-map", "0:a?",
+            "-c", "copy",
+            "-f", "mpegts",
+            "pipe:1",
+        ]
+        metrics.counter("watchdog_ffmpeg_spawns_total", "Uruchomienia procesów ffmpeg", {"role": "preroll_reader"}).inc()
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+        )
+        write_pid_file(self.pid_file, proc.pid)
+        return proc
+
+    def _kill_reader(self):
+        proc = self.reader_proc
+        if proc and proc.poll() is None:
+            try:
+                proc.terminate()
+                proc.wait(timeout=3)
+            except Exception:
+                proc.kill()
+
+    def _run(self):
+        backoff = 1
+        while not self.stop_event.is_set():
+            try:
+                self.reader_proc = self._spawn_reader()
+                logger.info(f"Pre-roll: czytnik strumienia uruchomiony (PID: {self.reader_proc.pid})")
+                while not self.stop_event.is_set():
+                    chunk = self.reader_proc.stdout.read1(READ_SIZE)
+                    if not chunk:
+                        break
+                    self.connected = True
+                    self._feed(chunk)
+                    backoff = 1
+            except Exception as e:
+                logger.error(f"Pre-roll: błąd czytnika strumienia: {e}")
+            finally:
+                self._kill_reader()
+
+            if self.stop_event.is_set():
+                break
+            with self.lock:
+                self.connected = False
+                self.gops.clear()
+                self.buffered_bytes = 0
+                self.partial = b""
+            logger.warning(f"Pre-roll: strumień przerwany, ponowienie za {backoff}s")
+            self.stop_event.wait(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _feed(self, chunk):
+        data = self.partial + chunk
+        usable = len(data) - len(data) % TS_PACKET_SIZE
+        self.partial = data[usable:]
+        now = time.time()
+        # Zapis do ffmpeg poza blokadą - wolny zapis nie wstrzymuje stop_recording()
+        chunks = []
+
+        with self.lock:
+            if self.writer_pending:
+                chunks = self._preroll_chunks()
+
+            gop = self.gops[-1][1] if self.gops else None
+            for offset in range(0, usable, TS_PACKET_SIZE):
+                packet = data[offset:offset + TS_PACKET_SIZE]
+                if packet[0] != TS_SYNC_BYTE:
+                    continue
+                pid = _packet_pid(packet)
+                if pid == TS_PAT_PID:
+                    self.pat = packet
+                elif pid == TS_PMT_PID:
+                    self.pmt = packet
+                elif pid == TS_VIDEO_PID and packet[1] & 0x40 and _is_random_access(packet):
+                    gop = bytearray()
+                    self.gops.append([now, gop])
+
+                if gop is not None:
+                    gop += packet
+                    self.buffered_bytes += TS_PACKET_SIZE
+
+            writer = self.writer if not self.writer_failed else None
+            if writer:
+                chunks.append(data[:usable])
+
+            self._trim(now)
+
+        if writer:
+            self._write(writer, chunks)
+
+    def _trim(self, now):
+        # Zostaje GOP obejmujący moment (now - seconds) i wszystkie nowsze
+        while len(self.gops) > 1 and (
+            self.buffered_bytes > self.max_bytes or self.gops[1][0] <= now - self.seconds
+        ):
+            _, gop = self.gops.popleft()
+            self.buffered_bytes -= len(gop)
+
+    # --- nagrywanie ---
+
+    def start_recording(self, output_file):
+        """Uruchamia zapis: najpierw zawartość bufora, potem strumień na żywo"""
+        with self.lock:
+            buffered = self.connected and bool(self.gops)
+        if not buffered:
+            return self._start_direct(output_file)
+
+        cmd = [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-f", "mpegts",
+            "-i", "pipe:0",
+            "-map", "0",
+            "-c", "copy",
+            "-avoid_negative_ts", "make_zero",
+            "-fflags", "+genpts",
+            output_file,
+        ]
+        metrics.counter("watchdog_ffmpeg_spawns_total", "Uruchomienia procesów ffmpeg", {"role": "recording"}).inc()
+        # bufsize=0: close() w stop_recording nie czeka na blokadę bufora trwającego zapisu
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            bufsize=0,
+        )
+        with self.lock:
+            self.writer = proc
+            self.writer_failed = False
+            # Bufor zapisuje wątek czytnika, żeby nie blokować wątku ruchu
+            self.writer_pending = True
+        return proc
+
+    def _start_direct(self, output_file):
+        """Nagranie wprost z RTSP - czytnik nie ma strumienia, więc nie ma też pre-rollu"""
+        logger.warning("Pre-roll: brak strumienia w buforze - nagrywanie wprost z RTSP")
+        cmd = [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-rtsp_transport", "tcp",
+            "-i", self.stream_url,
+            "-c:v", "copy",
+            "-avoid_negative_ts", "make_zero",
+            "-fflags", "+genpts",
+            output_file,
+        ]
+        metrics.counter("watchdog_ffmpeg_spawns_total", "Uruchomienia procesów ffmpeg", {"role": "recording"}).inc()
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        with self.lock:
+            self.direct = proc
+        return proc
+
+    def _preroll_chunks(self):
+        """Kopia bufora do zapisu na początku nagrania (pod self.lock)"""
+        self.writer_pending = False
+        chunks = []
+        if self.pat and self.pmt:
+            chunks.append(self.pat + self.pmt)
+        chunks.extend(bytes(gop) for _, gop in self.gops)
+        seconds = time.time() - self.gops[0][0] if self.gops else 0
+        logger.info(f"Pre-roll: zapisano {self.buffered_bytes // 1024} KiB ({seconds:.1f}s)")
+        return chunks
+
+    def _write(self, proc, chunks):
+        try:
+            for chunk in chunks:
+                view = memoryview(chunk)
+                while view:
+                    written = proc.stdin.write(view)
+                    view = view[written:]
+        except (BrokenPipeError, OSError, ValueError) as e:
+            with self.lock:
+                if self.writer is not proc:
+                    # stop_recording() zamknął już wejście - koniec zapisu jest zamierzony
+                    return
+                # Proces zostaje w self.writer - stop_recording() go zamknie i odbierze
+                self.writer_failed = True
+            logger.error(f"Pre-roll: zapis do ffmpeg przerwany: {e}")
+
+    def stop_recording(self, timeout=5):
+        """
+        Returns:
+            False gdy zapis się nie powiódł (nagranie może być niekompletne), None bez nagrania
+        """
+        with self.lock:
+            proc = self.writer
+            failed = self.writer_failed
+            direct = self.direct
+            self.writer = None
+            self.writer_pending = False
+            self.writer_failed = False
+            self.direct = None
+
+        if direct:
+            # ffmpeg zamyka plik MP4 po SIGTERM
+            direct.terminate()
+            proc = direct
+        elif proc:
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+        else:
+            return None
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            return False
+        return not failed and proc.returncode in (0, -15, 255)
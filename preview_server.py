@@ -0,0 +1,150 @@
+"""
+Lokalny podgląd kamery po HTTP na podstawie MotionRecorder.preview_frames.
+
+    /snapshot.jpg  - ostatnia klatka
+    /stream.mjpg   - strumień MJPEG
+
+Każda nowa klatka kodowana jest do JPEG co najwyżej raz, niezależnie od
+liczby oglądających, i to w wątku serwera - nie w wątku detekcji ruchu.
+"""
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+from dotenv import load_dotenv
+from logger import get_logger
+import metrics
+
+load_dotenv()
+
+# 0 = podgląd wyłączony
+PREVIEW_PORT = int(os.getenv("PREVIEW_PORT", 0))
+PREVIEW_HOST = os.getenv("PREVIEW_HOST", "127.0.0.1")
+PREVIEW_MAX_FPS = float(os.getenv("PREVIEW_MAX_FPS", 2))
+PREVIEW_WIDTH = int(os.getenv("PREVIEW_WIDTH", 640))
+PREVIEW_JPEG_QUALITY = int(os.getenv("PREVIEW_JPEG_QUALITY", 70))
+
+BOUNDARY = "watchdogframe"
+
+logger = get_logger("preview")
+
+PREVIEW_ENCODE_TIME = metrics.histogram("watchdog_preview_encode_seconds", "Kodowanie JPEG podglądu")
+
+
+class PreviewEncoder:
+    """Pamięć podręczna JPEG ostatniej klatki, wspólna dla wszystkich klientów"""
+
+    def __init__(self, recorder, width=PREVIEW_WIDTH, quality=PREVIEW_JPEG_QUALITY):
+        self.recorder = recorder
+        self.width = width
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.seq = -1
+        self.jpeg = None
+        self.encoded = 0
+
+    def latest(self):
+        """Zwraca (numer_klatki, jpeg); koduje tylko, gdy pojawiła się nowa klatka"""
+        seq, frame = self.recorder.preview_frames.latest()
+        with self.lock:
+            if seq != self.seq and frame is not None:
+                h, w = frame.shape[:2]
+                if w > self.width:
+                    frame = cv2.resize(frame, (self.width, int(h * self.width / w)),
+                                       interpolation=cv2.INTER_AREA)
+                with PREVIEW_ENCODE_TIME.time():
+                    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if ok:
+                    self.jpeg = encoded.tobytes()
+                    self.seq = seq
+                    self.encoded += 1
+            return self.seq, self.jpeg
+
+    def wait(self, after_seq, timeout):
+        """Czeka na klatkę nowszą niż `after_seq` (bez kodowania)"""
+        self.recorder.preview_frames.wait(after_seq, timeout)
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    encoder = None
+    max_fps = PREVIEW_MAX_FPS
+    stopping = None
+
+    def do_GET(self):
+        if self.path in ("/", "/snapshot.jpg"):
+            self.send_snapshot()
+        elif self.path == "/stream.mjpg":
+            self.send_stream()
+        else:
+            self.send_error(404)
+
+    def send_snapshot(self):
+        _, jpeg = self.encoder.latest()
+        if jpeg is None:
+            self.send_error(503, "Brak klatki")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(jpeg)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(jpeg)
+
+    def send_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+
+        min_gap = 1.0 / self.max_fps if self.max_fps > 0 else 0
+        last_seq = None
+        try:
+            while not self.stopping.is_set():
+                started = time.monotonic()
+                seq, jpeg = self.encoder.latest()
+                if jpeg is not None and seq != last_seq:
+                    self.wfile.write(
+                        f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                        f"Content-Length: {len(jpeg)}\r\n\r\n".encode()
+                    )
+                    self.wfile.write(jpeg)
+                    self.wfile.write(b"\r\n")
+                    last_seq = seq
+                    # Limit klatek na klienta
+                    self.stopping.wait(max(0.0, min_gap - (time.monotonic() - started)))
+                else:
+                    # Brak nowej klatki - czekanie na następną z detekcji ruchu
+                    self.encoder.wait(max(seq, 0), 0.5)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class PreviewServer:
+    def __init__(self, recorder, port=PREVIEW_PORT, host=PREVIEW_HOST, max_fps=PREVIEW_MAX_FPS):
+        self.stopping = threading.Event()
+        self.encoder = PreviewEncoder(recorder)
+        handler = type(
+            "BoundPreviewHandler",
+            (PreviewHandler,),
+            {"encoder": self.encoder, "max_fps": max_fps, "stopping": self.stopping},
+        )
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        logger.info(f"Podgląd: http://{host}:{port}/stream.mjpg")
+
+    def stop(self):
+        self.stopping.set()
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,337 @@
+"""
+Katalog nagrań (SQLite) i sprzątanie OUTPUT_DIR.
+
+Każde nagranie dostaje wpis przy starcie (status "recording"), a po
+obróbce uzupełniane są długość, rozmiar i miniatura. Wyszukiwanie po
+czasie nie wymaga listowania katalogu ani parsowania nazw plików.
+
+RetentionManager w tle usuwa najstarsze dane (nagrania, zdjęcia twarzy,
+segmenty, zgłoszenia kolejki wysyłek), gdy przekroczony jest limit bajtów,
+wieku lub spada wolne miejsce na dysku - zawsze to, co najstarsze, bez
+względu na rodzaj.
+Wpisy "recording" po zabitym workerze zamyka reconcile() przy starcie.
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from logger import get_logger
+
+load_dotenv()
+
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/tmp")
+RECORDINGS_DB = os.getenv("RECORDINGS_DB") or os.path.join(OUTPUT_DIR, "recordings.db")
+# 0 = brak limitu
+RETENTION_MAX_MB = int(os.getenv("RETENTION_MAX_MB", 0))
+RETENTION_MAX_DAYS = float(os.getenv("RETENTION_MAX_DAYS", 0))
+RETENTION_MIN_FREE_MB = int(os.getenv("RETENTION_MIN_FREE_MB", 500))
+RETENTION_CHECK_INTERVAL = int(os.getenv("RETENTION_CHECK_INTERVAL", 300))
+
+RECORDING_PREFIX = "motion_rec_"
+RECORDING_NAME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+logger = get_logger("recordings")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    path        TEXT PRIMARY KEY,
+    started_at  REAL NOT NULL,
+    ended_at    REAL,
+    duration    REAL,
+    size        INTEGER,
+    thumbnail   TEXT,
+    status      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recordings_started_at ON recordings (started_at);
+"""
+
+
+class RecordingCatalog:
+    def __init__(self, db_path=RECORDINGS_DB):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        # Wpisy "recording" starsze niż otwarcie katalogu należą do poprzedniego procesu
+        self.opened_at = time.time()
+        with self.lock, self.db:
+            # WAL: mniej zapisów na kartę SD i odczyty nie blokują zapisu
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(_SCHEMA)
+
+    def add(self, path, started_at):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO recordings (path, started_at, status) VALUES (?, ?, 'recording')",
+                (path, started_at),
+            )
+
+    def finish(self, path, ended_at=None, duration=None, size=None, thumbnail=None):
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE recordings SET ended_at = ?, duration = ?, size = ?, thumbnail = ?, "
+                "status = 'done' WHERE path = ?",
+                (ended_at or time.time(), duration, size, thumbnail, path),
+            )
+
+    def remove(self, path):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM recordings WHERE path = ?", (path,))
+
+    def between(self, start=0, end=None):
+        """Nagrania nachodzące na przedział [start, end] (czas unix), od najstarszego"""
+        end = time.time() if end is None else end
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM recordings WHERE started_at <= ? AND COALESCE(ended_at, ?) >= ? "
+                "ORDER BY started_at",
+                (end, end, start),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def oldest(self, limit=50):
+        """Zakończone nagrania od najstarszego (kandydaci do usunięcia)"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM recordings WHERE status = 'done' ORDER BY started_at LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def total_size(self):
+        with self.lock:
+            row = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM recordings").fetchone()
+        return row[0]
+
+    def reconcile(self, before=None):
+        """
+        Zamyka wpisy "recording" pozostawione przez proces zabity w trakcie
+        nagrania: plik, który istnieje, dostaje rozmiar i status "done" (podlega
+        retencji), wpis bez pliku jest usuwany.
+
+        Args:
+            before: tylko nagrania rozpoczęte wcześniej; domyślnie otwarcie katalogu
+
+        Returns:
+            (zamknięte, usunięte)
+        """
+        before = self.opened_at if before is None else before
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path FROM recordings WHERE status = 'recording' AND started_at < ?",
+                (before,),
+            ).fetchall()
+        closed = dropped = 0
+        for (path,) in rows:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.remove(path)
+                dropped += 1
+                continue
+            except OSError as e:
+                logger.error(f"Nie można sprawdzić {path}: {e}")
+                continue
+            with self.lock, self.db:
+                self.db.execute(
+                    "UPDATE recordings SET ended_at = ?, size = ?, status = 'done' "
+                    "WHERE path = ? AND status = 'recording'",
+                    (stat.st_mtime, stat.st_size, path),
+                )
+            closed += 1
+        if closed or dropped:
+            logger.warning(f"Przerwane nagrania: zamknięto {closed}, usunięto {dropped} wpisów bez pliku")
+        return closed, dropped
+
+    def import_directory(self, directory=OUTPUT_DIR):
+        """Dopisuje do katalogu nagrania sprzed jego istnienia (czas z nazwy pliku)"""
+        with self.lock:
+            known = {row[0] for row in self.db.execute("SELECT path FROM recordings")}
+        added = 0
+        for entry in os.scandir(directory):
+            if not entry.is_file() or entry.path in known:
+                continue
+            name = entry.name
+            if not (name.startswith(RECORDING_PREFIX) and name.endswith(".mp4")):
+                continue
+            try:
+                started_at = datetime.strptime(
+                    name[len(RECORDING_PREFIX):-len(".mp4")], RECORDING_NAME_FORMAT
+                ).timestamp()
+            except ValueError:
+                continue
+            thumbnail = os.path.splitext(entry.path)[0] + ".jpg"
+            stat = entry.stat()
+            with self.lock, self.db:
+                self.db.execute(
+                    "INSERT OR IGNORE INTO recordings (path, started_at, ended_at, size, thumbnail, status) "
+                    "VALUES (?, ?, ?, ?, ?, 'done')",
+                    (entry.path, started_at, stat.st_mtime, stat.st_size,
+                     thumbnail if os.path.exists(thumbnail) else None),
+                )
+            added += 1
+        if added:
+            logger.info(f"Dodano do katalogu {added} wcześniejszych nagrań")
+        return added
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def _dir_bytes(path):
+    """Rozmiar plików w katalogu (rekurencyjnie); 0 gdy katalogu nie ma"""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += _dir_bytes(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                total += entry.stat().st_size
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def _remove_file(path):
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+class RetentionManager:
+    def __init__(self, catalog, output_dir=OUTPUT_DIR, face_dir=None,
+                 max_bytes=RETENTION_MAX_MB * 1024 * 1024,
+                 max_age=RETENTION_MAX_DAYS * 24 * 3600,
+                 min_free=RETENTION_MIN_FREE_MB * 1024 * 1024,
+                 interval=RETENTION_CHECK_INTERVAL, stores=()):
+        """
+        Args:
+            stores: inne dane na dysku (SegmentStore, UploadSpool) z atrybutem
+                storage_dir i metodami oldest_time() -> czas unix albo None
+                oraz remove_oldest() -> zwolnione bajty
+        """
+        self.catalog = catalog
+        self.output_dir = output_dir
+        self.face_dir = face_dir or os.path.join(output_dir, "faces")
+        self.stores = [store for store in stores if store is not None]
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_free = min_free
+        self.interval = interval
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _face_files(self):
+        """Zdjęcia twarzy jako (czas, ścieżka, rozmiar), od najstarszego"""
+        if not os.path.isdir(self.face_dir):
+            return []
+        files = []
+        for entry in os.scandir(self.face_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        files.sort()
+        return files
+
+    def _free_bytes(self):
+        """Najmniej wolnego miejsca na dyskach OUTPUT_DIR i pozostałych danych"""
+        free = shutil.disk_usage(self.output_dir).free
+        for store in self.stores:
+            if os.path.isdir(store.storage_dir):
+                free = min(free, shutil.disk_usage(store.storage_dir).free)
+        return free
+
+    def _over_limit(self, oldest_time, used, free, now):
+        if self.max_age and oldest_time < now - self.max_age:
+            return True
+        if self.max_bytes and used > self.max_bytes:
+            return True
+        if self.min_free and free < self.min_free:
+            return True
+        return False
+
+    def enforce(self, now=None):
+        """Usuwa najstarsze dane, dopóki którykolwiek limit jest przekroczony"""
+        now = time.time() if now is None else now
+        faces = self._face_files()
+        used = self.catalog.total_size() + sum(size for _, _, size in faces)
+        used += sum(_dir_bytes(store.storage_dir) for store in self.stores)
+        # Wolne miejsce mierzone raz, potem doliczane usunięte bajty (bez statvfs w pętli)
+        free = self._free_bytes() if self.min_free else 0
+        freed = 0
+        removed = 0
+
+        while True:
+            # Kandydaci: (czas, rodzaj, dane) - usuwany jest najstarszy
+            candidates = []
+            recordings = self.catalog.oldest(limit=1)
+            if recordings:
+                candidates.append((recordings[0]["started_at"], "recording", recordings[0]))
+            if faces:
+                candidates.append((faces[0][0], "face", faces[0]))
+            for store in self.stores:
+                oldest = store.oldest_time()
+                if oldest is not None:
+                    candidates.append((oldest, "store", store))
+            if not candidates:
+                break
+
+            oldest_time, kind, item = min(candidates, key=lambda candidate: candidate[0])
+            if not self._over_limit(oldest_time, used, free + freed, now):
+                break
+
+            if kind == "face":
+                faces.pop(0)
+                size = _remove_file(item[1])
+                used -= item[2]
+            elif kind == "recording":
+                size = _remove_file(item["path"])
+                if item["thumbnail"]:
+                    size += _remove_file(item["thumbnail"])
+                self.catalog.remove(item["path"])
+                used -= item["size"] or 0
+            else:
+                size = item.remove_oldest()
+                used -= size
+            freed += size
+            removed += 1
+
+        if removed:
+            logger.info(f"Retencja: usunięto {removed} plików, zwolniono {freed / 1024 / 1024:.1f} MB")
+        return removed
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"Błąd sprzątania nagrań: {e}")
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Odtwarzanie lokalnych plików MP4/MJPEG przez pipeline workera
+(capture_frames -> motion_detection -> detect_faces_mediapipe)
+bez kamery, mediamtx, ffmpeg i serwera.
+
+Przykład:
+    python replay.py nagranie.mp4 --speed 4
+"""
+
+import argparse
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+
+# Worker przy imporcie tworzy katalogi z OUTPUT_DIR - przy odtwarzaniu
+# wszystko ląduje w katalogu tymczasowym
+_REPLAY_DIR = tempfile.mkdtemp(prefix="watchdog_replay_")
+os.environ["OUTPUT_DIR"] = _REPLAY_DIR
+os.environ["PID_FILE"] = os.path.join(_REPLAY_DIR, "record_ffmpeg.pid")
+# Próbki ruchu z odtwarzania do strojenia progu: python motion_log.py --file ...
+os.environ["MOTION_LOG_FILE"] = os.path.join(_REPLAY_DIR, "motion.ring")
+# Bez ffmpeg i serwera: pre-roll i segmenty czytałyby strumień ffmpegiem,
+# a kolejki wysyłek zastępuje ReplayUploader
+os.environ["PREROLL_SECONDS"] = "0"
+os.environ["RECORDING_MODE"] = "events"
+os.environ["VIDEO_UPLOAD"] = "0"
+os.environ["UPLOAD_SPOOL_DIR"] = os.path.join(_REPLAY_DIR, "upload_spool")
+
+import cv2
+from capture import LazyOpenCVCapture
+from worker import MotionRecorder, MotionScheduler, logger
+
+
+class ReplayClock:
+    """Zegar płynący `speed` razy szybciej od rzeczywistego"""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.wall_start = time.time()
+        self.virtual_start = self.wall_start
+
+    def __call__(self):
+        return self.virtual_start + (time.time() - self.wall_start) * self.speed
+
+
+class PacedCapture:
+    """Opakowanie cv2.VideoCapture oddające klatki w tempie nagrania"""
+
+    def __init__(self, path, speed):
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else 25.0
+        self.speed = speed
+        self.frames = 0
+        self.finished = threading.Event()
+        self.start = None
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def set(self, prop, value):
+        return True
+
+    def read(self):
+        if self.finished.is_set():
+            return False, None
+
+        if self.start is None:
+            self.start = time.time()
+        due = self.start + self.frames / (self.fps * self.speed)
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        ret, frame = self.cap.read()
+        if not ret:
+            self.finished.set()
+            return False, None
+        self.frames += 1
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class StallingCapture(PacedCapture):
+    """
+    PacedCapture z grab()/retrieve() dla opencv_lazy, którego grab() po
+    `stall_after` klatkach blokuje `stall_seconds` s jak zawieszony strumień
+    (CAP_PROP_READ_TIMEOUT_MSEC)
+    """
+
+    def __init__(self, path, speed, stall_after, stall_seconds):
+        super().__init__(path, speed)
+        self.stall_after = stall_after
+        self.stall_seconds = stall_seconds
+        self.frame = None
+
+    def grab(self):
+        if self.frames >= self.stall_after:
+            time.sleep(self.stall_seconds)
+            return False
+        ok, self.frame = self.read()
+        return ok
+
+    def retrieve(self):
+        return self.frame is not None, self.frame
+
+
+class ReplayUploader:
+    """Zamiennik UploadSpool: zapamiętuje zlecone wysyłki zamiast wysyłać je na serwer"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue_json(self, endpoint, data):
+        self.jobs.append((endpoint, data, None))
+
+    def enqueue_file(self, endpoint, data, content, filename, content_type):
+        self.jobs.append((endpoint, data, filename))
+
+    def pending(self):
+        return 0
+
+    def start(self):
+        pass
+
+    def stop(self, timeout=3):
+        pass
+
+
+class ReplayRecorder(MotionRecorder):
+    """MotionRecorder z lokalnymi zamiennikami ffmpeg i wysyłki"""
+
+    def __init__(self, path, speed=1.0, save_faces=False, camera_id=None, stall_after=None,
+                 stall_seconds=5.0):
+        """
+        Args:
+            camera_id: nazwa kamery przy kilku odtwarzaniach naraz (osobne katalogi)
+            stall_after: po tylu klatkach strumień się zawiesza (opencv_lazy); None = nigdy
+        """
+        self.path = path
+        self.speed = speed
+        self.save_faces = save_faces
+        self.stall_after = stall_after
+        self.stall_seconds = stall_seconds
+        self.capture = None
+
+        self.motion_checks = 0
+        self.motion_check_times = []
+        self.face_detections = 0
+        self.recordings = 0
+        self.record_latencies = []
+
+        if camera_id:
+            super().__init__(stream_url=path, camera_id=camera_id,
+                             output_dir=os.path.join(_REPLAY_DIR, camera_id))
+        else:
+            super().__init__(stream_url=path)
+        self.clock = ReplayClock(speed)
+        self.time_scale = speed
+        # Nic nie może sięgać po ffmpeg ani serwer, niezależnie od env
+        self.preroll = None
+        self.segment_store = None
+        self.shared.uploader = self.uploader = self.finalizer.uploader = ReplayUploader()
+        self.shared.video_uploader = self.video_uploader = self.finalizer.video_uploader = None
+        # Koniec pliku to nie zawieszenie strumienia - bez ponownego otwierania
+        self.capture_stall_seconds = float("inf")
+
+        engine_process = self.motion_engine.process
+
+        def counted_process(gray):
+            self.motion_checks += 1
+            self.motion_check_times.append(time.monotonic())
+            return engine_process(gray)
+
+        self.motion_engine.process = counted_process
+
+    def ensure_mediamtx_running(self, max_retries=3, wait_time=2):
+        return True
+
+    def open_capture(self):
+        if self.stall_after is not None:
+            self.capture = LazyOpenCVCapture(
+                self.path, cap=StallingCapture(self.path, self.speed, self.stall_after, self.stall_seconds)
+            )
+        else:
+            self.capture = PacedCapture(self.path, self.speed)
+        return self.capture
+
+    def start_ffmpeg_recording(self):
+        if self.recording:
+            return
+        # Opóźnienie w czasie rzeczywistym, niezależnie od przyspieszenia
+        latency = (self.clock() - self.motion_frame_time) / self.speed
+        self.record_latencies.append(latency)
+        self.recordings += 1
+        self.current_output_file = os.path.join(_REPLAY_DIR, f"replay_rec_{self.recordings}.mp4")
+        self.recording = True
+        logger.info(f"[replay] nagrywanie {self.recordings}, opóźnienie {latency * 1000:.1f} ms")
+
+    def stop_ffmpeg_recording(self):
+        self.curent_detected_faces = 0
+        self.recording = False
+
+    def save_face(self, face_img):
+        if face_img is None or face_img.size == 0:
+            return
+        self.curent_detected_faces += 1
+        self.face_detections += 1
+        if self.save_faces:
+            cv2.imwrite(os.path.join(self.face_output_dir, f"face_{self.face_detections}.jpg"), face_img)
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_replay(path, speed=1.0, save_faces=False):
+    """Odtwarza plik i zwraca słownik z wynikami"""
+    recorder = ReplayRecorder(path, speed=speed, save_faces=save_faces)
+    wall_start = time.time()
+    cpu_start = time.process_time()
+    recorder.start_motion_detection()
+
+    while recorder.capture is None or not recorder.capture.finished.is_set():
+        time.sleep(0.1)
+    # Ostatnia klatka musi jeszcze przejść przez detekcję ruchu
+    time.sleep(recorder.motion_interval.ceiling / speed + 0.1)
+
+    wall = time.time() - wall_start
+    cpu = time.process_time() - cpu_start
+    recorder.stop_motion_detection()
+
+    frames = recorder.capture.frames
+    return {
+        "file": path,
+        "speed": speed,
+        "frames": frames,
+        "wall_s": round(wall, 3),
+        "capture_fps": round(frames / wall, 2) if wall else None,
+        "motion_checks": recorder.motion_checks,
+        "motion_checks_per_s": round(recorder.motion_checks / wall, 2) if wall else None,
+        "motion_interval_avg_s": round(recorder.motion_interval.average(), 3),
+        "cpu_s": round(cpu, 3),
+        "recordings": recorder.recordings,
+        "motion_to_record_ms_p50": _ms(_percentile(recorder.record_latencies, 50)),
+        "motion_to_record_ms_max": _ms(max(recorder.record_latencies, default=None)),
+        "face_detections": recorder.face_detections,
+        "uploads": len(recorder.uploader.jobs),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "output_dir": _REPLAY_DIR,
+        "motion_log": os.environ["MOTION_LOG_FILE"],
+        "startup_s": {stage: round(value, 3) for stage, value in recorder.timeline.marks.items()},
+    }
+
+
+def run_scheduler_check(path, speed=1.0, seconds=10.0, stall_seconds=5.0):
+    """
+    Dwie kamery na wspólnym MotionScheduler: "stalled" po kilku klatkach
+    zawiesza się w grab() (opencv_lazy), "healthy" odtwarza plik normalnie.
+    Zawieszona kamera nie może opóźniać próbek zdrowej - największa przerwa
+    między nimi musi się zmieścić w górnym odstępie próbkowania plus limicie
+    jednej próbki.
+    """
+    healthy = ReplayRecorder(path, speed, camera_id="healthy")
+    stalled = ReplayRecorder(path, speed, camera_id="stalled", stall_after=5, stall_seconds=stall_seconds)
+    recorders = [healthy, stalled]
+    scheduler = MotionScheduler(recorders)
+    for recorder in recorders:
+        recorder.start_motion_detection(motion_thread=False)
+    scheduler.start()
+
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if healthy.capture is not None and healthy.capture.finished.is_set():
+            break
+        time.sleep(0.1)
+    scheduler.stop()
+    for recorder in recorders:
+        recorder.stop_motion_detection()
+
+    times = healthy.motion_check_times
+    max_gap = max((b - a for a, b in zip(times, times[1:])), default=None)
+    allowed = healthy.motion_interval.ceiling / speed + scheduler.step_budget
+    return {
+        "file": path,
+        "speed": speed,
+        "stall_seconds": stall_seconds,
+        "healthy_motion_checks": healthy.motion_checks,
+        "stalled_motion_checks": stalled.motion_checks,
+        "healthy_max_gap_s": None if max_gap is None else round(max_gap, 3),
+        "allowed_gap_s": round(allowed, 3),
+        "ok": max_gap is not None and max_gap <= allowed,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Odtwarzanie nagrania przez pipeline workera")
+    parser.add_argument("file", help="plik MP4/MJPEG")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="przyspieszenie względem czasu rzeczywistego (1 = real time)")
+    parser.add_argument("--save-faces", action="store_true",
+                        help="zapisuje wykryte twarze w katalogu tymczasowym")
+    parser.add_argument("--scheduler-check", action="store_true",
+                        help="dwie kamery na wspólnym harmonogramie, jedna z zawieszonym strumieniem")
+    parser.add_argument("--seconds", type=float, default=10,
+                        help="czas sprawdzenia harmonogramu")
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error("--speed musi być większe od 0")
+    if not os.path.exists(args.file):
+        parser.error(f"brak pliku {args.file}")
+
+    if args.scheduler_check:
+        result = run_scheduler_check(args.file, args.speed, args.seconds)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        raise SystemExit(0 if result["ok"] else 1)
+
+    result = run_replay(args.file, args.speed, args.save_faces)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
@@ -0,0 +1,444 @@
+"""
+Ciągłe nagrywanie kamery w krótkich segmentach (stream copy, MPEG-TS).
+
+Indeks `index.csv` mapuje czas zegarowy na segmenty i położenie klatek
+kluczowych w segmencie, `events.csv` przechowuje zdarzenia ruchu.
+clip(start, end) skleja fragment w MP4 bez ponownego kodowania.
+"""
+
+import bisect
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from logger import get_logger
+from supervisor import write_pid_file, remove_pid_file
+import metrics
+
+load_dotenv()
+
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/tmp")
+SEGMENT_DIR = os.getenv("SEGMENT_DIR") or os.path.join(OUTPUT_DIR, "segments")
+SEGMENT_SECONDS = int(os.getenv("SEGMENT_SECONDS", 10))
+SEGMENT_RETENTION_HOURS = float(os.getenv("SEGMENT_RETENTION_HOURS", 24))
+
+INDEX_FILE = "index.csv"
+EVENTS_FILE = "events.csv"
+SEGMENT_LIST_FILE = "segments.list"
+# strftime ffmpeg - czas zegarowy otwarcia segmentu (czas lokalny, z dokładnością do sekundy)
+SEGMENT_NAME_FORMAT = "seg_%Y%m%d_%H%M%S.ts"
+# Przesunięcia z listy segmentów rozjechane z nazwą pliku o więcej = nieciągłość strumienia
+SEGMENT_CLOCK_TOLERANCE = 2
+
+logger = get_logger("segment_store")
+
+
+class Segment:
+    __slots__ = ("name", "start", "duration", "keyframes")
+
+    def __init__(self, name, start, duration, keyframes):
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.keyframes = keyframes  # znaczniki pts klatek kluczowych w pliku segmentu
+
+    @property
+    def base(self):
+        """pts pierwszej klatki (segment zaczyna się od klatki kluczowej)"""
+        return self.keyframes[0] if self.keyframes else 0.0
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    def to_line(self):
+        keyframes = ";".join(f"{k:.3f}" for k in self.keyframes)
+        return f"{self.name},{self.start:.3f},{self.duration:.3f},{keyframes}\n"
+
+    @classmethod
+    def from_line(cls, line):
+        name, start, duration, keyframes = line.rstrip("\n").split(",", 3)
+        return cls(
+            name,
+            float(start),
+            float(duration),
+            [float(k) for k in keyframes.split(";") if k],
+        )
+
+
+class SegmentStore:
+    def __init__(self, stream_url, segment_dir=SEGMENT_DIR, segment_seconds=SEGMENT_SECONDS,
+                 retention_hours=SEGMENT_RETENTION_HOURS, pid_file=None):
+        """
+        Args:
+            pid_file: plik z PID ffmpeg - po zabiciu workera kolejny kończy pozostały proces
+        """
+        self.stream_url = stream_url
+        self.pid_file = pid_file
+        self.segment_dir = segment_dir
+        self.segment_seconds = segment_seconds
+        self.retention = retention_hours * 3600
+
+        self.lock = threading.Lock()
+        self.indexed = threading.Condition(self.lock)
+        self.segments = []
+        self.starts = []
+
+        self.proc = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        # Czas zegarowy odpowiadający chwili 0 strumienia bieżącego ffmpeg
+        self.time_base = None
+
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._load_index()
+
+    # --- indeks ---
+
+    def _path(self, name):
+        return os.path.join(self.segment_dir, name)
+
+    def _load_index(self):
+        index_path = self._path(INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path) as f:
+            for line in f:
+                try:
+                    segment = Segment.from_line(line)
+                except ValueError:
+                    continue
+                if os.path.exists(self._path(segment.name)):
+                    self.segments.append(segment)
+        self.segments.sort(key=lambda s: s.start)
+        self.starts = [s.start for s in self.segments]
+        logger.info(f"Indeks segmentów: {len(self.segments)} pozycji")
+
+    def _add_segment(self, segment):
+        with self.lock:
+            self.segments.append(segment)
+            self.starts.append(segment.start)
+            with open(self._path(INDEX_FILE), "a") as f:
+                f.write(segment.to_line())
+            self.indexed.notify_all()
+
+    def _probe_keyframes(self, path):
+        """Czasy pakietów z flagą K (bez dekodowania obrazu)"""
+        try:
+            result = subprocess.run(
+                [
+                    "ffprobe", "-v", "error",
+                    "-select_streams", "v:0",
+                    "-show_entries", "packet=pts_time,flags",
+                    "-of", "csv=p=0",
+                    path,
+                ],
+                capture_output=True,
+                text=True,
+                timeout=30,
+            )
+        except (subprocess.TimeoutExpired, OSError) as e:
+            # Segment trafia do indeksu bez klatek kluczowych (wycinanie od jego początku)
+            logger.error(f"Nie można odczytać klatek kluczowych {path}: {e}")
+            return []
+        keyframes = []
+        for line in result.stdout.splitlines():
+            parts = line.split(",")
+            if len(parts) >= 2 and "K" in parts[1]:
+                try:
+                    keyframes.append(float(parts[0]))
+                except ValueError:
+                    pass
+        return keyframes
+
+    def prune(self):
+        """Usuwa segmenty starsze niż okres retencji i przepisuje indeks"""
+        cutoff = time.time() - self.retention
+        with self.lock:
+            keep = bisect.bisect_right(self.starts, cutoff)
+            old, self.segments = self.segments[:keep], self.segments[keep:]
+            self.starts = self.starts[keep:]
+            for segment in old:
+                try:
+                    os.remove(self._path(segment.name))
+                except FileNotFoundError:
+                    pass
+            if old:
+                tmp_path = self._path(INDEX_FILE + ".tmp")
+                with open(tmp_path, "w") as f:
+                    f.writelines(s.to_line() for s in self.segments)
+                os.replace(tmp_path, self._path(INDEX_FILE))
+                logger.info(f"Usunięto {len(old)} starych segmentów")
+
+    # --- retencja (RetentionManager) ---
+
+    @property
+    def storage_dir(self):
+        return self.segment_dir
+
+    def oldest_time(self):
+        with self.lock:
+            return self.segments[0].start if self.segments else None
+
+    def remove_oldest(self):
+        """
+        Usuwa najstarszy segment i zwraca zwolnione bajty. Indeks przepisuje
+        prune() - przy wczytaniu pomijane są wpisy bez pliku.
+        """
+        with self.lock:
+            if not self.segments:
+                return 0
+            segment = self.segments.pop(0)
+            self.starts.pop(0)
+        path = self._path(segment.name)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return size
+
+    # --- nagrywanie ciągłe ---
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        proc = self.proc
+        if proc and proc.poll() is None:
+            try:
+                proc.terminate()
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+        remove_pid_file(self.pid_file)
+
+    def _spawn(self, list_path):
+        cmd = [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-rtsp_transport", "tcp",
+            "-i", self.stream_url,
+            "-map", "0:v:0",
+            "-map", "0:a?",
+            "-c", "copy",
+            "-f", "segment",
+            "-segment_time", str(self.segment_seconds),
+            "-segment_format", "mpegts",
+            "-segment_list", list_path,
+            "-segment_list_type", "csv",
+            "-reset_timestamps", "1",
+            "-strftime", "1",
+            self._path(SEGMENT_NAME_FORMAT),
+        ]
+        metrics.counter("watchdog_ffmpeg_spawns_total", "Uruchomienia procesów ffmpeg", {"role": "segments"}).inc()
+        # W grupie workera - zabity worker nie zostawia muksera zapisującego segmenty
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+        )
+        write_pid_file(self.pid_file, proc.pid)
+        return proc
+
+    def _run(self):
+        backoff = 1
+        last_prune = 0
+        while not self.stop_event.is_set():
+            list_path = self._path(SEGMENT_LIST_FILE)
+            position = 0
+            self.time_base = None
+            try:
+                if os.path.exists(list_path):
+                    os.remove(list_path)
+                self.proc = self._spawn(list_path)
+            except OSError as e:
+                # Brak ffmpeg, brak miejsca na liście segmentów - jak przy zerwanym nagrywaniu
+                logger.error(f"Nie można uruchomić nagrywania ciągłego: {e}")
+                self.proc = None
+            else:
+                logger.info(f"Nagrywanie ciągłe do {self.segment_dir} (PID: {self.proc.pid})")
+
+            while self.proc is not None and not self.stop_event.is_set():
+                running = self.proc.poll() is None
+                try:
+                    new_position = self._read_segment_list(list_path, position)
+                    if time.time() - last_prune > 600:
+                        self.prune()
+                        last_prune = time.time()
+                except Exception as e:
+                    # Wątek indeksowania nie może zginąć przy działającym ffmpeg -
+                    # nieodczytane linie zostaną przeczytane w następnej próbie
+                    logger.error(f"Błąd indeksowania segmentów, ponowienie za {backoff}s: {e}")
+                    self.stop_event.wait(backoff)
+                    backoff = min(backoff * 2, 30)
+                    continue
+                if new_position != position:
+                    backoff = 1
+                position = new_position
+                if not running:
+                    break
+                self.stop_event.wait(1)
+
+            if self.stop_event.is_set():
+                try:
+                    self._read_segment_list(list_path, position)
+                except Exception as e:
+                    logger.error(f"Błąd indeksowania segmentów: {e}")
+                break
+            logger.warning(f"Nagrywanie ciągłe przerwane, ponowienie za {backoff}s")
+            self.stop_event.wait(backoff)
+            backoff = min(backoff * 2, 30)
+
+    @staticmethod
+    def _name_time(name):
+        try:
+            return datetime.strptime(name, SEGMENT_NAME_FORMAT).timestamp()
+        except ValueError:
+            return None
+
+    def _segment_start(self, name, offset):
+        """
+        Początek segmentu w czasie zegarowym: podstawa z nazwy pierwszego pliku
+        plus przesunięcie `start` z listy (czas strumienia, rosnący) - segmenty
+        czytane z opóźnieniem lub kilka naraz nie nachodzą na siebie.
+        """
+        name_time = self._name_time(name)
+        if name_time is not None:
+            if self.time_base is None or abs(self.time_base + offset - name_time) > SEGMENT_CLOCK_TOLERANCE:
+                if self.time_base is not None:
+                    logger.warning(f"Nieciągłość czasu strumienia w {name} - nowa podstawa czasu segmentów")
+                self.time_base = name_time - offset
+        elif self.time_base is None:
+            # Nazwa spoza wzorca - segment właśnie się zamknął, więc jego koniec to mniej więcej "teraz"
+            return None
+        return self.time_base + offset
+
+    def _read_segment_list(self, list_path, position):
+        """ffmpeg dopisuje linię `plik,start,koniec` po zamknięciu segmentu"""
+        try:
+            with open(list_path) as f:
+                f.seek(position)
+                lines = f.readlines()
+                if lines and not lines[-1].endswith("\n"):
+                    lines.pop()
+                position += sum(len(line.encode()) for line in lines)
+        except FileNotFoundError:
+            return position
+
+        for line in lines:
+            try:
+                name, start, end = line.strip().split(",")[:3]
+                offset = float(start)
+                duration = float(end) - offset
+            except ValueError:
+                continue
+            name = os.path.basename(name)
+            segment_start = self._segment_start(name, offset)
+            if segment_start is None:
+                segment_start = time.time() - duration
+            keyframes = self._probe_keyframes(self._path(name))
+            self._add_segment(Segment(name, segment_start, duration, keyframes))
+        return position
+
+    # --- zdarzenia i wycinanie ---
+
+    def mark_event(self, start, end):
+        with self.lock:
+            with open(self._path(EVENTS_FILE), "a") as f:
+                f.write(f"{start:.3f},{end:.3f}\n")
+
+    def events(self, start=0, end=float("inf")):
+        path = self._path(EVENTS_FILE)
+        if not os.path.exists(path):
+            return []
+        result = []
+        with open(path) as f:
+            for line in f:
+                try:
+                    event_start, event_end = (float(v) for v in line.split(","))
+                except ValueError:
+                    continue
+                if event_end >= start and event_start <= end:
+                    result.append((event_start, event_end))
+        return result
+
+    def wait_until_indexed(self, end, timeout=None):
+        """Czeka, aż indeks obejmie chwilę `end` (segment zostanie zamknięty)"""
+        if timeout is None:
+            timeout = self.segment_seconds * 2 + 5
+        deadline = time.time() + timeout
+        with self.lock:
+            while not self.segments or self.segments[-1].end < end:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.indexed.wait(remaining)
+        return True
+
+    def clip(self, start, end, output_file):
+        """
+        Wycina fragment [start, end] (czas zegarowy) do pliku MP4 bez
+        ponownego kodowania. Początek wyrównany do poprzedzającej klatki kluczowej.
+
+        Returns:
+            ścieżka do pliku lub None, jeśli brak nagrań z tego okresu
+        """
+        self.wait_until_indexed(end)
+        with self.lock:
+            first = max(0, bisect.bisect_right(self.starts, start) - 1)
+            selected = [s for s in self.segments[first:] if s.start < end and s.end > start]
+
+        if not selected:
+            logger.warning(f"Brak segmentów dla fragmentu {start:.0f}-{end:.0f}")
+            return None
+
+        lines = []
+        for i, segment in enumerate(selected):
+            lines.append(f"file '{self._path(segment.name)}'\n")
+            if i == 0 and start > segment.start:
+                position = segment.base + start - segment.start
+                inpoint = max((k for k in segment.keyframes if k <= position), default=segment.base)
+                lines.append(f"inpoint {inpoint:.3f}\n")
+            if i == len(selected) - 1 and end < segment.end:
+                lines.append(f"outpoint {segment.base + end - segment.start:.3f}\n")
+
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", dir=self.segment_dir, delete=False) as f:
+            f.writelines(lines)
+            list_path = f.name
+
+        try:
+            result = subprocess.run(
+                [
+                    "ffmpeg", "-loglevel", "error", "-y",
+                    "-f", "concat", "-safe", "0",
+                    "-i", list_path,
+                    "-c", "copy",
+                    "-avoid_negative_ts", "make_zero",
+                    output_file,
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=120,
+            )
+        finally:
+            os.remove(list_path)
+
+        if result.returncode != 0:
+            logger.error(f"Błąd wycinania fragmentu do {output_file}: {result.stderr.strip()}")
+            return None
+        logger.info(f"Fragment {end - start:.1f}s zapisany: {output_file} ({len(selected)} segmentów)")
+        return output_file
@@ -0,0 +1,99 @@
+"""
+Oś czasu startu workera - od uruchomienia procesu do pierwszej próbki ruchu.
+
+Etapy (sekundy od startu procesu, razem z interpreterem i importami):
+
+    import               moduły workera zaimportowane
+    mediamtx             mediamtx sprawdzony (lub uruchomiony)
+    stream_open          strumień otwarty
+    first_frame          pierwsza klatka
+    first_motion_check   pierwsza próbka ruchu
+    face_detector_ready  detektor twarzy gotowy (ładowany w tle)
+
+Po pierwszej próbce ruchu oś czasu trafia do logu, a każdy etap do
+histogramu watchdog_startup_seconds - regresje czasu startu widać
+bez ręcznego mierzenia.
+"""
+
+import os
+import threading
+import time
+
+from logger import get_logger
+import metrics
+
+STAGES = ("import", "mediamtx", "stream_open", "first_frame", "first_motion_check", "face_detector_ready")
+STARTUP_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60, 120, 300)
+
+logger = get_logger("startup")
+
+
+def _process_start():
+    """Chwila startu procesu na zegarze time.monotonic() (Linux: /proc), inaczej chwila importu"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Pole 22 (starttime) liczone od nawiasu zamykającego nazwę procesu (pole 2)
+            fields = f.read().rsplit(")", 1)[1].split()
+        started_ticks = int(fields[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        running_for = uptime - started_ticks / os.sysconf("SC_CLK_TCK")
+        return time.monotonic() - max(0.0, running_for)
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+
+
+PROCESS_START = _process_start()
+_imports_done = None
+
+
+def since_start(at=None):
+    return (time.monotonic() if at is None else at) - PROCESS_START
+
+
+def imports_done():
+    """Wywoływane raz, po imporcie modułów workera"""
+    global _imports_done
+    if _imports_done is None:
+        _imports_done = since_start()
+
+
+class StartupTimeline:
+    def __init__(self, camera_id, log=logger):
+        self.camera_id = camera_id
+        self.log = log
+        self.lock = threading.Lock()
+        self.marks = {}
+        if _imports_done is not None:
+            self.mark("import", PROCESS_START + _imports_done)
+
+    def mark(self, stage, at=None):
+        """
+        Zapisuje pierwsze wystąpienie etapu (kolejne są ignorowane).
+
+        Args:
+            at: chwila na zegarze time.monotonic(); domyślnie teraz
+
+        Returns:
+            True przy pierwszym wystąpieniu
+        """
+        with self.lock:
+            if stage in self.marks:
+                return False
+            elapsed = self.marks[stage] = since_start(at)
+
+        metrics.histogram(
+            "watchdog_startup_seconds", "Etapy startu od uruchomienia procesu",
+            {"camera": self.camera_id, "stage": stage}, buckets=STARTUP_BUCKETS,
+        ).observe(elapsed)
+        if stage == "first_motion_check":
+            self.log.info(f"Start: {self.report()}")
+        elif stage == "face_detector_ready" and "first_motion_check" in self.marks:
+            self.log.info(f"Detektor twarzy gotowy {elapsed:.2f}s od startu procesu")
+        return True
+
+    def report(self):
+        """Np. "import 1.84s, mediamtx 1.90s, stream_open 2.41s, ..." """
+        with self.lock:
+            marks = dict(self.marks)
+        return ", ".join(f"{stage} {marks[stage]:.2f}s" for stage in STAGES if stage in marks)
@@ -0,0 +1,354 @@
+"""
+Nadzór procesów uruchamianych przez father.py (worker, gate_watcher).
+
+Father trzyma Popen każdego dziecka, odbiera jego kod wyjścia i uruchamia
+je ponownie z wykładniczym odstępem (RESTART_BASE * 2^n s, najwyżej
+RESTART_MAX). Dziecko co HEARTBEAT_INTERVAL dotyka pliku
+HEARTBEAT_DIR/watchdog_<rola>.heartbeat (Heartbeat) - brak bicia serca
+dłużej niż HEARTBEAT_TIMEOUT oznacza zawieszenie: grupa procesów dostaje
+SIGTERM, potem SIGKILL, a dziecko startuje od nowa. Procesy ffmpeg workera
+należą do jego grupy, więc po zakończeniu dziecka nie zostają sieroty.
+
+Każda rola działa w jednej kopii: proces trzyma blokadę flock na
+LOCK_DIR/watchdog_<rola>.lock (single_instance), a father przed startem
+kończy proces, który ją trzyma (np. sierotę po poprzednim fatherze).
+"""
+
+import fcntl
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+from logger import get_logger
+from uniwersal import backoff_delay
+
+load_dotenv()
+
+LOCK_DIR = os.getenv("LOCK_DIR", "/tmp")
+HEARTBEAT_DIR = os.getenv("HEARTBEAT_DIR", "/tmp")
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", 10))
+# 0 = bez wykrywania zawieszeń
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", 180))
+RESTART_BASE = float(os.getenv("RESTART_BASE", 1))
+RESTART_MAX = float(os.getenv("RESTART_MAX", 300))
+# Dziecko działające dłużej liczy próby restartu od nowa
+RESTART_STABLE_AFTER = float(os.getenv("RESTART_STABLE_AFTER", 600))
+STOP_TIMEOUT = 10
+# Czas, w którym worker musi się zamknąć (nagranie, obróbka, wysyłki) - father czeka
+# na niego o STOP_TIMEOUT dłużej, zanim wyśle SIGKILL
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", 60))
+
+logger = get_logger("supervisor")
+
+
+def lock_path(role):
+    return os.path.join(LOCK_DIR, f"watchdog_{role}.lock")
+
+
+def heartbeat_path(role):
+    return os.path.join(HEARTBEAT_DIR, f"watchdog_{role}.heartbeat")
+
+
+def single_instance(role):
+    """
+    Blokada jedynej kopii roli na czas życia procesu (zwalniana przez system
+    także po SIGKILL).
+
+    Returns:
+        otwarty plik blokady (trzeba trzymać referencję) albo None, gdy rola już działa
+    """
+    lock_file = open(lock_path(role), "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+
+def instance_pid(role):
+    """PID procesu, który trzyma blokadę roli, albo None"""
+    try:
+        lock_file = open(lock_path(role))
+    except FileNotFoundError:
+        return None
+    with lock_file:
+        try:
+            # Udało się zablokować - nikt jej nie trzyma
+            fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return None
+        except BlockingIOError:
+            pass
+        try:
+            return int(lock_file.read().strip())
+        except ValueError:
+            return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def terminate(pid, timeout=STOP_TIMEOUT, proc=None):
+    """
+    SIGTERM do procesu (i jego grupy, jeśli jest jej liderem), po `timeout` s SIGKILL.
+
+    Args:
+        proc: Popen, jeśli to nasze dziecko - wtedy jest też odbierany jego kod wyjścia
+    """
+    try:
+        pgid = os.getpgid(pid)
+    except ProcessLookupError:
+        return
+    # Grupę zabijamy tylko, gdy proces ma własną (start_new_session) - nigdy naszą
+    group = pgid == pid and pgid != os.getpgrp()
+
+    def send(sig):
+        try:
+            if group:
+                os.killpg(pgid, sig)
+            else:
+                os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    send(signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (proc.poll() is not None) if proc else not _alive(pid):
+            break
+        time.sleep(0.2)
+    else:
+        logger.warning(f"PID {pid} nie zakończył się po {timeout:.0f}s - SIGKILL")
+        send(signal.SIGKILL)
+        if proc:
+            proc.wait()
+    if group:
+        kill_group(pgid)
+
+
+def kill_group(pgid):
+    """SIGKILL dla procesów, które zostały w grupie po jej liderze (np. ffmpeg workera)"""
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return False
+    logger.warning(f"Zabito procesy pozostałe w grupie {pgid}")
+    return True
+
+
+def write_pid_file(path, pid):
+    if not path:
+        return
+    try:
+        with open(path, "w") as f:
+            f.write(str(pid))
+    except OSError as e:
+        logger.error(f"Błąd zapisu {path}: {e}")
+
+
+def remove_pid_file(path):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Błąd usuwania {path}: {e}")
+
+
+def reap_pid_file(path, name="ffmpeg"):
+    """
+    Kończy proces `name` z pliku PID pozostawionego przez poprzednią kopię
+    (np. worker zabity SIGKILL) i usuwa plik. Nazwa programu sprawdzana jest
+    w /proc/<pid>/comm - numer mógł już trafić do innego procesu.
+
+    Returns:
+        True jeśli proces został zakończony
+    """
+    if not path or not os.path.exists(path):
+        return False
+    reaped = False
+    try:
+        with open(path) as f:
+            pid = int(f.read().strip())
+        with open(f"/proc/{pid}/comm") as f:
+            program = f.read().strip()
+    except (OSError, ValueError):
+        program = None
+    # comm to najwyżej 15 znaków nazwy pliku programu
+    if program == name[:15]:
+        logger.warning(f"Pozostały proces {name} z {path} (PID: {pid}) - kończę go")
+        terminate(pid, timeout=3)
+        reaped = True
+    remove_pid_file(path)
+    return reaped
+
+
+class Heartbeat:
+    """Bicie serca po stronie dziecka: mtime pliku, nie częściej niż co `interval` s"""
+
+    def __init__(self, role, interval=HEARTBEAT_INTERVAL):
+        self.path = heartbeat_path(role)
+        self.interval = interval
+        self.last = None
+
+    def beat(self):
+        now = time.monotonic()
+        if self.last is not None and now - self.last < self.interval:
+            return
+        self.last = now
+        try:
+            with open(self.path, "a"):
+                pass
+            os.utime(self.path)
+        except OSError as e:
+            logger.error(f"Błąd zapisu {self.path}: {e}")
+
+
+class ChildProcess:
+    def __init__(self, role, script, python=None, heartbeat_timeout=HEARTBEAT_TIMEOUT,
+                 restart_base=RESTART_BASE, restart_max=RESTART_MAX, stop_timeout=STOP_TIMEOUT):
+        """
+        Args:
+            role: nazwa roli (blokada i plik bicia serca)
+            script: ścieżka do skryptu
+            python: interpreter (venv); domyślnie ten sam co fathera
+            heartbeat_timeout: po ilu sekundach bez bicia serca dziecko jest zabijane (0 = nigdy)
+            stop_timeout: ile sekund po SIGTERM dziecko ma na zamknięcie przed SIGKILL
+        """
+        self.role = role
+        self.script = script
+        self.python = python or sys.executable
+        self.heartbeat_timeout = heartbeat_timeout
+        self.heartbeat_path = heartbeat_path(role)
+        self.restart_base = restart_base
+        self.restart_max = restart_max
+        self.stop_timeout = stop_timeout
+
+        self.proc = None
+        self.started_at = None
+        self.started_wall = None
+        self.failures = 0
+        self.restart_at = 0
+        self.down_since = None
+        self.restarts = 0
+
+    @property
+    def pid(self):
+        return self.proc.pid if self.proc else None
+
+    def start(self):
+        stray = instance_pid(self.role)
+        if stray and stray != os.getpid():
+            logger.warning(f"{self.role} działa poza nadzorem (PID: {stray}) - kończę go")
+            terminate(stray)
+
+        logger.info(f"Uruchamiam {self.role}: {self.python} {self.script}")
+        self.started_at = None
+        try:
+            os.chmod(self.script, 0o755)
+            self.proc = subprocess.Popen(
+                [self.python, "-u", self.script],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                stdin=subprocess.DEVNULL,
+                start_new_session=True,
+                cwd=os.path.dirname(os.path.abspath(self.script)),
+            )
+        except OSError as e:
+            logger.error(f"Błąd uruchamiania {self.role}: {e}")
+            self._schedule_restart(time.monotonic(), f"nie uruchomił się ({e})")
+            return False
+
+        self.started_at = time.monotonic()
+        self.started_wall = time.time()
+        if self.down_since is not None:
+            self.restarts += 1
+            logger.info(
+                f"{self.role} uruchomiony ponownie (PID: {self.proc.pid}) "
+                f"{self.started_at - self.down_since:.1f}s po awarii"
+            )
+            self.down_since = None
+        else:
+            logger.info(f"{self.role} uruchomiony (PID: {self.proc.pid})")
+        return True
+
+    def heartbeat_age(self):
+        """Sekundy od ostatniego bicia serca (od startu, jeśli dziecko jeszcze nie biło)"""
+        try:
+            last = max(os.path.getmtime(self.heartbeat_path), self.started_wall)
+        except OSError:
+            last = self.started_wall
+        return time.time() - last
+
+    def check(self):
+        """Odbiera zakończone dziecko, zabija zawieszone i uruchamia ponownie, gdy minął odstęp"""
+        now = time.monotonic()
+        if self.proc is None:
+            if now >= self.restart_at:
+                self.start()
+            return
+
+        code = self.proc.poll()
+        if code is not None:
+            # Dziecko zabite z zewnątrz (np. OOM) zostawia swoje ffmpeg w grupie
+            kill_group(self.proc.pid)
+            self.proc = None
+            self._schedule_restart(now, f"zakończył się z kodem {code}")
+            return
+
+        if self.heartbeat_timeout:
+            age = self.heartbeat_age()
+            if age > self.heartbeat_timeout:
+                logger.error(f"{self.role} (PID: {self.proc.pid}) bez bicia serca od {age:.0f}s - zabijam")
+                self.stop()
+                self._schedule_restart(now, "zawiesił się")
+
+    def _schedule_restart(self, now, reason):
+        uptime = now - self.started_at if self.started_at else 0
+        self.failures = 1 if uptime > RESTART_STABLE_AFTER else self.failures + 1
+        delay = backoff_delay(self.failures, self.restart_base, self.restart_max)
+        if self.down_since is None:
+            self.down_since = now
+        self.restart_at = now + delay
+        logger.error(
+            f"{self.role} {reason} po {uptime:.0f}s działania - "
+            f"restart za {delay:.1f}s (próba {self.failures})"
+        )
+
+    def reset(self):
+        """Start od zera (np. po zmianie trybu) - bez odstępu i historii awarii"""
+        self.failures = 0
+        self.restart_at = 0
+        self.down_since = None
+
+    def stop(self, timeout=None):
+        if self.proc is None:
+            return
+        terminate(self.proc.pid, self.stop_timeout if timeout is None else timeout, self.proc)
+        self.proc = None
+
+    def status(self):
+        if self.proc is None:
+            return f"{self.role}: nie działa, restart za {max(0.0, self.restart_at - time.monotonic()):.0f}s"
+        return (
+            f"{self.role}: PID {self.proc.pid}, działa {time.monotonic() - self.started_at:.0f}s, "
+            f"bicie serca {self.heartbeat_age():.0f}s temu, restartów {self.restarts}"
+        )
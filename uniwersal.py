@@ -1,6 +1,7 @@
 import subprocess
 import sys
 import os
+import random
 from dotenv import load_dotenv
 import time
 
@@ -9,6 +10,15 @@ load_dotenv()
 WORKER_SCRIPT_VENV = os.getenv("WORKER_SCRIPT_VENV")
 
 
+def backoff_delay(attempt, base, maximum):
+    """
+    Odstęp przed próbą `attempt` (od 1): wykładniczy, z rozrzutem 50-100%,
+    żeby kilka procesów po wspólnej awarii nie ponawiało w tej samej chwili.
+    """
+    delay = min(maximum, base * 2 ** min(attempt - 1, 30))
+    return delay * random.uniform(0.5, 1.0)
+
+
 def start_script(script_path, logger, custon_venv=None):
     """
     Runs the indicated script in the background
@@ -35,4 +45,4 @@ def start_script(script_path, logger, custon_venv=None):
         return True
     except Exception as e:
         logger.error(f"Błąd podczas uruchamiania {script_path}: {e}")
-        return False
\ No newline at end of file
+        return False
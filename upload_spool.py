@@ -0,0 +1,343 @@
+"""
+Trwała kolejka wysyłek do REMOTE_SERVER_URL.
+
+Każde zgłoszenie trafia najpierw na dysk (plik .json z opisem i opcjonalny
+plik .bin z treścią), a osobny wątek wysyła je w kolejności zapisu.
+Po restarcie urządzenia niewysłane zgłoszenia są wysyłane dalej.
+
+Rozmiary zgłoszeń są liczone w pamięci (dysk listowany tylko przy starcie),
+więc pilnowanie limitów przy każdym zapisie nie listuje całej kolejki.
+Zapis nie wywołuje fsync - wątek ruchu/twarzy nie czeka na kartę SD;
+zgłoszenie uszkodzone przez zanik zasilania jest przy wysyłce usuwane.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from itertools import islice
+
+from dotenv import load_dotenv
+from api_client import DeviceApiClient, FACE_ENDPOINT, FACE_BATCH_ENDPOINT
+from logger import get_logger
+import metrics
+
+load_dotenv()
+
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/tmp")
+
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or os.path.join(OUTPUT_DIR, "upload_spool")
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", 50 * 1024 * 1024))
+UPLOAD_SPOOL_MAX_AGE = int(os.getenv("UPLOAD_SPOOL_MAX_AGE", 3 * 24 * 3600))
+UPLOAD_RETRY_BASE = float(os.getenv("UPLOAD_RETRY_BASE", 2))
+UPLOAD_RETRY_MAX = float(os.getenv("UPLOAD_RETRY_MAX", 300))
+
+logger = get_logger("upload_spool")
+
+UPLOAD_FAILURES = metrics.counter(
+    "watchdog_upload_failures_total", "Nieudane wysyłki", {"queue": "spool"}
+)
+UPLOAD_DROPPED = metrics.counter(
+    "watchdog_upload_dropped_total", "Zgłoszenia usunięte z kolejki", {"queue": "spool"}
+)
+
+# Kody, przy których ponawianie nic nie zmieni
+_RETRYABLE_CLIENT_ERRORS = (408, 425, 429)
+
+
+class PermanentUploadError(Exception):
+    """Serwer odrzucił zgłoszenie - nie ma sensu go ponawiać"""
+
+
+def check_response(response):
+    """PermanentUploadError dla trwałych błędów 4xx, HTTPError dla pozostałych"""
+    if 400 <= response.status_code < 500 and response.status_code not in _RETRYABLE_CLIENT_ERRORS:
+        raise PermanentUploadError(f"HTTP {response.status_code}")
+    response.raise_for_status()
+
+
+class UploadSpool:
+    def __init__(self, spool_dir=UPLOAD_SPOOL_DIR, max_bytes=UPLOAD_SPOOL_MAX_BYTES,
+                 max_age=UPLOAD_SPOOL_MAX_AGE, retry_base=UPLOAD_RETRY_BASE,
+                 retry_max=UPLOAD_RETRY_MAX, client=None):
+        self.spool_dir = spool_dir
+        self.client = client or DeviceApiClient()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.attempts = 0
+        self.next_attempt = 0
+        # job_id -> rozmiar plików w bajtach, w kolejności wysyłki
+        self.jobs = {}
+        self.total_bytes = 0
+        # Zgłoszenia z odrzuconej paczki twarzy - wysyłane pojedynczo
+        self.unbatched = set()
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._remove_partial_jobs()
+        self._load_jobs()
+
+    # --- zapis ---
+
+    def enqueue_json(self, endpoint, data):
+        """Dodaje zgłoszenie JSON (np. informacja o nagraniu)"""
+        self._write_job({"endpoint": endpoint, "kind": "json", "data": data})
+
+    def enqueue_file(self, endpoint, data, content, filename, content_type):
+        """Dodaje zgłoszenie multipart z jednym plikiem (np. zdjęcie twarzy)"""
+        self._write_job(
+            {
+                "endpoint": endpoint,
+                "kind": "file",
+                "data": data,
+                "filename": filename,
+                "content_type": content_type,
+            },
+            content,
+        )
+
+    def _write_job(self, job, content=None):
+        job["created"] = time.time()
+
+        with self.lock:
+            job_id = f"{time.time_ns():020d}_{uuid.uuid4().hex[:8]}"
+            json_path = os.path.join(self.spool_dir, job_id + ".json")
+            size = 0
+            try:
+                if content is not None:
+                    job["body"] = job_id + ".bin"
+                    self._atomic_write(os.path.join(self.spool_dir, job["body"]), content)
+                    size += len(content)
+                # Plik .json zapisywany jako ostatni - dopiero on oznacza gotowe zgłoszenie
+                encoded = json.dumps(job).encode("utf-8")
+                self._atomic_write(json_path, encoded)
+                size += len(encoded)
+            except OSError as e:
+                logger.error(f"Nie udało się zapisać zgłoszenia {job['endpoint']} w kolejce: {e}")
+                return
+            self.jobs[job_id] = size
+            self.total_bytes += size
+            self._enforce_limits()
+
+        self.wakeup.set()
+
+    @staticmethod
+    def _atomic_write(path, content):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    # --- utrzymanie kolejki ---
+
+    def _load_jobs(self):
+        """Zgłoszenia i ich rozmiary z dysku - tylko przy starcie"""
+        job_ids = sorted(
+            name[:-len(".json")] for name in os.listdir(self.spool_dir) if name.endswith(".json")
+        )
+        for job_id in job_ids:
+            size = 0
+            for path in self._job_files(job_id):
+                try:
+                    size += os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+            self.jobs[job_id] = size
+            self.total_bytes += size
+
+    def _job_files(self, job_id):
+        return [
+            os.path.join(self.spool_dir, job_id + ".json"),
+            os.path.join(self.spool_dir, job_id + ".bin"),
+        ]
+
+    def _remove_job(self, job_id):
+        self.total_bytes -= self.jobs.pop(job_id, 0)
+        self.unbatched.discard(job_id)
+        for path in self._job_files(job_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _remove_partial_jobs(self):
+        """Usuwa pozostałości po przerwanym zapisie (np. zanik zasilania)"""
+        names = set(os.listdir(self.spool_dir))
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif name.endswith(".bin") and name[:-len(".bin")] + ".json" not in names:
+                os.remove(path)
+
+    def _enforce_limits(self):
+        """Usuwa najstarsze zgłoszenia ponad limit rozmiaru i wieku (wywoływane pod self.lock)"""
+        now_ns = time.time_ns()
+        dropped = 0
+        while self.jobs:
+            job_id = next(iter(self.jobs))
+            created_ns = int(job_id.split("_", 1)[0])
+            too_old = (now_ns - created_ns) / 1e9 > self.max_age
+            if not too_old and self.total_bytes <= self.max_bytes:
+                break
+            self._remove_job(job_id)
+            dropped += 1
+
+        if dropped:
+            UPLOAD_DROPPED.inc(dropped)
+            logger.warning(f"Usunięto {dropped} najstarszych zgłoszeń z kolejki (limit rozmiaru/wieku)")
+
+    def pending(self):
+        with self.lock:
+            return len(self.jobs)
+
+    # --- retencja (RetentionManager) ---
+
+    @property
+    def storage_dir(self):
+        return self.spool_dir
+
+    def oldest_time(self):
+        with self.lock:
+            job_id = next(iter(self.jobs), None)
+        return None if job_id is None else int(job_id.split("_", 1)[0]) / 1e9
+
+    def remove_oldest(self):
+        """Usuwa najstarsze zgłoszenie (brak miejsca na dysku) i zwraca zwolnione bajty"""
+        with self.lock:
+            job_id = next(iter(self.jobs), None)
+            if job_id is None:
+                return 0
+            size = self.jobs[job_id]
+            self._remove_job(job_id)
+        UPLOAD_DROPPED.inc()
+        return size
+
+    # --- wysyłka ---
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        pending = self.pending()
+        if pending:
+            logger.info(f"Kolejka wysyłek: {pending} zgłoszeń do wysłania")
+
+    def stop(self, timeout=3):
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+        self.client.close()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            delay = self.next_attempt - time.time()
+            if delay > 0:
+                self.wakeup.wait(timeout=delay)
+                self.wakeup.clear()
+                continue
+
+            with self.lock:
+                self._enforce_limits()
+                job_ids = list(islice(self.jobs, max(1, self.client.face_batch_size)))
+
+            if not job_ids:
+                self.wakeup.wait(timeout=60)
+                self.wakeup.clear()
+                continue
+
+            batch = job_ids[:1]
+            try:
+                jobs = [self._load_job(batch[0])]
+                if (self.client.face_batch_size > 1 and self._is_face_job(jobs[0])
+                        and batch[0] not in self.unbatched):
+                    # Kolejne twarze z kolejki idą razem jednym żądaniem
+                    for job_id in job_ids[1:]:
+                        if job_id in self.unbatched:
+                            break
+                        try:
+                            job = self._load_job(job_id)
+                        except PermanentUploadError:
+                            break
+                        if not self._is_face_job(job):
+                            break
+                        batch.append(job_id)
+                        jobs.append(job)
+                self._send(jobs)
+            except PermanentUploadError as e:
+                if len(batch) > 1:
+                    # Jedna zła twarz odrzuca całą paczkę - każda idzie osobno
+                    # i usuwane są tylko te, które serwer odrzuci pojedynczo
+                    logger.warning(f"Serwer odrzucił paczkę {len(batch)} twarzy ({e}), wysyłka pojedyncza")
+                    with self.lock:
+                        self.unbatched.update(batch)
+                    continue
+                UPLOAD_DROPPED.inc()
+                logger.error(f"Serwer odrzucił zgłoszenie {batch[0]}, usuwam: {e}")
+                with self.lock:
+                    self._remove_job(batch[0])
+                continue
+            except Exception as e:
+                UPLOAD_FAILURES.inc()
+                self.attempts += 1
+                backoff = min(self.retry_max, self.retry_base * 2 ** (self.attempts - 1))
+                backoff *= random.uniform(0.5, 1.0)
+                self.next_attempt = time.time() + backoff
+                logger.warning(
+                    f"Wysyłka {batch[0]} nieudana (próba {self.attempts}), ponowienie za {backoff:.1f}s: {e}"
+                )
+                continue
+
+            self.attempts = 0
+            self.next_attempt = 0
+            with self.lock:
+                for job_id in batch:
+                    self._remove_job(job_id)
+
+    @staticmethod
+    def _is_face_job(job):
+        return job["kind"] == "file" and job["endpoint"] == FACE_ENDPOINT
+
+    def _load_job(self, job_id):
+        try:
+            with open(os.path.join(self.spool_dir, job_id + ".json"), "rb") as f:
+                job = json.loads(f.read().decode("utf-8"))
+            if job["kind"] == "file":
+                with open(os.path.join(self.spool_dir, job["body"]), "rb") as f:
+                    job["content"] = f.read()
+        except (OSError, ValueError, KeyError) as e:
+            raise PermanentUploadError(f"uszkodzony wpis kolejki: {e}")
+        return job
+
+    def _send(self, jobs):
+        job = jobs[0]
+        started = time.perf_counter()
+        if len(jobs) > 1:
+            response = self.client.upload_faces(
+                [(j["data"].get("recorded_at"), j["content"], j["filename"]) for j in jobs]
+            )
+        elif job["kind"] == "file":
+            response = self.client.post_file(
+                job["endpoint"], job["data"], job["content"], job["filename"], job["content_type"]
+            )
+        else:
+            response = self.client.post_json(job["endpoint"], job["data"])
+
+        endpoint = FACE_BATCH_ENDPOINT if len(jobs) > 1 else job["endpoint"]
+        metrics.histogram(
+            "watchdog_http_request_seconds", "Czas żądania HTTP", {"endpoint": endpoint}
+        ).observe(time.perf_counter() - started)
+        logger.info(f"{job['endpoint']} ({len(jobs)}): {response}")
+        check_response(response)
@@ -0,0 +1,410 @@
+"""
+Wysyłka gotowych nagrań MP4 na REMOTE_SERVER_URL w kawałkach.
+
+Protokół (VIDEO_UPLOAD_ENDPOINT):
+    POST {endpoint}            JSON z opisem pliku -> {"upload_id", "offset"}
+    GET  {endpoint}{id}/       -> {"offset"} (ile bajtów serwer już ma)
+    PUT  {endpoint}{id}/       kawałek z nagłówkiem Content-Range -> {"offset"}
+
+Stan każdej wysyłki (upload_id, offset) leży w pliku .json w
+VIDEO_UPLOAD_DIR, więc po restarcie wysyłka rusza od miejsca przerwania.
+Przepustowość ograniczana jest do VIDEO_UPLOAD_RATE_KBPS, żeby nie
+zagłodzić strumienia RTSP ani wysyłki twarzy.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+from api_client import DeviceApiClient
+from logger import get_logger
+import metrics
+from upload_spool import PermanentUploadError, UploadSpool, check_response
+
+load_dotenv()
+
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/tmp")
+
+# 0 = nagrania zostają tylko na urządzeniu
+VIDEO_UPLOAD = os.getenv("VIDEO_UPLOAD", "0") == "1"
+VIDEO_UPLOAD_DIR = os.getenv("VIDEO_UPLOAD_DIR") or os.path.join(OUTPUT_DIR, "video_uploads")
+VIDEO_CHUNK_SIZE = int(os.getenv("VIDEO_CHUNK_SIZE", 1024 * 1024))
+# 0 = bez limitu
+VIDEO_UPLOAD_RATE_KBPS = int(os.getenv("VIDEO_UPLOAD_RATE_KBPS", 256))
+UPLOAD_RETRY_BASE = float(os.getenv("UPLOAD_RETRY_BASE", 2))
+UPLOAD_RETRY_MAX = float(os.getenv("UPLOAD_RETRY_MAX", 300))
+
+logger = get_logger("video_upload")
+
+UPLOAD_FAILURES = metrics.counter(
+    "watchdog_upload_failures_total", "Nieudane wysyłki", {"queue": "video"}
+)
+UPLOADED_BYTES = metrics.counter("watchdog_video_upload_bytes_total", "Wysłane bajty nagrań")
+CHUNK_TIME = metrics.histogram(
+    "watchdog_http_request_seconds", "Czas żądania HTTP", {"endpoint": "video_chunk"}
+)
+
+
+class RateLimiter:
+    """Wspólny limit bajtów na sekundę (kubełek o pojemności `burst` sekund)"""
+
+    def __init__(self, bytes_per_second, burst=0.25):
+        self.rate = bytes_per_second
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.next_free = time.monotonic()
+
+    def consume(self, size):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.next_free = max(self.next_free, now - self.burst) + size / self.rate
+            delay = self.next_free - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ThrottledReader:
+    """
+    Kawałek pliku jako obiekt z read() dla requests/http.client.
+    Dane są czytane z dysku i wysyłane porcjami zgodnie z limitem.
+    """
+
+    def __init__(self, path, offset, length, limiter, stop_event=None):
+        self.file = open(path, "rb")
+        self.file.seek(offset)
+        self.remaining = length
+        self.length = length
+        self.limiter = limiter
+        self.stop_event = stop_event
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=64 * 1024):
+        if self.remaining <= 0:
+            return b""
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise IOError("wysyłka przerwana")
+        if size is None or size < 0:
+            size = self.remaining
+        data = self.file.read(min(size, self.remaining, 64 * 1024))
+        self.remaining -= len(data)
+        self.limiter.consume(len(data))
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class VideoUploader:
+    def __init__(self, upload_dir=VIDEO_UPLOAD_DIR, chunk_size=VIDEO_CHUNK_SIZE,
+                 rate_kbps=VIDEO_UPLOAD_RATE_KBPS, retry_base=UPLOAD_RETRY_BASE,
+                 retry_max=UPLOAD_RETRY_MAX, client=None):
+        self.upload_dir = upload_dir
+        self.chunk_size = chunk_size
+        self.client = client or DeviceApiClient()
+        self.limiter = RateLimiter(rate_kbps * 1024)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.attempts = 0
+        self.next_attempt = 0
+        self.sent_bytes = 0
+
+        os.makedirs(self.upload_dir, exist_ok=True)
+
+    # --- stan wysyłek ---
+
+    def enqueue(self, path, data):
+        """
+        Dodaje plik do wysyłki.
+
+        Args:
+            path: ścieżka do gotowego pliku MP4
+            data: opis pliku przekazywany przy zakładaniu wysyłki (np. recorded_at)
+        """
+        state = {
+            "path": path,
+            "size": os.path.getsize(path),
+            "data": data,
+            "upload_id": None,
+            "offset": 0,
+        }
+        job_id = f"{time.time_ns():020d}_{uuid.uuid4().hex[:8]}"
+        with self.lock:
+            self._save(job_id, state)
+        self.wakeup.set()
+
+    def _state_path(self, job_id):
+        return os.path.join(self.upload_dir, job_id + ".json")
+
+    def _save(self, job_id, state):
+        UploadSpool._atomic_write(self._state_path(job_id), json.dumps(state).encode("utf-8"))
+
+    def _load(self, job_id):
+        try:
+            with open(self._state_path(job_id), "rb") as f:
+                return json.loads(f.read().decode("utf-8"))
+        except (OSError, ValueError) as e:
+            raise PermanentUploadError(f"uszkodzony stan wysyłki: {e}")
+
+    def _remove(self, job_id):
+        try:
+            os.remove(self._state_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _job_ids(self):
+        return sorted(
+            name[:-len(".json")] for name in os.listdir(self.upload_dir) if name.endswith(".json")
+        )
+
+    def pending(self):
+        with self.lock:
+            return len(self._job_ids())
+
+    # --- wysyłka ---
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        pending = self.pending()
+        if pending:
+            logger.info(f"Wysyłka nagrań: {pending} plików do wysłania")
+
+    def stop(self, timeout=3):
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+        self.client.close()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            delay = self.next_attempt - time.time()
+            if delay > 0:
+                self.wakeup.wait(timeout=delay)
+                self.wakeup.clear()
+                continue
+
+            with self.lock:
+                job_ids = self._job_ids()
+            if not job_ids:
+                self.wakeup.wait(timeout=60)
+                self.wakeup.clear()
+                continue
+
+            job_id = job_ids[0]
+            try:
+                self._upload(job_id, self._load(job_id))
+            except PermanentUploadError as e:
+                logger.error(f"Wysyłka nagrania {job_id} porzucona: {e}")
+                with self.lock:
+                    self._remove(job_id)
+                continue
+            except Exception as e:
+                if self.stop_event.is_set():
+                    break
+                UPLOAD_FAILURES.inc()
+                self.attempts += 1
+                backoff = min(self.retry_max, self.retry_base * 2 ** (self.attempts - 1))
+                backoff *= random.uniform(0.5, 1.0)
+                self.next_attempt = time.time() + backoff
+                logger.warning(
+                    f"Wysyłka nagrania {job_id} przerwana (próba {self.attempts}), "
+                    f"ponowienie za {backoff:.1f}s: {e}"
+                )
+                continue
+
+            self.attempts = 0
+            self.next_attempt = 0
+
+    def _resume_offset(self, state):
+        """Zakłada wysyłkę albo pyta serwer, ile już ma"""
+        if state["upload_id"]:
+            response = self.client.video_upload_offset(state["upload_id"])
+            if response.status_code != 404:
+                check_response(response)
+                return response.json()["offset"]
+            # Serwer zapomniał wysyłkę - zaczynamy od nowa
+            state["upload_id"] = None
+
+        response = self.client.start_video_upload(
+            dict(state["data"], file_path=os.path.basename(state["path"]), size=state["size"])
+        )
+        check_response(response)
+        result = response.json()
+        state["upload_id"] = result["upload_id"]
+        return result.get("offset", 0)
+
+    def _upload(self, job_id, state):
+        path = state["path"]
+        if not os.path.exists(path) or os.path.getsize(path) != state["size"]:
+            # Usunięty przez retencję albo zmieniony - nie ma czego dokończyć
+            raise PermanentUploadError(f"plik {path} zniknął lub się zmienił")
+
+        total = state["size"]
+        state["offset"] = self._resume_offset(state)
+        with self.lock:
+            self._save(job_id, state)
+        if state["offset"]:
+            logger.info(f"Wznawianie wysyłki {path} od {state['offset']}/{total} B")
+
+        while state["offset"] < total:
+            if self.stop_event.is_set():
+                return
+            offset = state["offset"]
+            length = min(self.chunk_size, total - offset)
+            body = ThrottledReader(path, offset, length, self.limiter, self.stop_event)
+            try:
+                with CHUNK_TIME.time():
+                    response = self.client.upload_video_chunk(state["upload_id"], offset, body, length, total)
+            finally:
+                body.close()
+            if response.status_code == 409:
+                # Serwer ma inny stan niż zapisany lokalnie - wyrównanie do jego offsetu
+                state["offset"] = response.json()["offset"]
+                with self.lock:
+                    self._save(job_id, state)
+                continue
+            check_response(response)
+
+            state["offset"] = response.json().get("offset", offset + length)
+            self.sent_bytes += state["offset"] - offset
+            UPLOADED_BYTES.inc(state["offset"] - offset)
+            with self.lock:
+                self._save(job_id, state)
+
+        with self.lock:
+            self._remove(job_id)
+        logger.info(f"Nagranie wysłane: {path} ({total / 1024 / 1024:.1f} MB)")
+
+
+def benchmark(size=8 * 1024 * 1024, rate_kbps=1024, chunk_size=1024 * 1024, fail_after=3):
+    """
+    Wysyłka na lokalny serwer zastępczy: serwer zrywa połączenie po
+    `fail_after` kawałkach, a uploader jest tworzony od nowa (jak po
+    restarcie) i musi dokończyć od zapisanego miejsca z zadanym limitem.
+    """
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    uploads = {}
+    stats = {"chunks": 0, "bytes": 0}
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def upload_id(self):
+            return self.path.rstrip("/").rsplit("/", 1)[-1]
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            upload_id = uuid.uuid4().hex
+            uploads[upload_id] = bytearray()
+            self.reply(201, {"upload_id": upload_id, "offset": 0})
+
+        def do_GET(self):
+            data = uploads.get(self.upload_id())
+            if data is None:
+                self.reply(404, {})
+            else:
+                self.reply(200, {"offset": len(data)})
+
+        def do_PUT(self):
+            data = uploads.get(self.upload_id())
+            chunk = self.rfile.read(int(self.headers["Content-Length"]))
+            start = int(self.headers["Content-Range"].split()[1].split("-")[0])
+            if data is None:
+                self.reply(404, {})
+                return
+            if start != len(data):
+                self.reply(409, {"offset": len(data)})
+                return
+            stats["chunks"] += 1
+            if fail_after and stats["chunks"] == fail_after + 1:
+                # Symulacja zerwanego połączenia - kawałek nie zostaje zapisany
+                self.close_connection = True
+                self.connection.close()
+                return
+            data.extend(chunk)
+            stats["bytes"] += len(chunk)
+            self.reply(200, {"offset": len(data)})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, "motion_rec_test.mp4")
+        content = os.urandom(size)
+        with open(video, "wb") as f:
+            f.write(content)
+        state_dir = os.path.join(tmp, "state")
+
+        def make_uploader():
+            return VideoUploader(state_dir, chunk_size=chunk_size, rate_kbps=rate_kbps,
+                                 retry_base=0.2, retry_max=1,
+                                 client=DeviceApiClient(base_url, "bench"))
+
+        uploader = make_uploader()
+        uploader.enqueue(video, {"recorded_at": "test"})
+        start = time.perf_counter()
+        uploader.start()
+        while stats["chunks"] <= fail_after and uploader.pending():
+            time.sleep(0.05)
+        # "Restart" urządzenia w trakcie wysyłki
+        uploader.stop()
+        with open(os.path.join(state_dir, os.listdir(state_dir)[0])) as f:
+            resumed_from = json.load(f)["offset"]
+
+        uploader = make_uploader()
+        uploader.start()
+        while uploader.pending():
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        uploader.stop()
+
+    received = next(iter(uploads.values()), b"")
+    server.shutdown()
+    print(f"plik {size / 1024 / 1024:.1f} MB, limit {rate_kbps} KB/s, kawałek {chunk_size // 1024} KB")
+    print(f"wznowienie od {resumed_from} B po zerwaniu połączenia")
+    print(f"czas {elapsed:.2f}s, średnio {size / 1024 / elapsed:.0f} KB/s")
+    print(f"zgodność danych: {'OK' if bytes(received) == content else 'BŁĄD'}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Wysyłka nagrania na lokalny serwer zastępczy")
+    parser.add_argument("--size", type=int, default=8 * 1024 * 1024, help="rozmiar pliku w bajtach")
+    parser.add_argument("--rate", type=int, default=1024, help="limit w KB/s (0 = bez limitu)")
+    parser.add_argument("--chunk", type=int, default=1024 * 1024, help="rozmiar kawałka w bajtach")
+    parser.add_argument("--fail-after", type=int, default=3, help="zerwanie połączenia po N kawałkach")
+    args = parser.parse_args()
+    benchmark(args.size, args.rate, args.chunk, args.fail_after)
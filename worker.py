@@ -2,16 +2,39 @@ import sys
 import subprocess
 import signal
 import os
+import logging
 import cv2
 import threading
 import time
-import requests
-import queue
+import heapq
 from datetime import datetime
-import mediapipe as mp
 from dotenv import load_dotenv
 from logger import setup_logging, get_logger
+from motion_engine import create_motion_engine, motion_bbox, AdaptiveInterval
+from upload_spool import UploadSpool
+from preroll import PrerollBuffer, PREROLL_SECONDS
+from segment_store import SegmentStore
+from capture import (
+    FFmpegPipeCapture, LazyOpenCVCapture, open_opencv_capture, reconnect_delay,
+    CAPTURE_BACKEND, CAPTURE_STALL_SECONDS, CAPTURE_MEDIAMTX_AFTER,
+)
+from face_detection import create_face_detector, find_faces
+from face_pool import FaceDetectionPool, FACE_WORKERS, default_workers
+from face_dedup import FaceDeduplicator, FACE_DEDUP
+from face_selection import BestShotSelector, FACE_WINDOW_SECONDS
+from frame_mailbox import FrameMailbox
+from preview_server import PreviewServer, PREVIEW_PORT
+from finalizer import RecordingFinalizer
+from recordings import RecordingCatalog, RetentionManager
+from video_upload import VideoUploader, VIDEO_UPLOAD
+import metrics
+from metrics import MetricsExporter
+from motion_log import MotionLog
+import startup
+from startup import StartupTimeline
+from supervisor import Heartbeat, single_instance, reap_pid_file, HEARTBEAT_INTERVAL, WORKER_STOP_TIMEOUT
 
+startup.imports_done()
 load_dotenv()
 
 STREAM_URL = os.getenv("STREAM_URL")
@@ -24,62 +47,287 @@ DEVICE_UID = os.getenv("DEVICE_UID")
 MOTION_RATIO_THRESHOLD = float(os.getenv("MOTION_RATIO_THRESHOLD"))
 MOTION_SENSITIVITY = int(os.getenv("MOTION_SENSITIVITY"))
 RECORDING_AFTER_MOTION = int(os.getenv("RECORDING_AFTER_MOTION"))
-MOTION_CHECK_INTERVAL = int(os.getenv("MOTION_CHECK_INTERVAL"))
+MOTION_CHECK_INTERVAL = float(os.getenv("MOTION_CHECK_INTERVAL"))
 FACE_SCAN_TIME = int(os.getenv("FACE_SCAN_TIME"))
 FRAME_WIDTH = int(os.getenv("FRAME_WIDTH"))
 FRAME_HEIGHT = int(os.getenv("FRAME_HEIGHT"))
 MOTION_WIDTH = int(os.getenv("MOTION_WIDTH"))
 MOTION_HEIGHT = int(os.getenv("MOTION_HEIGHT"))
 MEDIAMTX_DIR = os.getenv("MEDIAMTX_DIR")
-MAX_DETECTIONS = os.getenv("MAX_DETECTIONS")
-
-FACE_OUTPUT_DIR = os.path.join(OUTPUT_DIR, "faces")
-os.makedirs(FACE_OUTPUT_DIR, exist_ok=True)
+MAX_DETECTIONS = int(os.getenv("MAX_DETECTIONS"))
+MOTION_ENGINE = os.getenv("MOTION_ENGINE", "absdiff")
+# events = osobny ffmpeg na każde zdarzenie, segments = nagrywanie ciągłe + wycinanie
+RECORDING_MODE = os.getenv("RECORDING_MODE", "events")
+# Wykrywanie twarzy tylko w obszarze ruchu (wycinek pełnej klatki)
+FACE_ROI = os.getenv("FACE_ROI", "1") == "1"
+FACE_ROI_MARGIN = float(os.getenv("FACE_ROI_MARGIN", 0.1))
+FACE_ROI_MIN_SIZE = int(os.getenv("FACE_ROI_MIN_SIZE", 256))
+# Kilka kamer w jednym procesie: "nazwa=rtsp://...;nazwa2=rtsp://..." (puste = tylko STREAM_URL)
+CAMERAS = os.getenv("CAMERAS", "")
+DEFAULT_CAMERA = "camera"
+# Część WORKER_STOP_TIMEOUT zostawiana po obróbce nagrań na zamknięcie puli twarzy i wysyłek
+STOP_RESERVE = 15
 
 setup_logging()
 logger = get_logger("worker")
 
 
+
+def parse_cameras(value):
+    """CAMERAS -> lista (nazwa, adres strumienia)"""
+    cameras = []
+    for entry in value.split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, url = entry.partition("=")
+        if not sep or not name.strip() or not url.strip():
+            raise ValueError(f"Niepoprawny wpis CAMERAS: {entry}")
+        cameras.append((name.strip(), url.strip()))
+    return cameras
+
+
+def camera_path(path, camera_id):
+    """Osobny plik dla każdej kamery poza domyślną: /tmp/x.pid -> /tmp/x.front.pid"""
+    if not path or camera_id == DEFAULT_CAMERA:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{camera_id}{ext}"
+
+
+class CameraMetrics:
+    """Czasy etapów gorącej ścieżki, z etykietą kamery"""
+
+    def __init__(self, camera_id):
+        labels = {"camera": camera_id}
+        self.capture_read = metrics.histogram("watchdog_capture_read_seconds", "Odczyt i dekodowanie klatki", labels)
+        self.capture_frames = metrics.counter("watchdog_capture_frames_total", "Odczytane klatki", labels)
+        self.frame_drops = metrics.counter("watchdog_frame_drops_total", "Klatki nadpisane przed detekcją ruchu", labels)
+        self.motion_resize = metrics.histogram("watchdog_motion_resize_seconds", "Skalowanie i konwersja do szarości", labels)
+        self.motion_blur = metrics.histogram("watchdog_motion_blur_seconds", "GaussianBlur klatki ruchu", labels)
+        self.motion_diff = metrics.histogram("watchdog_motion_diff_seconds", "Silnik detekcji ruchu", labels)
+        self.motion_check = metrics.histogram("watchdog_motion_check_seconds", "Cała próbka ruchu (bez uśpienia)", labels)
+        self.motion_step_overruns = metrics.counter(
+            "watchdog_motion_step_overruns_total", "Próbki ruchu dłuższe niż limit harmonogramu", labels
+        )
+        self.face_detect = metrics.histogram("watchdog_face_detect_seconds", "MediaPipe w wątku ruchu", labels)
+        self.face_encode = metrics.histogram("watchdog_face_encode_seconds", "Kodowanie JPEG twarzy", labels)
+        self.faces_sent = metrics.counter("watchdog_faces_sent_total", "Zdjęcia twarzy przekazane do wysyłki", labels)
+        self.faces_suppressed = metrics.counter(
+            "watchdog_faces_suppressed_total", "Zdjęcia twarzy pominięte jako duplikaty", labels
+        )
+        self.recordings = metrics.counter("watchdog_recordings_total", "Rozpoczęte nagrania", labels)
+        self.ffmpeg_spawns = metrics.counter(
+            "watchdog_ffmpeg_spawns_total", "Uruchomienia procesów ffmpeg", {"role": "recording", **labels}
+        )
+        self.capture_stalls = metrics.counter("watchdog_capture_stalls_total", "Zawieszenia strumienia", labels)
+        self.capture_reconnects = metrics.counter(
+            "watchdog_capture_reconnects_total", "Nieudane próby otwarcia strumienia", labels
+        )
+        self.capture_recovery = metrics.histogram(
+            "watchdog_capture_recovery_seconds", "Czas bez klatek do odzyskania strumienia", labels,
+            buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+        )
+
+
+class SharedServices:
+    """Usługi wspólne dla wszystkich kamer procesu: wysyłka, metryki, pula twarzy"""
+
+    def __init__(self, face_workers=FACE_WORKERS):
+        # Wysyłka na serwer w tle, z kolejką na dysku
+        self.uploader = UploadSpool()
+        # Pliki nagrań na serwer, w kawałkach i z limitem przepustowości
+        self.video_uploader = VideoUploader() if VIDEO_UPLOAD else None
+        # Liczniki i histogramy etapów (/metrics lub plik)
+        self.metrics_exporter = MetricsExporter()
+
+        # MediaPipe w osobnych procesach; 0 = każda kamera wykrywa twarze u siebie
+        self.face_pool = None
+        if face_workers > 0:
+            try:
+                self.face_pool = FaceDetectionPool(workers=face_workers)
+            except Exception as e:
+                logger.error(f"Błąd uruchamiania puli detekcji twarzy: {e}")
+
+    def start(self):
+        if self.metrics_exporter.enabled():
+            try:
+                self.metrics_exporter.start()
+            except OSError as e:
+                logger.error(f"Nie udało się uruchomić eksportu metryk: {e}")
+        self.uploader.start()
+        if self.video_uploader:
+            self.video_uploader.start()
+
+    def stop(self):
+        if self.face_pool:
+            self.face_pool.close()
+        self.uploader.stop()
+        if self.video_uploader:
+            self.video_uploader.stop()
+        if self.metrics_exporter.enabled():
+            self.metrics_exporter.stop()
+
+
 class MotionRecorder:
-    def __init__(self):
+    def __init__(self, stream_url=STREAM_URL, camera_id=DEFAULT_CAMERA, output_dir=OUTPUT_DIR,
+                 shared=None):
+        """
+        Args:
+            camera_id: nazwa kamery (etykieta metryk, nazwy plików)
+            output_dir: katalog nagrań tej kamery
+            shared: SharedServices wspólne dla kilku kamer; None = własne
+        """
+        self.stream_url = stream_url
+        self.camera_id = camera_id
+        self.logger = logger if camera_id == DEFAULT_CAMERA else get_logger(f"worker.{camera_id}")
+        self.metrics = CameraMetrics(camera_id)
+        self.timeline = StartupTimeline(camera_id, self.logger)
+        
+        # Katalogi i pliki tej kamery
+        self.output_dir = output_dir
+        self.face_output_dir = os.path.join(output_dir, "faces")
+        os.makedirs(self.face_output_dir, exist_ok=True)
+        self.pid_file = camera_path(PID_FILE, camera_id)
+        # Pozostałe procesy ffmpeg: /tmp/record_ffmpeg.pid -> /tmp/record_ffmpeg.segments.pid itd.
+        self.segments_pid_file = camera_path(self.pid_file, "segments")
+        self.preroll_pid_file = camera_path(self.pid_file, "preroll")
+        self.capture_pid_file = camera_path(self.pid_file, "capture")
+        
+        self.owns_shared = shared is None
+        self.shared = shared or SharedServices()
         self.recording = False
         self.ffmpeg_proc = None
         
         # W¹tki
         self.capture_thread = None
         self.motion_thread = None
+        self.catalog_thread = None
         
         # Flagi zatrzymywania
         self.stop_capture = False
         self.stop_motion = False
         
         # Kolejki i stan
-        self.frame_queue = queue.Queue(maxsize=3)
-        self.frame_lock = threading.Lock()
+        self.capture = None
+        # Nadzór strumienia (czas monotoniczny): ostatnia klatka i początek przerwy
+        self.capture_stall_seconds = CAPTURE_STALL_SECONDS
+        self.last_frame_at = None
+        self.capture_lost_at = None
+        # Najnowsza klatka z przechwytywania i ostatnia przeanalizowana (dla podglądu)
+        self.frames = FrameMailbox()
+        self.frame_seq = 0
+        self.preview_frames = FrameMailbox()
+        self.preview_server = None
+        self.preview_port = PREVIEW_PORT
+        
+        # Zegar i tempo upływu czasu (podmieniane przy odtwarzaniu z pliku)
+        self.clock = time.time
+        self.time_scale = 1.0
+        
+        # Odstęp próbkowania ruchu dopasowywany do aktywności sceny
+        self.motion_interval = AdaptiveInterval()
+        self.motion_check_interval = self.motion_interval.interval
+        # Ostatnie wywołanie motion_step (z klatką lub bez) - podstawa bicia serca dla fathera
+        self.motion_polled_at = None
         
         # Stan detekcji
+        self.motion_frame_time = None
+        self.motion_roi = None
+        self.motion_roi_time = 0
         self.last_motion_time = None
         self.motion_detected_recently = False
+        self.motion_engine = create_motion_engine(MOTION_ENGINE)
+        self.logger.info(f"Silnik detekcji ruchu: {self.motion_engine.name}")
         
-        # Uruchom mediamtx
-        self.ensure_mediamtx_running()
-        self.ensure_mediapipe_running()
+        # Każda próbka ruchu w pierścieniowym pliku (do strojenia progu)
+        self.motion_log = None
+        motion_log_file = camera_path(MOTION_LOG_FILE, camera_id)
+        if motion_log_file:
+            try:
+                self.motion_log = MotionLog(motion_log_file)
+            except (OSError, ValueError) as e:
+                self.logger.error(f"Nie udało się otworzyć {motion_log_file}: {e}")
+        
+        # mediamtx sprawdza wątek przechwytywania, MediaPipe ładuje się w tle po starcie -
+        # detekcja ruchu rusza, gdy tylko strumień się otworzy
+        self.face_detection = None
+        self.face_pool = None
+        self.face_loader = None
+        if self.shared.face_pool:
+            # MediaPipe działa w osobnych procesach, wątek ruchu tylko zleca klatki
+            self.face_pool = self.shared.face_pool.client(self.camera_id, self.on_pool_faces)
 
+        self.last_face_check = 0
         self.last_face_save = datetime.min
+        # Licznik zmieniają wątek ruchu i wątek wyników puli twarzy
+        self.face_count_lock = threading.Lock()
         self.curent_detected_faces = 0
+        self.face_dedup = FaceDeduplicator() if FACE_DEDUP else None
+        self.face_selector = BestShotSelector() if FACE_WINDOW_SECONDS > 0 else None
+
+        self.uploader = self.shared.uploader
+        self.video_uploader = self.shared.video_uploader
+        # Katalog nagrań i sprzątanie dysku
+        if output_dir == OUTPUT_DIR:
+            self.catalog = RecordingCatalog()
+        else:
+            self.catalog = RecordingCatalog(os.path.join(output_dir, "recordings.db"))
+        # Sonda, faststart, miniatura i metadane nagrania po jego zakończeniu
+        self.finalizer = RecordingFinalizer(
+            self.uploader, catalog=self.catalog, video_uploader=self.video_uploader
+        )
+
+        # Tryb ciągły: zdarzenia to tylko wpisy w indeksie segmentów
+        self.segment_store = None
+        if RECORDING_MODE == "segments":
+            if output_dir == OUTPUT_DIR:
+                self.segment_store = SegmentStore(self.stream_url, pid_file=self.segments_pid_file)
+            else:
+                self.segment_store = SegmentStore(
+                    self.stream_url, os.path.join(output_dir, "segments"), pid_file=self.segments_pid_file
+                )
+        self.recording_started_at = None
+        # Segmenty i kolejka wysyłek zajmują ten sam dysk - retencja usuwa je
+        # razem z nagraniami, od najstarszych
+        self.retention = RetentionManager(
+            self.catalog, output_dir, self.face_output_dir,
+            stores=(self.segment_store, self.uploader),
+        )
+
+        # Bufor ostatnich sekund strumienia (0 = nagrywanie startuje od wykrycia ruchu)
+        self.preroll = None
+        if PREROLL_SECONDS > 0 and not self.segment_store:
+            self.preroll = PrerollBuffer(self.stream_url, pid_file=self.preroll_pid_file)
 
     def ensure_mediapipe_running(self):
-        try:
-            self.mp_face_detection = mp.solutions.face_detection
-            self.face_detection = self.mp_face_detection.FaceDetection(
-                model_selection=0,  # 0 = short range (szybszy), 1 = full range
-                min_detection_confidence=0.5
-            )
-            logger.info("MediaPipe Face Detection zainicjalizowany")
-        except Exception as e:
-            logger.error(f"B³¹d inicjalizacji MediaPipe: {e}")
-            self.face_detection = None
+        """Tworzy detektor twarzy w tle (raz) - import mediapipe i graf nie blokują wątku ruchu"""
+        if self.face_loader is not None:
+            return
         
+        def load():
+            started = time.perf_counter()
+            try:
+                self.face_detection = create_face_detector()
+            except Exception as e:
+                self.logger.error(f"Błąd inicjalizacji MediaPipe: {e}")
+                return
+            self.timeline.mark("face_detector_ready")
+            self.logger.info(f"MediaPipe Face Detection zainicjalizowany ({time.perf_counter() - started:.1f}s)")
+        
+        self.face_loader = threading.Thread(target=load, daemon=True)
+        self.face_loader.start()
+
+    def face_detection_ready(self):
+        """Czy można wykrywać twarze; za pierwszym razem zaczyna ładować detektor w tle"""
+        if self.face_pool is not None:
+            if self.face_pool.ready_at is not None:
+                self.timeline.mark("face_detector_ready", self.face_pool.ready_at)
+            return True
+        if self.face_detection is None:
+            self.ensure_mediapipe_running()
+            return False
+        return True
 
     def ensure_mediamtx_running(self, max_retries=3, wait_time=2):
         """
@@ -105,14 +353,14 @@ class MotionRecorder:
                 )
                 return bool(result.stdout.strip())
             except Exception as e:
-                logger.error(f"worker ---- Błąd sprawdzania mediamtx: {e}")
+                self.logger.error(f"worker ---- Błąd sprawdzania mediamtx: {e}")
                 return False
         
         if is_mediamtx_running():
-            logger.info("MediaMTX już działa")
+            self.logger.info("MediaMTX już działa")
             return True
         
-        logger.info("MediaMTX nie działa, uruchamiam...")
+        self.logger.info("MediaMTX nie działa, uruchamiam...")
         
         for attempt in range(1, max_retries + 1):
             try:
@@ -124,364 +372,778 @@ class MotionRecorder:
                     start_new_session=True
                 )
                 
-                logger.info(f"MediaMTX uruchomiony (PID: {process.pid}), czekam {wait_time}s...")
+                self.logger.info(f"MediaMTX uruchomiony (PID: {process.pid}), czekam {wait_time}s...")
                 time.sleep(wait_time)
                 
                 if is_mediamtx_running():
-                    logger.info("MediaMTX działa poprawnie")
+                    self.logger.info("MediaMTX działa poprawnie")
                     return True
                 else:
-                    logger.warning(f"MediaMTX nie działa po uruchomieniu (próba {attempt}/{max_retries})")
+                    self.logger.warning(f"MediaMTX nie działa po uruchomieniu (próba {attempt}/{max_retries})")
                     
             except Exception as e:
-                logger.error(f"Błąd podczas uruchamiania mediamtx (próba {attempt}/{max_retries}): {e}")
+                self.logger.error(f"Błąd podczas uruchamiania mediamtx (próba {attempt}/{max_retries}): {e}")
         
         error_msg = f"Nie udało się uruchomić MediaMTX po {max_retries} próbach"
-        logger.error(f"{error_msg}")
+        self.logger.error(f"{error_msg}")
         raise RuntimeError(error_msg)
 
 
     def start_ffmpeg_recording(self):
         if self.recording:
             return
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
         ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        self.current_output_file = os.path.join(OUTPUT_DIR, f"motion_rec_{ts}.mp4")
+        self.current_output_file = os.path.join(self.output_dir, f"motion_rec_{ts}.mp4")
+        self.recording_started_at = time.time()
+        self.recording_started_iso = datetime.now().isoformat()
         try:
-            cmd = [
-                "ffmpeg", 
-                "-rtsp_transport", "tcp",
-                "-i", STREAM_URL,
-                "-c:v", "copy",
-                "-avoid_negative_ts", "make_zero",
-                "-fflags", "+genpts",
-                self.current_output_file
-            ]
-            
-            self.ffmpeg_proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                preexec_fn=os.setsid
-            )
-            with open(PID_FILE, "w") as f:
-                f.write(str(self.ffmpeg_proc.pid))
+            if self.segment_store:
+                # Segmenty nagrywają się cały czas - plik powstanie po zakończeniu zdarzenia
+                self.ffmpeg_proc = None
+            elif self.preroll:
+                self.ffmpeg_proc = self.preroll.start_recording(self.current_output_file)
+            else:
+                cmd = [
+                    "ffmpeg", 
+                    "-rtsp_transport", "tcp",
+                    "-i", self.stream_url,
+                    "-c:v", "copy",
+                    "-avoid_negative_ts", "make_zero",
+                    "-fflags", "+genpts",
+                    self.current_output_file
+                ]
+                
+                self.metrics.ffmpeg_spawns.inc()
+                # Bez własnej sesji - SIGKILL grupy workera kończy też nagrywanie
+                self.ffmpeg_proc = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+            if self.ffmpeg_proc:
+                with open(self.pid_file, "w") as f:
+                    f.write(str(self.ffmpeg_proc.pid))
+            self.catalog.add(self.current_output_file, self.recording_started_at)
+            self.metrics.recordings.inc()
             self.recording = True
-            logger.info(f"Nagrywanie rozpoczête: {self.current_output_file}")
-
-            data = {
-                'file_path': os.path.basename(cmd[-1]),
-                'recorded_at': datetime.now().isoformat(),
-                'record_length': 1111
-            }
-
-            headers = {
-                'X-Device-UID': DEVICE_UID,
-                'Content-Type': 'application/json'
-            }
-
-            response = requests.post(
-                REMOTE_SERVER_URL + 'videos/save-info-about-video/',
-                json=data,
-                headers=headers,
-                timeout=10
-            )
-            logger.info(f'start {response}')
-            response.raise_for_status()
+            self.logger.info(f"Nagrywanie rozpoczête: {self.current_output_file}")
+            # Metadane wysyła finalizer po zakończeniu nagrania, z rzeczywistą długością
         except Exception as e:
-            logger.error(f"B³¹d startu nagrywania, w lini: {sys.exc_info()[2].tb_lineno}, komunikat b³êdu: {str(e)}")
+            self.logger.error(f"B³¹d startu nagrywania, w lini: {sys.exc_info()[2].tb_lineno}, komunikat b³êdu: {str(e)}")
 
     def stop_ffmpeg_recording(self):
-        self.curent_detected_faces = 0
+        with self.face_count_lock:
+            self.curent_detected_faces = 0
 
-        if not self.recording or not self.ffmpeg_proc:
+        if not self.recording:
+            return
+        if self.segment_store:
+            self.stop_segment_event()
+            return
+        if not self.ffmpeg_proc:
             return
         try:
-            self.ffmpeg_proc.terminate()
-            self.ffmpeg_proc.wait(timeout=3)
+            if self.preroll:
+                if self.preroll.stop_recording() is False:
+                    self.logger.error(f"Zapis nagrania przerwany - plik może być niekompletny: {self.current_output_file}")
+            else:
+                self.ffmpeg_proc.terminate()
+                self.ffmpeg_proc.wait(timeout=3)
         except subprocess.TimeoutExpired:
-            os.killpg(os.getpgid(self.ffmpeg_proc.pid), signal.SIGKILL)
+            self.ffmpeg_proc.kill()
+            self.ffmpeg_proc.wait()
         except Exception as e:
-            logger.error(f"B³¹d zatrzymywania nagrywania: {e}")
+            self.logger.error(f"B³¹d zatrzymywania nagrywania: {e}")
         
-        if os.path.exists(PID_FILE):
+        if os.path.exists(self.pid_file):
             try: 
-                os.remove(PID_FILE)
+                os.remove(self.pid_file)
             except: 
                 pass
         
         self.recording = False
-        logger.info(f"Nagrywanie zatrzymane: {self.current_output_file}")
+        self.logger.info(f"Nagrywanie zatrzymane: {self.current_output_file}")
         self.ffmpeg_proc = None
+        self.finalizer.submit(self.current_output_file, self.recording_started_iso)
+
+    def stop_segment_event(self):
+        start = self.recording_started_at - PREROLL_SECONDS
+        end = time.time()
+        self.segment_store.mark_event(self.recording_started_at, end)
+        self.recording = False
+        self.logger.info(f"Zdarzenie zakończone, wycinanie: {self.current_output_file}")
+
+        # Wycięcie czeka na zamknięcie ostatniego segmentu - w puli finalizera
+        output_file = self.current_output_file
+        self.finalizer.submit(
+            output_file,
+            self.recording_started_iso,
+            prepare=lambda: self.segment_store.clip(start, end, output_file),
+        )
 
     def save_face(self, face_img):
         if face_img is None or face_img.size == 0:
             return
         
-        self.curent_detected_faces += 1
-
         try:
-            success, encoded_image = cv2.imencode(".jpg", face_img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            with self.metrics.face_encode.time():
+                success, encoded_image = cv2.imencode(".jpg", face_img, [cv2.IMWRITE_JPEG_QUALITY, 85])
             if not success:
-                logger.info("Blad enkodowania zdjecia")
+                self.logger.info("Blad enkodowania zdjecia")
                 return
             
             image_bytes = encoded_image.tobytes()
             
-            files = {
-                "file": (f"{datetime.now().isoformat()}.jpg", image_bytes, "image/jpeg")
-            }
-            
             data = {
                 'recorded_at': datetime.now().isoformat()
             }
-            
-            headers = {
-                'X-Device-UID': DEVICE_UID
-            }
 
-            response = requests.post(
-                REMOTE_SERVER_URL + 'analyze/upload-face-to-analyze/',
-                data=data,
-                files=files,
-                headers=headers,
-                timeout=10
+            self.uploader.enqueue_file(
+                'analyze/upload-face-to-analyze/',
+                data,
+                image_bytes,
+                f"{data['recorded_at']}.jpg",
+                "image/jpeg"
             )
-            logger.info(f'face: {response}')
-            response.raise_for_status()
         except Exception as e:
-            logger.error(f"Błd podczas wysy³ki: {e}")
+            self.logger.error(f"Błd podczas wysy³ki: {e}")
 
-    def capture_frames(self):
-        """W¹tek tylko do czytania klatek"""
-        cap = cv2.VideoCapture(STREAM_URL, cv2.CAP_FFMPEG)
-        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    def open_capture(self):
+        if CAPTURE_BACKEND == "ffmpeg_pipe":
+            return FFmpegPipeCapture(self.stream_url, pid_file=self.capture_pid_file)
+        if CAPTURE_BACKEND == "opencv_lazy":
+            return LazyOpenCVCapture(self.stream_url)
+        cap = open_opencv_capture(self.stream_url)
         cap.set(cv2.CAP_PROP_FPS, 25)
-        
-        if not cap.isOpened():
-            logger.error("B³¹d otwarcia strumienia!")
-            return
+        return cap
+
+    def capture_sleep(self, seconds):
+        """Uśpienie przerywane przez stop_capture"""
+        deadline = time.monotonic() + seconds
+        while not self.stop_capture and time.monotonic() < deadline:
+            time.sleep(min(0.2, deadline - time.monotonic()))
 
-        logger.info("Start przechwytywania klatek...")
+    def capture_frames(self):
+        """
+        Wątek czytania klatek z nadzorem: strumień, który się nie otworzył,
+        zerwał lub przestał dostarczać klatki, jest otwierany ponownie
+        z wykładniczym odstępem; co CAPTURE_MEDIAMTX_AFTER prób sprawdzany jest mediamtx.
+        """
+        self.logger.info("Start przechwytywania klatek...")
+        try:
+            self.ensure_mediamtx_running()
+        except RuntimeError:
+            pass
+        self.timeline.mark("mediamtx")
+        failures = 0
         
         while not self.stop_capture:
             try:
-                ret, frame = cap.read()
-                if not ret or frame is None:
-                    time.sleep(0.1)
-                    continue
-                
-                if frame.shape[0] < 100 or frame.shape[1] < 100:
+                cap = self.open_capture()
+            except Exception as e:
+                self.logger.error(f"Błąd tworzenia przechwytywania: {e}")
+                cap = None
+            
+            if cap is not None and cap.isOpened():
+                self.capture = cap
+                self.timeline.mark("stream_open")
+                if self.read_frames(cap):
+                    failures = 0
                     continue
-                
+            elif cap is not None:
+                cap.release()
+            
+            if self.stop_capture:
+                break
+            
+            failures += 1
+            self.metrics.capture_reconnects.inc()
+            if self.capture_lost_at is None:
+                self.capture_lost_at = time.monotonic()
+            if CAPTURE_MEDIAMTX_AFTER and failures % CAPTURE_MEDIAMTX_AFTER == 0:
                 try:
-                    self.frame_queue.put(frame, block=False)
-                except queue.Full:
-                    try:
-                        self.frame_queue.get_nowait()
-                        self.frame_queue.put(frame, block=False)
-                    except queue.Empty:
-                        pass
-                
+                    self.ensure_mediamtx_running()
+                except RuntimeError:
+                    pass
+            
+            delay = reconnect_delay(failures)
+            self.logger.error(
+                f"Strumień niedostępny (próba {failures}, bez obrazu od "
+                f"{time.monotonic() - self.capture_lost_at:.0f}s) - ponowne otwarcie za {delay:.1f}s"
+            )
+            self.capture_sleep(delay)
+        
+        self.logger.info("Przechwytywanie zakoñczone")
+
+    def read_frames(self, cap):
+        """
+        Czyta klatki z otwartego `cap` do zatrzymania albo zawieszenia strumienia
+        (brak klatek dłużej niż capture_stall_seconds), potem zwalnia `cap`.
+        
+        Returns:
+            True jeśli dotarła choć jedna klatka
+        """
+        lazy = getattr(cap, "lazy", False)
+        opened_at = time.monotonic()
+        got_frame = False
+        
+        while not self.stop_capture:
+            try:
+                if lazy:
+                    # Tylko grab() - dekodowanie do BGR robi next_frame() na żądanie
+                    ok, frame = cap.grab(self.clock()), None
+                else:
+                    with self.metrics.capture_read.time():
+                        ret, frame = cap.read()
+                    ok = ret and frame is not None
             except Exception as e:
-                logger.error(f"B³¹d przechwytywania: {e}")
-                time.sleep(1)
+                self.logger.error(f"B³¹d przechwytywania: {e}")
+                ok = False
+            
+            now = time.monotonic()
+            if not ok:
+                waiting = now - (self.last_frame_at if got_frame else opened_at)
+                if waiting > self.capture_stall_seconds:
+                    if got_frame:
+                        self.metrics.capture_stalls.inc()
+                        self.capture_lost_at = self.last_frame_at
+                    self.logger.warning(f"Brak klatek od {waiting:.1f}s - ponowne otwarcie strumienia")
+                    break
+                time.sleep(0.1)
+                continue
+            
+            self.last_frame_at = now
+            if not got_frame:
+                got_frame = True
+                if self.capture_lost_at is not None:
+                    recovery = now - self.capture_lost_at
+                    self.metrics.capture_recovery.observe(recovery)
+                    self.logger.info(f"Strumień odzyskany po {recovery:.1f}s bez obrazu")
+                    self.capture_lost_at = None
+                self.timeline.mark("first_frame")
+            
+            if lazy or frame.shape[0] < 100 or frame.shape[1] < 100:
+                continue
+            
+            self.metrics.capture_frames.inc()
+            self.frames.put((self.clock(), frame))
         
         cap.release()
-        logger.info("Przechwytywanie zakoñczone")
+        return got_frame
+
+    def next_frame(self, timeout=1):
+        """Najnowsza klatka jako (czas_przechwycenia, klatka) albo None po `timeout` s"""
+        if getattr(self.capture, "lazy", False):
+            frame_time, frame = self.capture.retrieve(timeout=timeout)
+            if frame is None or frame.shape[0] < 100 or frame.shape[1] < 100:
+                return None
+            return frame_time, frame
+        
+        seq, item = self.frames.wait(self.frame_seq, timeout)
+        if item is None:
+            return None
+        if self.frame_seq and seq > self.frame_seq + 1:
+            self.metrics.frame_drops.inc(seq - self.frame_seq - 1)
+        self.frame_seq = seq
+        return item
 
     def motion_detection(self):
         """W¹tek detekcji ruchu - dzia³a rzadziej"""
-        logger.info("Start detekcji ruchu...")
-        
-        prev_motion_frame = None
-        last_face_check = 0
+        self.logger.info("Start detekcji ruchu...")
         
         while not self.stop_motion:
             try:
-                try:
-                    frame = self.frame_queue.get(timeout=1)
-                    while not self.frame_queue.empty():
-                        try:
-                            frame = self.frame_queue.get_nowait()
-                        except queue.Empty:
-                            break
-                except queue.Empty:
-                    continue
-                
-                current_time = time.time()
-                if current_time - last_face_check > FACE_SCAN_TIME:
-                    full_frame = cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT))
-                    with self.frame_lock:
-                        self.preview_frame = full_frame.copy()
-                    last_face_check = current_time
-                    
-                    if self.motion_detected_recently and self.face_detection is not None:
-                        if self.curent_detected_faces <= MAX_DETECTIONS:
-                            self.detect_faces_mediapipe(full_frame)
+                if self.motion_step():
+                    time.sleep(self.motion_check_interval / self.time_scale)
+            except Exception as e:
+                self.logger.error(f"B³¹d detekcji ruchu: {e}")
+                time.sleep(1)
+        
+        self.logger.info("Detekcja ruchu zatrzymana")
+
+    def motion_step(self, timeout=1):
+        """
+        Jedna próbka ruchu na najnowszej klatce (wątek ruchu lub MotionScheduler).
+        
+        Returns:
+            False gdy w ciągu `timeout` nie było nowej klatki
+        """
+        self.motion_polled_at = time.monotonic()
+        item = self.next_frame(timeout)
+        if item is None:
+            return False
+        
+        self.motion_frame_time, frame = item
+        check_started = time.perf_counter()
+        current_time = self.clock()
+        # Podgląd dostaje tylko referencję - kodowanie JPEG robi serwer podglądu
+        self.preview_frames.put(frame)
+        
+        if current_time - self.last_face_check > FACE_SCAN_TIME:
+            full_frame = self.full_resolution_frame(frame)
+            # Bez aktualnej pełnej klatki kolejna próba przy następnej próbce ruchu
+            if full_frame is not None:
+                self.last_face_check = current_time
                 
+                # face_detection_ready() także przy braku ruchu - detektor ładuje się zawczasu
+                if self.face_detection_ready() and self.motion_detected_recently:
+                    if self.curent_detected_faces < MAX_DETECTIONS:
+                        self.detect_faces_mediapipe(full_frame)
+        
+        if frame.ndim == 2 and frame.shape == (MOTION_HEIGHT, MOTION_WIDTH):
+            # ffmpeg już przeskalował i przekonwertował klatkę
+            motion_gray = frame
+        else:
+            with self.metrics.motion_resize.time():
                 motion_frame = cv2.resize(frame, (MOTION_WIDTH, MOTION_HEIGHT))
                 motion_gray = cv2.cvtColor(motion_frame, cv2.COLOR_BGR2GRAY)
-                motion_gray = cv2.GaussianBlur(motion_gray, (5, 5), 0)
-                
-                if prev_motion_frame is not None:
-                    diff = cv2.absdiff(prev_motion_frame, motion_gray)
-                    _, thresh = cv2.threshold(diff, MOTION_SENSITIVITY, 255, cv2.THRESH_BINARY)
-                    
-                    motion_pixels = cv2.countNonZero(thresh)
-                    motion_ratio = motion_pixels / (MOTION_WIDTH * MOTION_HEIGHT)
-                    motion_detected = motion_ratio > MOTION_RATIO_THRESHOLD
-                    
-                    now = datetime.now()
-                    
-                    if motion_detected:
-                        if not self.motion_detected_recently:
-                            logger.info(f"RUCH: {motion_ratio:.2%}")
-                        self.last_motion_time = now
-                        self.motion_detected_recently = True
-                        if not self.recording:
-                            self.start_ffmpeg_recording()
-                    else:
-                        if self.motion_detected_recently and self.last_motion_time:
-                            if (now - self.last_motion_time).total_seconds() > RECORDING_AFTER_MOTION:
-                                self.motion_detected_recently = False
-                                logger.info("Brak ruchu")
-                    
-                    if self.recording and self.last_motion_time and not self.motion_detected_recently:
-                        if (now - self.last_motion_time).total_seconds() > RECORDING_AFTER_MOTION:
-                            self.stop_ffmpeg_recording()
-                            self.last_motion_time = None
-                
-                prev_motion_frame = motion_gray.copy()
-                time.sleep(MOTION_CHECK_INTERVAL)
-                
-            except Exception as e:
-                logger.error(f"B³¹d detekcji ruchu: {e}")
-                time.sleep(1)
+        with self.metrics.motion_blur.time():
+            motion_gray = cv2.GaussianBlur(motion_gray, (5, 5), 0)
         
-        logger.info("Detekcja ruchu zatrzymana")
+        with self.metrics.motion_diff.time():
+            motion_ratio, motion_mask = self.motion_engine.process(motion_gray)
+        if self.motion_log:
+            self.motion_log.append(
+                current_time, motion_ratio, self.recording,
+                motion_ratio > MOTION_RATIO_THRESHOLD
+            )
+        if motion_mask is not None:
+            motion_detected = motion_ratio > MOTION_RATIO_THRESHOLD
+            
+            now = datetime.fromtimestamp(current_time)
+            
+            if motion_detected:
+                if not self.motion_detected_recently:
+                    self.logger.info(f"RUCH: {motion_ratio:.2%}")
+                self.last_motion_time = now
+                self.motion_detected_recently = True
+                roi = motion_bbox(motion_mask)
+                if roi:
+                    self.motion_roi = roi
+                    self.motion_roi_time = current_time
+                if not self.recording:
+                    self.start_ffmpeg_recording()
+            else:
+                if self.motion_detected_recently and self.last_motion_time:
+                    if (now - self.last_motion_time).total_seconds() > RECORDING_AFTER_MOTION:
+                        self.motion_detected_recently = False
+                        self.logger.info("Brak ruchu")
+            
+            self.flush_face_window(force=not self.motion_detected_recently)
+            
+            interval = self.motion_interval.update(
+                motion_ratio, self.motion_detected_recently, current_time
+            )
+            if interval != self.motion_check_interval:
+                self.logger.debug(f"Odstęp próbkowania ruchu: {interval:.2f}s")
+            self.motion_check_interval = interval
+            
+            if self.recording and self.last_motion_time and not self.motion_detected_recently:
+                if (now - self.last_motion_time).total_seconds() > RECORDING_AFTER_MOTION:
+                    self.stop_ffmpeg_recording()
+                    self.last_motion_time = None
+        
+        self.metrics.motion_check.observe(time.perf_counter() - check_started)
+        self.timeline.mark("first_motion_check")
+        return True
+
+    def full_resolution_frame(self, frame):
+        """
+        Klatka FRAME_WIDTH x FRAME_HEIGHT do wykrywania twarzy. Przy ffmpeg_pipe
+        pełna klatka z drugiego wyjścia albo None, gdy jeszcze nie dotarła lub
+        jest starsza od próbki ruchu - powiększona szara klatka nic by nie dała.
+        """
+        if getattr(self.capture, "scaled", False):
+            return self.capture.full_frame(not_before=self.motion_frame_time)
+        return cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT))
 
     def detect_faces_mediapipe(self, frame):
-        if self.face_detection is None:
+        if not self.face_detection_ready():
             return
         
-        now = datetime.now()
+        now = datetime.fromtimestamp(self.clock())
         if (now - self.last_face_save).total_seconds() < 3:
             return
         
+        full_shape = frame.shape[:2]
+        roi = self.face_roi(frame)
+        if roi:
+            x1, y1, x2, y2 = roi
+            frame = frame[y1:y2, x1:x2]
+        
+        if self.face_pool:
+            # Wynik wróci asynchronicznie do on_pool_faces
+            if not self.face_pool.submit(frame, (now, roi, full_shape)):
+                self.logger.info("Pula detekcji twarzy zajęta - pomijam klatkę")
+            return
+        
         try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = self.face_detection.process(rgb_frame)
-            
-            if results.detections:
-                for detection in results.detections:
-                    # MediaPipe: bounding box wzglêdny 01
-                    bboxC = detection.location_data.relative_bounding_box
-
-                    # Wymiary ma³ej klatki
-                    small_h, small_w = rgb_frame.shape[:2]
-
-                    # Skalowanie z ma³ej klatki do wspó³rzêdnych pikselowych w niej
-                    x_small = int(bboxC.xmin * small_w)
-                    y_small = int(bboxC.ymin * small_h)
-                    w_small = int(bboxC.width * small_w)
-                    h_small = int(bboxC.height * small_h)
-
-                    # Wymiary du¿ej klatki
-                    h, w = frame.shape[:2]
-
-                    # Skala powiêkszenia
-                    scale_x = w / small_w
-                    scale_y = h / small_h
-
-                    # Przeskalowanie wspó³rzêdnych do du¿ej klatki
-                    x = int(x_small * scale_x)
-                    y = int(y_small * scale_y)
-                    box_w = int(w_small * scale_x)
-                    box_h = int(h_small * scale_y)
-
-                    # Powiêkszenie bounding boxa
-                    scale_factor = 2
-
-                    cx = x + box_w // 2
-                    cy = y + box_h // 2
-
-                    new_w = int(box_w * scale_factor)
-                    new_h = int(box_h * scale_factor)
-
-                    # Wyznaczenie granic wycinka (z zabezpieczeniem przed wyjciem poza kadr)
-                    x1 = max(0, cx - new_w // 2)
-                    y1 = max(0, cy - new_h // 2)
-                    x2 = min(w, cx + new_w // 2)
-                    y2 = min(h, cy + new_h // 2)
-                    y2 = int(y2 * 1.5)
-                    # Wyciêcie twarzy
-                    face_img = frame[y1:y2, x1:x2]
-
-                    if face_img.size > 0:
-                        self.save_face(face_img)
-                        confidence = detection.score[0]
-                        logger.info(f"Twarz wykryta MediaPipe (confidence: {confidence:.2f})")
-                        break  # Tylko jedna twarz na raz
-                
-                self.last_face_save = now
-                
+            with self.metrics.face_detect.time():
+                faces = find_faces(self.face_detection, frame)
+            self.on_faces_detected(now, self.faces_to_full_frame(faces, roi, full_shape))
+        except Exception as e:
+            self.logger.error(f"B³¹d detekcji twarzy MediaPipe, w lini: {sys.exc_info()[2].tb_lineno}, komunikat b³êdu: {str(e)}")
+
+    def face_roi(self, frame):
+        """
+        Obszar ostatniego ruchu w pikselach pełnej klatki (x1, y1, x2, y2),
+        z marginesem i minimalnym rozmiarem, albo None gdy brak świeżego ruchu.
+        """
+        if not FACE_ROI or self.motion_roi is None:
+            return None
+        if self.clock() - self.motion_roi_time > max(3, 2 * self.motion_interval.ceiling):
+            return None
+        
+        h, w = frame.shape[:2]
+        rx1, ry1, rx2, ry2 = self.motion_roi
+        x1, x2 = (rx1 - FACE_ROI_MARGIN) * w, (rx2 + FACE_ROI_MARGIN) * w
+        y1, y2 = (ry1 - FACE_ROI_MARGIN) * h, (ry2 + FACE_ROI_MARGIN) * h
+        
+        # Za mały wycinek powiększany wokół środka
+        min_size = min(FACE_ROI_MIN_SIZE, w, h)
+        if x2 - x1 < min_size:
+            cx = (x1 + x2) / 2
+            x1, x2 = cx - min_size / 2, cx + min_size / 2
+        if y2 - y1 < min_size:
+            cy = (y1 + y2) / 2
+            y1, y2 = cy - min_size / 2, cy + min_size / 2
+        
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(w, int(x2)), min(h, int(y2))
+        if (x2 - x1) * (y2 - y1) >= 0.9 * w * h:
+            return None
+        return x1, y1, x2, y2
+
+    @staticmethod
+    def faces_to_full_frame(faces, roi, full_shape):
+        """Przelicza bounding boxy z wycinka ROI na współrzędne względne całej klatki"""
+        if not roi:
+            return faces
+        x1, y1, x2, y2 = roi
+        h, w = full_shape
+        roi_w, roi_h = x2 - x1, y2 - y1
+        return [
+            (
+                face_img,
+                confidence,
+                (
+                    (x1 + bx * roi_w) / w,
+                    (y1 + by * roi_h) / h,
+                    bw * roi_w / w,
+                    bh * roi_h / h,
+                ),
+            )
+            for face_img, confidence, (bx, by, bw, bh) in faces
+        ]
+
+    def on_pool_faces(self, meta, faces):
+        detected_at, roi, full_shape = meta
+        self.on_faces_detected(detected_at, self.faces_to_full_frame(faces, roi, full_shape))
+
+    def on_faces_detected(self, detected_at, faces):
+        if not faces:
+            return
+        self.last_face_save = detected_at
+        
+        if self.face_selector:
+            # Wysyłka dopiero po zamknięciu okna - flush_face_window
+            for face_img, confidence, bbox in faces:
+                self.face_selector.add(face_img, confidence, bbox, detected_at.timestamp())
+            return
+        
+        self.upload_faces(faces, detected_at, limit=1)  # Tylko jedna twarz na raz
+
+    def flush_face_window(self, force=False):
+        """Wysyła najlepsze twarze z okna, gdy minął jego czas (lub force przy końcu ruchu)"""
+        if not self.face_selector:
+            return
+        now = self.clock()
+        if not self.face_selector.ready(now) and not (force and self.face_selector.pending()):
+            return
+        best = self.face_selector.flush()
+        self.logger.info(f"Okno twarzy zamknięte, najlepsze ujęcia: {len(best)}")
+        self.upload_faces(best, datetime.fromtimestamp(now), limit=len(best))
+
+    def reserve_face_slot(self):
+        """Sprawdzenie limitu MAX_DETECTIONS i zwiększenie licznika w jednym kroku"""
+        with self.face_count_lock:
+            if self.curent_detected_faces >= MAX_DETECTIONS:
+                return False
+            self.curent_detected_faces += 1
+            return True
+
+    def upload_faces(self, faces, detected_at, limit):
+        sent = 0
+        for face_img, confidence, bbox in faces:
+            if sent >= limit or self.curent_detected_faces >= MAX_DETECTIONS:
+                break
+            if face_img is None or face_img.size == 0:
+                continue
+            if self.face_dedup and not self.face_dedup.should_send(bbox, face_img, detected_at.timestamp()):
+                self.metrics.faces_suppressed.inc()
+                continue
+            if not self.reserve_face_slot():
+                break
+            self.save_face(face_img)
+            self.metrics.faces_sent.inc()
+            self.logger.info(f"Twarz wykryta MediaPipe (confidence: {confidence:.2f})")
+            sent += 1
+
+    def healthy(self, max_age=3 * HEARTBEAT_INTERVAL):
+        """Czy pętla detekcji ruchu kręci się (brak klatek to nie zawieszenie - to obsługuje capture_frames)"""
+        return self.motion_polled_at is not None and time.monotonic() - self.motion_polled_at < max_age
+
+    def start_retention(self):
+        """Zamknięcie przerwanych nagrań, import wcześniejszych (skan OUTPUT_DIR) i retencja - w tle, bez opóźniania startu"""
+        try:
+            self.catalog.reconcile()
+            self.catalog.import_directory(self.output_dir)
         except Exception as e:
-            logger.error(f"B³¹d detekcji twarzy MediaPipe, w lini: {sys.exc_info()[2].tb_lineno}, komunikat b³êdu: {str(e)}")
+            self.logger.error(f"Błąd importu istniejących nagrań do katalogu: {e}")
+        if not self.stop_capture:
+            self.retention.start()
 
-    def start_motion_detection(self):
-        logger.info("Uruchamianie systemu...")
+    def start_motion_detection(self, motion_thread=True):
+        """
+        Args:
+            motion_thread: False gdy próbki ruchu zleca wspólny MotionScheduler
+        """
+        self.logger.info("Uruchamianie systemu...")
+        
+        # ffmpeg po poprzedniej kopii (zabitej SIGKILL) pisałby dalej na kartę
+        # i nagrywał segmenty pod tymi samymi nazwami co nowy mukser
+        for pid_file in (self.pid_file, self.segments_pid_file, self.preroll_pid_file, self.capture_pid_file):
+            if reap_pid_file(pid_file):
+                self.logger.warning(f"Zakończono ffmpeg pozostały po poprzednim workerze ({pid_file})")
         
         self.stop_capture = False
         self.stop_motion = False
         
+        if self.owns_shared:
+            self.shared.start()
+        self.catalog_thread = threading.Thread(target=self.start_retention, daemon=True)
+        self.catalog_thread.start()
+        if self.preview_port:
+            try:
+                self.preview_server = PreviewServer(self, port=self.preview_port)
+                self.preview_server.start()
+            except OSError as e:
+                self.logger.error(f"Nie udało się uruchomić podglądu na porcie {self.preview_port}: {e}")
+                self.preview_server = None
+        if self.segment_store:
+            self.segment_store.start()
+        if self.preroll:
+            self.preroll.start()
+        
         self.capture_thread = threading.Thread(target=self.capture_frames, daemon=True)
         self.capture_thread.start()
         
-        time.sleep(1)
+        if motion_thread:
+            # Bez czekania na strumień - motion_step czeka na pierwszą klatkę w skrzynce
+            self.motion_thread = threading.Thread(target=self.motion_detection, daemon=True)
+            self.motion_thread.start()
         
-        self.motion_thread = threading.Thread(target=self.motion_detection, daemon=True)
-        self.motion_thread.start()
-        
-        logger.info("System uruchomiony")
+        self.logger.info("System uruchomiony")
 
-    def stop_motion_detection(self):
-        logger.info("Zatrzymywanie systemu...")
+    def stop_motion_detection(self, deadline=None):
+        """
+        Args:
+            deadline: time.monotonic(), do kiedy worker musi się zamknąć
+                (domyślnie za WORKER_STOP_TIMEOUT s - potem father wysyła SIGKILL)
+        """
+        if deadline is None:
+            deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        self.logger.info("Zatrzymywanie systemu...")
         
         self.stop_capture = True
         self.stop_motion = True  
         
-        threads = [self.capture_thread, self.motion_thread]
+        threads = [self.capture_thread, self.motion_thread, self.catalog_thread]
         for thread in threads:
             if thread and thread.is_alive():
                 thread.join(timeout=3)
+        self.frames.clear()
+        
+        self.flush_face_window(force=True)
         
         if self.recording:
             self.stop_ffmpeg_recording()
         
+        if self.preroll:
+            self.preroll.stop()
+        
+        if self.motion_log:
+            self.motion_log.close()
+            self.motion_log = None
+        
+        # Zatrzymany mukser zamyka ostatni segment - wycięcie zdarzenia nie czeka na kolejny
+        if self.segment_store:
+            self.segment_store.stop()
+        
+        # Ostatnie nagranie musi trafić do kolejki wysyłek przed jej zatrzymaniem;
+        # reszta zamykania (pula twarzy, wysyłki) dostaje STOP_RESERVE s
+        self.finalizer.close(timeout=max(0.0, deadline - time.monotonic() - STOP_RESERVE))
+        self.retention.stop()
+        self.catalog.close()
+        
         if self.face_detection:
             self.face_detection.close()
         
-        logger.info("System zatrzymany")
+        if self.face_pool:
+            self.face_pool.close()
+        
+        if self.owns_shared:
+            self.shared.stop()
+        
+        if self.preview_server:
+            self.preview_server.stop()
+        
+        self.logger.info("System zatrzymany")
+
+
+class MotionScheduler:
+    """
+    Jeden wątek próbkowania ruchu dla wszystkich kamer.
+    
+    Kamery czekają w kopcu według terminu kolejnej próbki; każda ma własny
+    odstęp (AdaptiveInterval), więc spokojna kamera nie zabiera czasu aktywnej.
+    Klatka jest pobierana bez czekania (motion_step(timeout=0)), więc zawieszony
+    strumień jednej kamery nie wstrzymuje pozostałych; próbka dłuższa niż
+    `step_budget` s jest logowana i liczona jako przekroczenie.
+    """
+    
+    def __init__(self, recorders, idle_retry=0.05, step_budget=0.5):
+        self.recorders = recorders
+        self.idle_retry = idle_retry
+        self.step_budget = step_budget
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def _run(self):
+        logger.info(f"Harmonogram ruchu: {len(self.recorders)} kamer")
+        now = time.monotonic()
+        due = [(now, index) for index in range(len(self.recorders))]
+        heapq.heapify(due)
+        
+        while not self.stop_event.is_set():
+            when, index = heapq.heappop(due)
+            delay = when - time.monotonic()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            
+            recorder = self.recorders[index]
+            started = time.monotonic()
+            try:
+                # Bez czekania na klatkę - inne kamery nie mogą na to czekać
+                if recorder.motion_step(timeout=0):
+                    next_in = recorder.motion_check_interval / recorder.time_scale
+                else:
+                    next_in = self.idle_retry
+            except Exception as e:
+                recorder.logger.error(f"Błąd detekcji ruchu: {e}")
+                next_in = 1
+            took = time.monotonic() - started
+            if took > self.step_budget:
+                recorder.metrics.motion_step_overruns.inc()
+                recorder.logger.warning(
+                    f"Próbka ruchu trwała {took:.2f}s (limit {self.step_budget:.2f}s) - "
+                    f"opóźnia pozostałe kamery"
+                )
+            heapq.heappush(due, (time.monotonic() + next_in, index))
+        
+        logger.info("Harmonogram ruchu zatrzymany")
+    
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=3)
+
+
+class CameraGroup:
+    """Kilka kamer w jednym procesie: wspólne usługi, pula twarzy i harmonogram ruchu"""
+    
+    def __init__(self, cameras, output_dir=OUTPUT_DIR):
+        # Jedna pula MediaPipe na wszystkie kamery, dopasowana do liczby rdzeni
+        self.shared = SharedServices(face_workers=FACE_WORKERS or default_workers())
+        self.recorders = []
+        for index, (camera_id, stream_url) in enumerate(cameras):
+            recorder = MotionRecorder(
+                stream_url,
+                camera_id=camera_id,
+                output_dir=os.path.join(output_dir, camera_id),
+                shared=self.shared,
+            )
+            if PREVIEW_PORT:
+                recorder.preview_port = PREVIEW_PORT + index
+            self.recorders.append(recorder)
+        self.scheduler = MotionScheduler(self.recorders)
+    
+    def start(self):
+        self.shared.start()
+        for recorder in self.recorders:
+            recorder.start_motion_detection(motion_thread=False)
+        self.scheduler.start()
+    
+    def healthy(self):
+        return all(recorder.healthy() for recorder in self.recorders)
+    
+    def stop(self):
+        # Jeden limit na wszystkie kamery, nie po WORKER_STOP_TIMEOUT na każdą
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        self.scheduler.stop()
+        for recorder in self.recorders:
+            recorder.stop_motion_detection(deadline)
+        self.shared.stop()
 
 
 def signal_handler(signum, frame):
-    recorder.stop_motion_detection()
-    exit(0)
+    stop_worker()
+    # Wątki finalizera przerwanego po limicie są dołączane przy wyjściu
+    # interpretera - nie mogą przedłużyć zamykania; ich ffmpeg kończy father
+    logging.shutdown()
+    os._exit(0)
 
 
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     logger.info("worker --- start")
-    recorder = MotionRecorder()
-    recorder.start_motion_detection()
+    # Jedna kopia workera, niezależnie od tego, kto go uruchomił (father, gate_watcher, postman)
+    instance_lock = single_instance("worker")
+    if instance_lock is None:
+        logger.error("worker --- inna kopia już działa, kończę")
+        sys.exit(1)
+    heartbeat = Heartbeat("worker")
+    
+    cameras = parse_cameras(CAMERAS)
+    if cameras:
+        logger.info(f"Kamery: {', '.join(name for name, _ in cameras)}")
+        group = CameraGroup(cameras)
+        group.start()
+        stop_worker = group.stop
+        worker_healthy = group.healthy
+    else:
+        recorder = MotionRecorder()
+        recorder.start_motion_detection()
+        stop_worker = recorder.stop_motion_detection
+        worker_healthy = recorder.healthy
 
     try:
         while True:
             logger.info("worker --- loop")
-            time.sleep(10)
+            # Zawieszona detekcja ruchu = brak bicia serca, father zabije i uruchomi workera od nowa
+            if worker_healthy():
+                heartbeat.beat()
+            else:
+                logger.error("worker --- detekcja ruchu nie odpowiada")
+            time.sleep(HEARTBEAT_INTERVAL)
     except KeyboardInterrupt:
-        recorder.stop_motion_detection()
+        stop_worker()
     except Exception as e:
-        logger.info(f"{str(e)}") 
+        logger.info(f"{str(e)}")